@@ -0,0 +1,200 @@
+#!/usr/bin/env python3
+"""
+失敗時だけ保存する調査用の記録（DOM・スクリーンショット・Playwrightのトレース）
+
+実行中は画面の記録をメモリ上のリングバッファ（直近数件）に溜めるだけで、ディスクには書かない。
+実行が失敗したとき、または異常（表示されない対象日など）を検出したときにだけ、
+バッファの中身とトレースを1つのzip（圧縮）にまとめて保存する。
+保存先のディレクトリは合計サイズに上限があり、超えたら古いものから削除する。
+
+設定（環境変数）:
+  ARTIFACT_CAPTURE      failure: 失敗・異常時だけ保存（デフォルト） / always: 毎回保存 / off: 記録しない
+  ARTIFACT_DIR          保存先（デフォルト: CHECKER_STATE_DIR/artifacts）
+  ARTIFACT_DIR_MAX_MB   保存先の合計サイズの上限MB（デフォルト: 50）
+  ARTIFACT_BUFFER_SIZE  メモリに残す画面の記録の件数（デフォルト: 5）
+  ARTIFACT_TRACE        Playwrightのトレースを取るか（デフォルト: false。スクリーンショット付きで成功時も重いため、調査するときだけ true）
+"""
+
+import json
+import os
+import tempfile
+import time
+import traceback
+import zipfile
+from collections import deque
+from datetime import datetime
+
+from circuit_breaker import state_dir
+
+
+def capture_mode():
+    return os.getenv("ARTIFACT_CAPTURE", "failure").lower()
+
+
+def artifact_dir():
+    path = os.getenv("ARTIFACT_DIR") or os.path.join(state_dir(), "artifacts")
+    os.makedirs(path, exist_ok=True)
+    return path
+
+
+def evict(directory=None, max_bytes=None):
+    """保存先の合計サイズが上限を超えていたら、古いファイルから削除する。削除した件数を返す"""
+    directory = directory or artifact_dir()
+    if max_bytes is None:
+        max_bytes = float(os.getenv("ARTIFACT_DIR_MAX_MB", "50")) * 1024 * 1024
+
+    files = []
+    for name in os.listdir(directory):
+        path = os.path.join(directory, name)
+        if os.path.isfile(path):
+            stat = os.stat(path)
+            files.append((stat.st_mtime, stat.st_size, path))
+    files.sort()
+
+    total = sum(size for _, size, _ in files)
+    removed = 0
+    # 最新の1件は上限を超えていても残す
+    while total > max_bytes and len(files) - removed > 1:
+        _, size, path = files[removed]
+        os.remove(path)
+        total -= size
+        removed += 1
+    return removed
+
+
+class ArtifactRecorder:
+    """画面の記録をリングバッファに溜め、失敗・異常時だけzipに書き出す"""
+
+    def __init__(self, run_name, size=None):
+        self.run_name = run_name
+        self.mode = capture_mode()
+        self.trace_enabled = os.getenv("ARTIFACT_TRACE", "false").lower() == "true"
+        self.buffer = deque(maxlen=size or int(os.getenv("ARTIFACT_BUFFER_SIZE", "5")))
+        self.notes = []
+        self.anomalies = []
+        self._tracing = set()
+
+    @property
+    def enabled(self):
+        return self.mode != "off"
+
+    def _push(self, label, files):
+        self.buffer.append({"label": label, "time": datetime.now().isoformat(), "files": files})
+
+    def capture_page(self, page, label):
+        """Playwrightのページの DOM とスクリーンショットを記録する（失敗しても例外は出さない）"""
+        if not self.enabled:
+            return
+        files = {}
+        try:
+            files["url.txt"] = page.url.encode("utf-8")
+            files["dom.html"] = page.content().encode("utf-8")
+            files["screenshot.png"] = page.screenshot(full_page=False, timeout=5000)
+        except Exception as e:
+            files["capture_error.txt"] = str(e).encode("utf-8")
+        self._push(label, files)
+
+    def capture_driver(self, driver, label):
+        """Seleniumのドライバーの DOM とスクリーンショットを記録する（失敗しても例外は出さない）"""
+        if not self.enabled:
+            return
+        files = {}
+        try:
+            files["url.txt"] = driver.current_url.encode("utf-8")
+            files["dom.html"] = driver.page_source.encode("utf-8")
+            files["screenshot.png"] = driver.get_screenshot_as_png()
+        except Exception as e:
+            files["capture_error.txt"] = str(e).encode("utf-8")
+        self._push(label, files)
+
+    def capture_html(self, url, html, label):
+        """HTTPで取得したページ（URLとHTML）を記録する"""
+        if not self.enabled:
+            return
+        self._push(label, {"url.txt": url.encode("utf-8"), "dom.html": html.encode("utf-8")})
+
+    def note(self, text):
+        """ログ（例外のトレースバックなど）を記録する"""
+        self.notes.append(f"[{datetime.now().isoformat()}] {text}")
+
+    def note_exception(self, error):
+        self.note("".join(traceback.format_exception(type(error), error, error.__traceback__)))
+
+    def anomaly(self, reason):
+        """失敗ではないが調査が必要な状態を記録する（実行の最後に保存される）"""
+        self.anomalies.append(reason)
+        self.note(f"異常: {reason}")
+
+    def start_trace(self, context):
+        """Playwrightのcontextでトレースを開始する"""
+        if not (self.enabled and self.trace_enabled):
+            return
+        try:
+            context.tracing.start(screenshots=True, snapshots=True)
+            self._tracing.add(context)
+        except Exception as e:
+            self.note(f"トレースを開始できません: {e}")
+
+    def discard_trace(self, context):
+        """保存せずにトレースを止める（コンテキストを作り直すときなど）"""
+        if context in self._tracing:
+            self._tracing.discard(context)
+            try:
+                context.tracing.stop()
+            except Exception:
+                pass
+
+    def _stop_trace(self, context, path):
+        self._tracing.discard(context)
+        try:
+            context.tracing.stop(path=path)
+            return True
+        except Exception as e:
+            self.note(f"トレースを保存できません: {e}")
+            return False
+
+    def finish(self, failed, context=None, reason=None):
+        """実行の最後に呼ぶ。失敗・異常があれば（always なら常に）保存し、保存したzipのパスを返す"""
+        if not self.enabled:
+            return None
+        keep = failed or bool(self.anomalies) or self.mode == "always"
+        if not keep:
+            for traced in list(self._tracing):
+                self.discard_trace(traced)
+            return None
+
+        reason = reason or ("failure" if failed else ("anomaly" if self.anomalies else "always"))
+        directory = artifact_dir()
+        stamp = datetime.now().strftime("%Y%m%d-%H%M%S-%f")
+        path = os.path.join(directory, f"{stamp}_{self.run_name}_{reason}.zip")
+
+        with zipfile.ZipFile(path, "w", compression=zipfile.ZIP_DEFLATED) as archive:
+            archive.writestr("meta.json", json.dumps({
+                "run": self.run_name,
+                "reason": reason,
+                "failed": failed,
+                "anomalies": self.anomalies,
+                "saved_at": time.time(),
+            }, ensure_ascii=False, indent=2))
+            archive.writestr("notes.txt", "\n".join(self.notes))
+            for index, entry in enumerate(self.buffer):
+                prefix = f"{index:02d}_{entry['label']}"
+                for name, data in entry["files"].items():
+                    # PNG とトレースは圧縮済みなのでそのまま格納する
+                    compression = zipfile.ZIP_STORED if name.endswith(".png") else zipfile.ZIP_DEFLATED
+                    archive.writestr(f"{prefix}/{name}", data, compress_type=compression)
+
+            traced = [context] if context in self._tracing else []
+            traced += [other for other in list(self._tracing) if other is not context]
+            for index, traced_context in enumerate(traced):
+                fd, trace_path = tempfile.mkstemp(suffix=".zip", dir=directory)
+                os.close(fd)
+                try:
+                    if self._stop_trace(traced_context, trace_path):
+                        archive.write(trace_path, f"trace{index or ''}.zip", compress_type=zipfile.ZIP_STORED)
+                finally:
+                    os.remove(trace_path)
+
+        evict(directory)
+        print(f"🗂 調査用の記録を保存しました: {path}")
+        return path
@@ -0,0 +1,368 @@
+#!/usr/bin/env python3
+"""
+空き状況の履歴の集計（NumPy）
+
+history_store.py が記録した履歴を、スナップショット × 部屋 × 日付 × 時間帯 の配列に展開して集計する。
+集計はすべて配列演算で行い、1年分の30分間隔のスナップショットでも1秒かからない。
+保持期間（history_retention.py の HISTORY_FULL_DAYS）を過ぎたスナップショットは縮約されるので、
+ここで集計できるのは縮約されていない直近のスナップショットだけ。
+--since に縮約済みの日付を指定するとエラーにし、指定しなければ集計した期間の始まりを表示する。
+それより長い期間の推移は history_retention.py trend で見る。
+
+使い方:
+  python availability_analytics.py heatmap [--facility nishiogi]   # 曜日（祝日）× 時間帯の空き率
+  python availability_analytics.py rebook  [--facility nishiogi]   # キャンセルで空いた枠が埋まるまでの時間
+  python availability_analytics.py trends  [--facility nishiogi]   # 週ごと・曜日ごとの空き率の推移
+  共通オプション: --db 履歴ファイル  --since YYYY-MM-DD  --until YYYY-MM-DD  --json
+
+空き率 = 空きとして記録された回数 / その枠が表示されていた（予約期間内だった）回数
+表示されていたかどうかは、各スナップショットの日付から1か月先（SITE_PERIOD_MONTHS）までを対象日とみなして求める。
+
+必要なパッケージ: numpy（チェッカー本体には不要なので requirements.txt には含めていない）
+"""
+
+import argparse
+import json
+import sys
+import time
+from datetime import date, datetime, timedelta, timezone
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+import history_retention
+import history_store
+from jp_holidays import add_months, candidate_dates, is_holiday
+from suginami_slots import FACILITIES, SITE_PERIOD_MONTHS, hhmm_from_minutes
+
+JST = timezone(timedelta(hours=9))
+EPOCH_ORDINAL = date(1970, 1, 1).toordinal()
+# 曜日の区分（0=月曜〜6=日曜, 7=祝日）
+CATEGORY_NAMES = ["月", "火", "水", "木", "金", "土", "日", "祝"]
+HOLIDAY = 7
+
+
+def _epoch(day_text):
+    return int(datetime.combine(date.fromisoformat(day_text), datetime.min.time(), JST).timestamp())
+
+
+def _category(ordinals):
+    """日付の序数の配列 → 曜日の区分の配列（祝日は7）"""
+    days, inverse = np.unique(ordinals, return_inverse=True)
+    categories = (days - 1) % 7
+    holidays = np.fromiter((is_holiday(date.fromordinal(int(day))) for day in days), dtype=bool, count=len(days))
+    categories[holidays] = HOLIDAY
+    return categories[inverse.reshape(-1)]
+
+
+class FacilityHistory:
+    """1施設分の履歴の配列
+
+    snapshot_time[i], snapshot_day[i], horizon[i]: i番目のスナップショットの時刻・日付・表示期間の終わり（含まない）
+    cells[i]: そのときの表のセル数（空き・満室・その他・合計。記録がなければ NaN）
+    obs_*[k]: k番目の空き枠の記録（スナップショット番号・部屋番号・日付・時間帯番号）
+    """
+
+    def __init__(self, facility_key, rooms, bands, snapshots, observations):
+        self.facility_key = facility_key
+        self.rooms = rooms
+        self.bands = bands
+
+        self.snapshot_time = snapshots[:, 1].astype(np.int64)
+        self.snapshot_day = (self.snapshot_time + 9 * 3600) // 86400 + EPOCH_ORDINAL
+        horizon_of = {int(day): add_months(date.fromordinal(int(day)), SITE_PERIOD_MONTHS).toordinal()
+                      for day in np.unique(self.snapshot_day)}
+        self.horizon = np.array([horizon_of[int(day)] for day in self.snapshot_day], dtype=np.int64)
+        self.cells = snapshots[:, 2:6]
+
+        self.obs_snapshot = observations[:, 0]
+        self.obs_room = observations[:, 1]
+        self.obs_day = observations[:, 2]
+        self.obs_band = observations[:, 3]
+
+        # 監視対象日（指定曜日・祝日）の並び。空き枠が一度もなかった日も分母に入れる
+        if len(self.snapshot_day):
+            facility = FACILITIES.get(facility_key, {"weekdays": range(7), "holidays": True})
+            days = candidate_dates(date.fromordinal(int(self.snapshot_day.min())),
+                                   date.fromordinal(int(self.horizon.max())),
+                                   facility["weekdays"], facility["holidays"])
+            self.days = np.array([day.toordinal() for day in days], dtype=np.int64)
+        else:
+            self.days = np.zeros(0, dtype=np.int64)
+        self.day_category = _category(self.days)
+
+    def observed_counts(self):
+        """日付ごとの、その日が表示期間内だったスナップショット数"""
+        # snapshot_day と horizon はどちらも時刻順に単調増加する
+        shown_from = np.searchsorted(np.sort(self.snapshot_day), self.days, side="right")
+        shown_until = np.searchsorted(np.sort(self.horizon), self.days, side="right")
+        return shown_from - shown_until
+
+    def vacancy_cube(self):
+        """(部屋, 日付, 時間帯) ごとの空きの回数"""
+        day_index = np.searchsorted(self.days, self.obs_day)
+        valid = (day_index < len(self.days)) & (self.days[np.minimum(day_index, len(self.days) - 1)] == self.obs_day)
+        shape = (len(self.rooms), len(self.days), len(self.bands))
+        flat = np.ravel_multi_index((self.obs_room[valid], day_index[valid], self.obs_band[valid]), shape)
+        return np.bincount(flat, minlength=int(np.prod(shape))).reshape(shape)
+
+
+def load_history(conn, facility_key, since=None, until=None):
+    """履歴から1施設分を読み込む（該当がなければ None）"""
+    facility_ids = {name: key for key, name in history_store.names(conn, "facility").items()}
+    if facility_key not in facility_ids:
+        return None
+
+    where = "facility = ?"
+    params = [facility_ids[facility_key]]
+    if since:
+        where += " AND checked_at >= ?"
+        params.append(_epoch(since))
+    if until:
+        where += " AND checked_at < ?"
+        params.append(_epoch(until) + 86400)
+
+    # セル数が記録されていない（None）は NaN になる
+    snapshots = np.array(conn.execute(
+        f"SELECT id, checked_at, vacant, full, other, total FROM snapshots WHERE {where} ORDER BY checked_at", params
+    ).fetchall(), dtype=float).reshape(-1, 6)
+    if not len(snapshots):
+        return None
+    snapshot_ids = snapshots[:, 0].astype(np.int64)
+
+    rows = np.array(conn.execute(
+        # 前回と同じだった回（same_as）は、空き枠を持つスナップショットの空き枠を読む
+        f"SELECT snapshots.id, room, day, start, end FROM snapshots"
+        f" JOIN slots ON slots.snapshot = {history_store.SLOTS_OF} WHERE {where}",
+        params,
+    ).fetchall(), dtype=np.int64).reshape(-1, 5)
+
+    # スナップショットID → 時刻順の番号、部屋ID → 連番、(開始, 終了) → 時間帯番号
+    position = np.full(int(snapshot_ids.max()) + 1, -1, dtype=np.int64)
+    position[snapshot_ids] = np.arange(len(snapshots))
+    room_ids, room_index = np.unique(rows[:, 1], return_inverse=True)
+    band_keys, band_index = np.unique(rows[:, 3] * 1440 + rows[:, 4], return_inverse=True)
+
+    room_names = history_store.names(conn, "room")
+    rooms = [room_names[int(room)] for room in room_ids]
+    bands = [(int(key) // 1440, int(key) % 1440) for key in band_keys]
+    observations = np.column_stack([position[rows[:, 0]], room_index.reshape(-1), rows[:, 2], band_index.reshape(-1)])
+    return FacilityHistory(facility_key, rooms, bands, snapshots, observations)
+
+
+def vacancy_heatmap(history):
+    """部屋ごとの 曜日の区分 × 時間帯 の空き率（%）。表示されなかった区分は NaN"""
+    vacant = history.vacancy_cube()
+    observed = history.observed_counts()
+
+    heatmap = np.full((len(history.rooms), len(CATEGORY_NAMES), len(history.bands)), np.nan)
+    for category in range(len(CATEGORY_NAMES)):
+        mask = history.day_category == category
+        denominator = observed[mask].sum()
+        if denominator:
+            heatmap[:, category, :] = vacant[:, mask, :].sum(axis=1) / denominator * 100
+    return heatmap
+
+
+def time_to_rebook(history):
+    """キャンセル（表示期間内に満室から空きに変わった枠）が再び埋まるまでの時間
+
+    空きが続いた連続区間ごとに、(時間帯番号, 曜日の区分, 分, 埋まったか) の配列を返す。
+    分は「空きを最初に確認した時刻」から「埋まっていたのを最初に確認した時刻」まで。
+    まだ空いている（または表示期間を過ぎた）区間は 埋まったか=False で、分は最後の確認までの値。
+    """
+    n = len(history.snapshot_time)
+    if not len(history.obs_snapshot):
+        return np.zeros((0, 4))
+
+    cell = (history.obs_room * (history.obs_day.max() + 1) + history.obs_day) * len(history.bands) + history.obs_band
+    order = np.lexsort((history.obs_snapshot, cell))
+    cell, snapshot = cell[order], history.obs_snapshot[order]
+    day, band = history.obs_day[order], history.obs_band[order]
+
+    # 同じ枠で、スナップショットが連続している間を1つの区間にまとめる
+    starts = np.ones(len(cell), dtype=bool)
+    starts[1:] = (cell[1:] != cell[:-1]) | (snapshot[1:] != snapshot[:-1] + 1)
+    ends = np.roll(starts, -1)
+    ends[-1] = True
+    first, last = snapshot[starts], snapshot[ends]
+    run_day, run_band = day[starts], band[starts]
+
+    # 直前のスナップショットでも表示されていたのに空きではなかった → キャンセルで空いた
+    before = np.maximum(first - 1, 0)
+    cancelled = (first > 0) & (history.snapshot_day[before] <= run_day) & (run_day < history.horizon[before])
+
+    # 直後のスナップショットで表示期間内なのに空きでなくなった → 埋まった
+    after = np.minimum(last + 1, n - 1)
+    rebooked = (last + 1 < n) & (history.snapshot_day[after] <= run_day) & (run_day < history.horizon[after])
+
+    end_time = np.where(rebooked, history.snapshot_time[after], history.snapshot_time[last])
+    minutes = (end_time - history.snapshot_time[first]) / 60
+    categories = _category(run_day)
+    return np.column_stack([run_band, categories, minutes, rebooked])[cancelled]
+
+
+def weekday_trends(history):
+    """週（スナップショットの週の月曜日）× 曜日の区分 の空き率（%）
+
+    (週の月曜日の序数の配列, 空き率の配列) を返す。
+    """
+    if not len(history.snapshot_day):
+        return np.zeros(0, dtype=np.int64), np.zeros((0, len(CATEGORY_NAMES)))
+
+    week_of_snapshot = history.snapshot_day - (history.snapshot_day - 1) % 7
+    weeks, week_index = np.unique(week_of_snapshot, return_inverse=True)
+
+    # 分子: 空きの記録を (週, 空き枠の日付の曜日の区分) で数える
+    obs_category = _category(history.obs_day)
+    numerator = np.zeros((len(weeks), len(CATEGORY_NAMES)))
+    np.add.at(numerator, (week_index[history.obs_snapshot], obs_category), 1)
+
+    # 分母: スナップショットごとに、表示期間内の各区分の日数 × 部屋数 × 時間帯数
+    denominator = np.zeros((len(weeks), len(CATEGORY_NAMES)))
+    for category in range(len(CATEGORY_NAMES)):
+        days = history.days[history.day_category == category]
+        shown = np.searchsorted(days, history.horizon) - np.searchsorted(days, history.snapshot_day)
+        denominator[:, category] = np.bincount(week_index, weights=shown, minlength=len(weeks))
+    denominator *= len(history.rooms) * len(history.bands)
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        rates = np.where(denominator > 0, numerator / denominator * 100, np.nan)
+    return weeks, rates
+
+
+def weekly_occupancy(history, weeks):
+    """週ごとの、表のセルのうち満室だった割合の平均（%）。セル数の記録がない週は NaN"""
+    week_of_snapshot = history.snapshot_day - (history.snapshot_day - 1) % 7
+    week_index = np.searchsorted(weeks, week_of_snapshot)
+    full, total = history.cells[:, 1], history.cells[:, 3]
+    recorded = ~np.isnan(full) & (total > 0)
+    sums = np.bincount(week_index[recorded], weights=full[recorded] / total[recorded], minlength=len(weeks))
+    counts = np.bincount(week_index[recorded], minlength=len(weeks))
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return np.where(counts > 0, sums / counts * 100, np.nan)
+
+
+def _band_label(band):
+    return f"{hhmm_from_minutes(band[0])}-{hhmm_from_minutes(band[1])}"
+
+
+def _print_heatmap(history, heatmap, as_json):
+    if as_json:
+        print(json.dumps({
+            room: {CATEGORY_NAMES[c]: {_band_label(b): (None if np.isnan(v) else round(float(v), 1))
+                                       for b, v in zip(history.bands, heatmap[r, c])}
+                   for c in range(len(CATEGORY_NAMES))}
+            for r, room in enumerate(history.rooms)
+        }, ensure_ascii=False, indent=2))
+        return
+    for r, room in enumerate(history.rooms):
+        print(f"\n🏢 {room}（空き率 %）")
+        print("    " + "".join(f"{_band_label(band):>14}" for band in history.bands))
+        for c, name in enumerate(CATEGORY_NAMES):
+            if np.all(np.isnan(heatmap[r, c])):
+                continue
+            print(f"  {name} " + "".join(f"{value:>14.1f}" for value in heatmap[r, c]))
+
+
+def _summary(minutes):
+    if not len(minutes):
+        return {"count": 0}
+    p25, p50, p75, p90 = np.percentile(minutes, [25, 50, 75, 90])
+    return {"count": int(len(minutes)), "p25": round(float(p25)), "median": round(float(p50)),
+            "p75": round(float(p75)), "p90": round(float(p90))}
+
+
+def _print_rebook(history, runs, as_json):
+    rebooked = runs[runs[:, 3] == 1]
+    result = {
+        "cancellations": int(len(runs)),
+        "rebooked": _summary(rebooked[:, 2]),
+        "still_open": int(len(runs) - len(rebooked)),
+        "by_band": {_band_label(band): _summary(rebooked[rebooked[:, 0] == b, 2]) for b, band in enumerate(history.bands)},
+        "by_weekday": {name: _summary(rebooked[rebooked[:, 1] == c, 2]) for c, name in enumerate(CATEGORY_NAMES)},
+    }
+    if as_json:
+        print(json.dumps(result, ensure_ascii=False, indent=2))
+        return
+    print(f"\n🔁 キャンセルで空いた枠: {result['cancellations']}件（再び埋まった {len(rebooked)}件 / 空いたまま {result['still_open']}件）")
+    overall = result["rebooked"]
+    if overall["count"]:
+        print(f"  埋まるまで（分）: 中央値 {overall['median']} / 25% {overall['p25']} / 75% {overall['p75']} / 90% {overall['p90']}")
+    for label, summary in list(result["by_band"].items()) + list(result["by_weekday"].items()):
+        if summary["count"]:
+            print(f"  {label:>12}: 中央値 {summary['median']}分（{summary['count']}件）")
+
+
+def _print_trends(weeks, rates, occupancy, as_json):
+    if as_json:
+        print(json.dumps({
+            date.fromordinal(int(week)).isoformat(): {
+                **{name: (None if np.isnan(v) else round(float(v), 1)) for name, v in zip(CATEGORY_NAMES, row)},
+                "満室率": None if np.isnan(full) else round(float(full), 1),
+            }
+            for week, row, full in zip(weeks, rates, occupancy)
+        }, ensure_ascii=False, indent=2))
+        return
+    print("\n📈 週ごとの空き率（%）と、表全体の満室率（%）")
+    print("  週の月曜日  " + "".join(f"{name:>7}" for name in CATEGORY_NAMES) + "   満室率")
+    for week, row, full in zip(weeks, rates, occupancy):
+        cells = "".join("      -" if np.isnan(v) else f"{v:>7.1f}" for v in row)
+        full_text = "      -" if np.isnan(full) else f"{full:>7.1f}"
+        print(f"  {date.fromordinal(int(week)).isoformat()}  {cells}  {full_text}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="空き状況の履歴の集計")
+    parser.add_argument("command", choices=["heatmap", "rebook", "trends"])
+    parser.add_argument("--db", help="履歴のSQLiteファイル（デフォルト: SUGINAMI_HISTORY_DB）")
+    parser.add_argument("--facility", default="nishiogi", choices=sorted(FACILITIES))
+    parser.add_argument("--since", help="この日以降のスナップショット（YYYY-MM-DD）")
+    parser.add_argument("--until", help="この日までのスナップショット（YYYY-MM-DD）")
+    parser.add_argument("--json", action="store_true", help="JSONで出力")
+    args = parser.parse_args(argv)
+
+    if np is None:
+        print("❌ numpy が必要です: pip install numpy")
+        return 1
+
+    started = time.perf_counter()
+    conn = history_store.connect(args.db)
+    try:
+        boundary = history_retention.compacted_before(conn, args.facility)
+        if boundary is not None and (args.since is None or _epoch(args.since) < boundary):
+            # 境界の日の途中から縮約されていない（その日のスナップショットは一部しかない）ので翌日からを勧める
+            first_day = (datetime.fromtimestamp(boundary, JST) + timedelta(days=1)).date().isoformat()
+            message = (f"{datetime.fromtimestamp(boundary, JST):%Y-%m-%d %H:%M} より前の履歴は縮約済みで、"
+                       f"ここでは集計できません（--since {first_day} 以降を指定するか、"
+                       "長い期間の推移は history_retention.py trend で見てください）")
+            if args.since is not None:
+                print(f"❌ {message}")
+                return 2
+            print(f"⚠ {message}", file=sys.stderr)
+        history = load_history(conn, args.facility, args.since, args.until)
+    finally:
+        conn.close()
+    if history is None:
+        print(f"⚠ {args.facility} の履歴がありません")
+        return 1
+    loaded = time.perf_counter()
+
+    if args.command == "heatmap":
+        _print_heatmap(history, vacancy_heatmap(history), args.json)
+    elif args.command == "rebook":
+        _print_rebook(history, time_to_rebook(history), args.json)
+    else:
+        weeks, rates = weekday_trends(history)
+        _print_trends(weeks, rates, weekly_occupancy(history, weeks), args.json)
+
+    if not args.json:
+        print(f"\n⏱ スナップショット {len(history.snapshot_time)}件・空き枠 {len(history.obs_day)}件 "
+              f"（読み込み {(loaded - started) * 1000:.0f}ms / 集計 {(time.perf_counter() - loaded) * 1000:.0f}ms）")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
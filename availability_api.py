@@ -0,0 +1,434 @@
+#!/usr/bin/env python3
+"""
+空き状況の問い合わせAPI（読み取り専用）
+
+チェッカーが保存した最新の状態データを、施設・部屋ごとに正規化してHTTPで返す。
+区のサイトにはアクセスしない（スクレイピングするのはチェッカーだけ）。
+状態データはバックグラウンドで読み直し、リクエストはメモリ上のスナップショットだけで答える。
+
+使い方:
+  python availability_api.py            # http://127.0.0.1:8080/
+
+エンドポイント:
+  GET /health          状態データの確認時刻と読み込み状況
+  GET /facilities      監視対象の施設・部屋と空き枠数
+  GET /events          空き枠の追加・削除イベントのストリーム（Server-Sent Events）。
+                       Last-Event-ID ヘッダーか cursor= で続きから受け取れる。facility= 等の絞り込みも可
+                       状態データを読み直したときの差分なので、チェッカーの保存から読み直し間隔だけ遅れる
+  GET /availability    空き枠の一覧。以下のクエリで絞り込める（カンマ区切りで複数指定可）
+      facility=nishiogi,sesion     施設キー
+      room=体育室半面               部屋名
+      date=2025-11-03              日付
+      from=2025-11-01&to=2025-11-30  期間（両端を含む）
+      weekday=sat,sun,holiday      曜日（mon〜sun）と祝日
+      time_from=09:00&time_to=17:00  この時間帯に収まる枠
+
+ETag / If-None-Match に対応し、変化がなければ 304 を返す。
+
+設定（環境変数）:
+  AVAILABILITY_API_HOST      待ち受けるアドレス（デフォルト: 127.0.0.1）
+  PORT                       待ち受けるポート（デフォルト: 8080）
+  AVAILABILITY_API_SOURCE    状態データの読み込み元
+                               file  : チェッカーのローカルキャッシュ（CHECKER_STATE_DIR/latest_state.json, デフォルト）
+                               issue : GitHub Issue #2（GITHUB_TOKEN, GITHUB_REPOSITORY）
+  AVAILABILITY_API_REFRESH_SECONDS  読み込み元を確認する間隔（デフォルト: file 2秒 / issue 60秒）
+  EVENT_STREAM_KEEPALIVE_SECONDS    /events の無通信時にコメント行を送る間隔（デフォルト: 15）
+"""
+
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from datetime import date, datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import rate_limit
+from event_bus import default_bus
+from jp_holidays import holiday_name
+from state_codec import state_cache_path, state_from_issue_body
+from suginami_slots import FACILITIES, Slot, minutes_from_hhmm
+
+WEEKDAY_NAMES = ["mon", "tue", "wed", "thu", "fri", "sat", "sun"]
+
+# (状態データの版, 正規化したクエリ) → 応答本文。同じ問い合わせは絞り込みをやり直さない
+RESPONSE_CACHE_SIZE = 256
+
+
+class QueryError(ValueError):
+    """クエリパラメータが不正"""
+
+
+def _normalize(data):
+    """状態データの空き枠を、APIで返す形式に変換する"""
+    checked_at = data.get("checked_at")
+    try:
+        reference = datetime.fromisoformat(checked_at).date() if checked_at else None
+    except ValueError:
+        reference = None
+
+    records = []
+    for legacy in data.get("availability", []):
+        slot = Slot.from_legacy(legacy, reference)
+        day = slot.day
+        records.append({
+            "facility_key": slot.facility_key,
+            "facility_name": FACILITIES.get(slot.facility_key, {}).get("name", slot.facility_key),
+            "room": slot.room_name,
+            "date": day.isoformat() if day else None,
+            "date_label": slot.date_label,
+            "weekday": WEEKDAY_NAMES[day.weekday()] if day else None,
+            "holiday": holiday_name(day) if day else None,
+            "time_from": legacy["time_from"],
+            "time_to": legacy["time_to"],
+            "_slot": slot,
+        })
+    records.sort(key=lambda record: (record["_slot"].date, record["facility_key"], record["room"], record["_slot"].start))
+    return records
+
+
+class Snapshot:
+    """読み込んだ状態データ（読み取り専用。差し替えるときは丸ごと入れ替える）"""
+
+    def __init__(self, data, source):
+        self.checked_at = data.get("checked_at")
+        self.availability = data.get("availability", [])
+        self.records = _normalize(data)
+        self.source = source
+        self.loaded_at = time.time()
+        keys = "\n".join(sorted(
+            f"{r['facility_key']}\t{r['date_label']}\t{r['room']}\t{r['time_from']}\t{r['time_to']}" for r in self.records
+        ))
+        self.version = hashlib.sha256(f"{self.checked_at}\n{keys}".encode("utf-8")).hexdigest()[:16]
+
+
+EMPTY_SNAPSHOT = Snapshot({}, "none")
+
+
+def _split(values):
+    return [item.strip() for value in values for item in value.split(",") if item.strip()]
+
+
+def _parse_date(text):
+    try:
+        return date.fromisoformat(text)
+    except ValueError:
+        raise QueryError(f"日付は YYYY-MM-DD で指定してください: {text}")
+
+
+def _parse_minutes(text):
+    try:
+        return minutes_from_hhmm(text)
+    except ValueError:
+        raise QueryError(f"時刻は HH:MM で指定してください: {text}")
+
+
+def build_filter(query):
+    """クエリ（parse_qs の結果）から、レコードを判定する関数を作る"""
+    facilities = set(_split(query.get("facility", [])))
+    rooms = set(_split(query.get("room", [])))
+    dates = {_parse_date(text).isoformat() for text in _split(query.get("date", []))}
+    date_from = _parse_date(query["from"][0]).isoformat() if "from" in query else None
+    date_to = _parse_date(query["to"][0]).isoformat() if "to" in query else None
+
+    weekdays = set()
+    holidays = False
+    for name in _split(query.get("weekday", [])):
+        name = name.lower()[:3]
+        if name == "hol":
+            holidays = True
+        elif name in WEEKDAY_NAMES:
+            weekdays.add(name)
+        else:
+            raise QueryError(f"曜日は mon〜sun または holiday で指定してください: {name}")
+
+    band_from = _parse_minutes(query["time_from"][0]) if "time_from" in query else None
+    band_to = _parse_minutes(query["time_to"][0]) if "time_to" in query else None
+
+    def matches(record):
+        if facilities and record["facility_key"] not in facilities:
+            return False
+        if rooms and record["room"] not in rooms:
+            return False
+        day = record["date"]
+        if (dates or date_from or date_to) and day is None:
+            return False
+        if dates and day not in dates:
+            return False
+        if date_from and day < date_from:
+            return False
+        if date_to and day > date_to:
+            return False
+        if (weekdays or holidays) and not (record["weekday"] in weekdays or (holidays and record["holiday"])):
+            return False
+        slot = record["_slot"]
+        if band_from is not None and slot.start < band_from:
+            return False
+        if band_to is not None and slot.end > band_to:
+            return False
+        return True
+
+    return matches
+
+
+def _public(record):
+    return {key: value for key, value in record.items() if not key.startswith("_")}
+
+
+class StateSource:
+    """状態データを定期的に読み直し、最新のスナップショットを保持する"""
+
+    def __init__(self, source=None, refresh_seconds=None):
+        self.source = source or os.getenv("AVAILABILITY_API_SOURCE", "file")
+        if self.source not in ("file", "issue"):
+            raise ValueError(f"不明な読み込み元です: {self.source}")
+        default_refresh = "2" if self.source == "file" else "60"
+        self.refresh_seconds = float(refresh_seconds or os.getenv("AVAILABILITY_API_REFRESH_SECONDS", default_refresh))
+        self.snapshot = EMPTY_SNAPSHOT
+        self.last_error = None
+        self._file_mtime = None
+        self._issue_etag = None
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _load_file(self):
+        path = state_cache_path()
+        try:
+            mtime = os.stat(path).st_mtime_ns
+        except FileNotFoundError:
+            return None
+        if mtime == self._file_mtime:
+            return None
+        with open(path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        self._file_mtime = mtime
+        return data
+
+    def _load_issue(self):
+        token = os.getenv("GITHUB_TOKEN")
+        repo = os.getenv("GITHUB_REPOSITORY", "manzoku-bukuro/taikukan")
+        headers = {"Accept": "application/vnd.github.v3+json"}
+        if token:
+            headers["Authorization"] = f"token {token}"
+        # 変化がなければ GitHub は 304 を返す（レート制限も消費しない）
+        if self._issue_etag:
+            headers["If-None-Match"] = self._issue_etag
+
+        response = rate_limit.get(f"https://api.github.com/repos/{repo}/issues/2", headers=headers, timeout=30)
+        if response.status_code == 304:
+            return None
+        response.raise_for_status()
+        data = state_from_issue_body(response.json().get("body") or "")
+        self._issue_etag = response.headers.get("ETag")
+        return data
+
+    def refresh(self):
+        """読み込み元を確認し、変化があればスナップショットを差し替える"""
+        try:
+            data = self._load_file() if self.source == "file" else self._load_issue()
+        except Exception as e:
+            self.last_error = str(e)[:200]
+            print(f"⚠ 状態データの読み込み失敗: {self.last_error}")
+            return False
+
+        self.last_error = None
+        if data is None:
+            return False
+        previous, self.snapshot = self.snapshot, Snapshot(data, self.source)
+        if previous is not EMPTY_SNAPSHOT:
+            # チェッカー（別プロセス）が保存した状態との差分を /events に流す
+            default_bus().publish_diff(self.snapshot.checked_at, previous.availability, self.snapshot.availability)
+        print(f"✓ 状態データを読み込みました（{self.snapshot.checked_at}, {len(self.snapshot.records)}件）")
+        return True
+
+    def _loop(self):
+        while not self._stop.wait(self.refresh_seconds):
+            self.refresh()
+
+    def start(self):
+        self.refresh()
+        self._thread = threading.Thread(target=self._loop, name="state-refresh", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+
+
+class AvailabilityAPI:
+    """リクエストに応答本文を返す（HTTPサーバーから切り離した処理部分）"""
+
+    def __init__(self, source):
+        self.source = source
+        self._responses = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _cached(self, key, build):
+        with self._lock:
+            body = self._responses.get(key)
+            if body is not None:
+                self._responses.move_to_end(key)
+                return body
+        body = json.dumps(build(), ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+        with self._lock:
+            self._responses[key] = body
+            while len(self._responses) > RESPONSE_CACHE_SIZE:
+                self._responses.popitem(last=False)
+        return body
+
+    def handle(self, path, query):
+        """(ステータス, 応答本文) を返す。本文は同じ版・同じクエリなら同じバイト列"""
+        snapshot = self.source.snapshot
+
+        if path == "/health":
+            return 200, json.dumps({
+                "status": "ok" if snapshot is not EMPTY_SNAPSHOT else "no_data",
+                "checked_at": snapshot.checked_at,
+                "source": self.source.source,
+                "age_seconds": round(time.time() - snapshot.loaded_at) if snapshot is not EMPTY_SNAPSHOT else None,
+                "last_error": self.source.last_error,
+            }, ensure_ascii=False).encode("utf-8")
+
+        if path == "/facilities":
+            def build_facilities():
+                counts = {}
+                for record in snapshot.records:
+                    key = (record["facility_key"], record["room"])
+                    counts[key] = counts.get(key, 0) + 1
+                return {
+                    "checked_at": snapshot.checked_at,
+                    "facilities": [
+                        {
+                            "facility_key": key,
+                            "name": facility["name"],
+                            "rooms": [{"room": room, "count": counts.get((key, room), 0)} for room in facility["rooms"]],
+                        }
+                        for key, facility in FACILITIES.items()
+                    ],
+                }
+            return 200, self._cached((snapshot.version, path), build_facilities)
+
+        if path == "/availability":
+            normalized = tuple(sorted((name, tuple(values)) for name, values in query.items()))
+            matches = build_filter(query)
+
+            def build_availability():
+                slots = [_public(record) for record in snapshot.records if matches(record)]
+                return {"checked_at": snapshot.checked_at, "count": len(slots), "slots": slots}
+            return 200, self._cached((snapshot.version, path, normalized), build_availability)
+
+        return 404, json.dumps({"error": "not found"}).encode("utf-8")
+
+
+def format_event(event):
+    """イベントをSSEの1メッセージに整形する"""
+    record = _normalize({"checked_at": event["checked_at"], "availability": [event["slot"]]})[0]
+    payload = {"type": event["type"], "checked_at": event["checked_at"], "slot": _public(record)}
+    data = json.dumps(payload, ensure_ascii=False, separators=(",", ":"))
+    return f"id: {event['id']}\nevent: {event['type']}\ndata: {data}\n\n".encode("utf-8"), record
+
+
+def _make_handler(api):
+    keepalive = float(os.getenv("EVENT_STREAM_KEEPALIVE_SECONDS", "15"))
+
+    class Handler(BaseHTTPRequestHandler):
+        server_version = "SuginamiAvailability/1"
+
+        def _stream_events(self, query):
+            bus = default_bus()
+            matches = build_filter(query)
+            cursor = self.headers.get("Last-Event-ID") or (query.get("cursor") or [None])[0] or bus.cursor()
+
+            self.send_response(200)
+            self.send_header("Content-Type", "text/event-stream; charset=utf-8")
+            self.send_header("Cache-Control", "no-cache")
+            self.send_header("X-Accel-Buffering", "no")
+            self.end_headers()
+
+            # 接続直後に現在のカーソルを送り、以降の再接続で続きから受け取れるようにする
+            self.wfile.write(f"retry: 3000\nid: {cursor}\n\n".encode("utf-8"))
+            self.wfile.flush()
+
+            try:
+                while True:
+                    events, missed = bus.wait(cursor, timeout=keepalive)
+                    if missed:
+                        self.wfile.write(f"id: {bus.cursor()}\nevent: reset\ndata: {{}}\n\n".encode("utf-8"))
+                    chunks = []
+                    for event in events:
+                        message, record = format_event(event)
+                        if matches(record):
+                            chunks.append(message)
+                    if events:
+                        cursor = events[-1]["id"]
+                        if not chunks and not missed:
+                            # 絞り込みで送るものがなくてもカーソルは進める
+                            chunks.append(f"id: {cursor}\n\n".encode("utf-8"))
+                    elif missed:
+                        cursor = bus.cursor()
+                    self.wfile.write(b"".join(chunks) or b": keepalive\n\n")
+                    self.wfile.flush()
+            except (BrokenPipeError, ConnectionResetError):
+                pass
+
+        def do_GET(self):
+            url = urlparse(self.path)
+            if url.path.rstrip("/") == "/events":
+                try:
+                    self._stream_events(parse_qs(url.query))
+                except QueryError as e:
+                    body = json.dumps({"error": str(e)}, ensure_ascii=False).encode("utf-8")
+                    self.send_response(400)
+                    self.send_header("Content-Type", "application/json; charset=utf-8")
+                    self.send_header("Content-Length", str(len(body)))
+                    self.end_headers()
+                    self.wfile.write(body)
+                return
+
+            try:
+                status, body = api.handle(url.path.rstrip("/") or "/", parse_qs(url.query))
+            except QueryError as e:
+                status, body = 400, json.dumps({"error": str(e)}, ensure_ascii=False).encode("utf-8")
+
+            etag = f'"{hashlib.sha256(body).hexdigest()[:32]}"'
+            if status == 200 and etag in [tag.strip() for tag in self.headers.get("If-None-Match", "").split(",")]:
+                self.send_response(304)
+                self.send_header("ETag", etag)
+                self.end_headers()
+                return
+
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            if status == 200:
+                self.send_header("ETag", etag)
+                self.send_header("Cache-Control", "no-cache")
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            # アクセスログは出さない（cronのログを埋めないため）
+            pass
+
+    return Handler
+
+
+def main():
+    source = StateSource().start()
+    host = os.getenv("AVAILABILITY_API_HOST", "127.0.0.1")
+    port = int(os.getenv("PORT", "8080"))
+    server = ThreadingHTTPServer((host, port), _make_handler(AvailabilityAPI(source)))
+    print(f"🚀 空き状況APIを起動しました: http://{host}:{port}/ （読み込み元: {source.source}）")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        source.stop()
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,252 @@
+#!/usr/bin/env python3
+"""
+1つのページから複数の施設の空き状況をまとめて取得する（ページ内のfetch）
+
+画面を操作して時間帯別空き状況を表示すると、Vueアプリがバックエンドに空き状況のJSONを問い合わせる。
+その問い合わせ（network_capture.ResponseCapture が記録したリクエスト）の施設・部屋の値を
+カタログ（facility_catalog.py）のチェックボックスの値で他の施設に置き換え、
+同じページ（Cookie・トークンを持つセッション）から fetch() で同時数を絞って呼び出す。
+応答はPythonで network_capture.parse_payloads を使って空き状況に変換する。
+置き換えるのは、カタログに記録したチェックボックスの name 属性と同じ名前のパラメータ（クエリ・フォーム・JSONのキー）だけ。
+パスや他のパラメータにたまたま同じ値があっても置き換えない。
+施設の値を置き換えられない形の問い合わせや、取得・推定に失敗した施設は None とし、
+呼び出し側は従来どおり画面を操作して取得する。
+問い合わせは network_capture.ResponseCapture が記録するため、EXTRACTION_MODE=network のときだけ使う。
+
+使い方:
+  results = fetch_facilities(page, capture.templates(), "nishiogi", ["sesion"])
+  # → {"sesion": parse_payloads と同じ形の結果 または None}
+
+設定（環境変数）:
+  BATCH_FETCH               EXTRACTION_MODE=network のとき、true で残りの施設をまとめて取得する（デフォルト: true）
+  BATCH_FETCH_CONCURRENCY   ページから同時に呼び出す数（デフォルト: 3）
+"""
+
+import json
+import os
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+
+import network_capture
+import rate_limit
+from facility_catalog import FacilityCatalog
+from network_capture import parse_payloads
+from suginami_slots import FACILITIES
+
+# ページから同時数を絞って fetch() し、応答ごとに {status, json} を返す
+FETCH_BATCH_JS = """
+    async ([requests, limit, timeout]) => {
+        const results = new Array(requests.length);
+        let next = 0;
+        async function worker() {
+            while (next < requests.length) {
+                const index = next++;
+                const request = requests[index];
+                const controller = new AbortController();
+                const timer = setTimeout(() => controller.abort(), timeout);
+                try {
+                    const response = await fetch(request.url, {
+                        method: request.method, headers: request.headers, body: request.body,
+                        credentials: 'same-origin', signal: controller.signal,
+                    });
+                    const text = await response.text();
+                    let json = null;
+                    try { json = JSON.parse(text); } catch (e) {}
+                    results[index] = {status: response.status, json};
+                } catch (e) {
+                    results[index] = {status: 0, json: null, error: String(e)};
+                } finally {
+                    clearTimeout(timer);
+                }
+            }
+        }
+        await Promise.all(Array.from({length: Math.min(limit, requests.length)}, worker));
+        return results;
+    }
+"""
+
+# fetch() では指定できない・ブラウザに任せるヘッダー
+_SKIP_HEADERS = {"cookie", "host", "content-length", "origin", "referer", "user-agent", "connection",
+                 "accept-encoding"}
+
+
+def enabled():
+    # 問い合わせのテンプレートはネットワークの応答を捕まえないと得られない
+    return network_capture.enabled() and os.getenv("BATCH_FETCH", "true").lower() == "true"
+
+
+def concurrency():
+    return max(1, int(os.getenv("BATCH_FETCH_CONCURRENCY", "3")))
+
+
+class _Unsupported(Exception):
+    """問い合わせの施設・部屋を置き換えられない"""
+
+
+def _param(name):
+    """パラメータ名（"rooms[]" のような配列の表記は除く）"""
+    return str(name)[:-2] if str(name).endswith("[]") else str(name)
+
+
+def _value(entry):
+    """カタログの項目のチェックボックスの値（バックエンドに送られる値）"""
+    value = entry.get("value")
+    if not value or value == "on":
+        raise _Unsupported(f"{entry['name']} のチェックボックスに値がありません")
+    return str(value)
+
+
+class _Substitution:
+    """問い合わせの中の、テンプレートの施設・部屋の値を対象の施設・部屋の値に置き換える
+
+    置き換えるのは、テンプレートの施設・部屋のチェックボックスの name 属性と同じ名前のパラメータの値だけ。
+    """
+
+    def __init__(self, template, target):
+        self.facility = (_value(template["facility"]), _value(target["facility"]))
+        self.rooms = ([_value(room) for room in template["rooms"]], [_value(room) for room in target["rooms"]])
+        self.names = {_param(entry["param"]) for entry in [template["facility"]] + template["rooms"] if entry.get("param")}
+        if not self.names:
+            raise _Unsupported("カタログにチェックボックスの name 属性がありません")
+        self.count = 0
+
+    def scalar(self, value):
+        text = str(value)
+        old_rooms, new_rooms = self.rooms
+        if text == self.facility[0]:
+            new = self.facility[1]
+        elif text in old_rooms:
+            if len(old_rooms) == len(new_rooms):
+                new = new_rooms[old_rooms.index(text)]
+            elif len(new_rooms) == 1:
+                new = new_rooms[0]
+            else:
+                raise _Unsupported("部屋の数が違うため、部屋の値を1つずつ置き換えられません")
+        else:
+            return value
+        self.count += 1
+        return int(new) if isinstance(value, int) and new.isdigit() else new
+
+    def room_list(self, values):
+        """すべてテンプレートの部屋の値なら、対象の部屋の値の一覧を返す（そうでなければ None）"""
+        if not values or not all(str(value) in self.rooms[0] for value in values):
+            return None
+        self.count += 1
+        as_int = isinstance(values[0], int)
+        return [int(new) if as_int and new.isdigit() else new for new in self.rooms[1]]
+
+    def json(self, node, name=None):
+        """JSONの、name 属性と同じキーの値だけを置き換える（name は node を持つキー）"""
+        if isinstance(node, dict):
+            return {key: self.json(value, key) for key, value in node.items()}
+        named = name is not None and _param(name) in self.names
+        if isinstance(node, list):
+            flat = all(not isinstance(item, (dict, list)) for item in node)
+            rooms = self.room_list(node) if named and flat else None
+            return rooms if rooms is not None else [self.json(item, name) for item in node]
+        if named and isinstance(node, (str, int)) and not isinstance(node, bool):
+            return self.scalar(node)
+        return node
+
+    def pairs(self, pairs):
+        """クエリ文字列・フォームの (名前, 値) の一覧（同じ名前の部屋の値はまとめて置き換える）"""
+        result = []
+        for name in dict.fromkeys(name for name, _ in pairs):
+            values = [value for key, value in pairs if key == name]
+            if _param(name) not in self.names:
+                result += [(name, value) for value in values]
+                continue
+            rooms = self.room_list(values) if len(values) > 1 else None
+            result += [(name, value) for value in (rooms if rooms is not None else map(self.scalar, values))]
+        return result
+
+
+def _headers(headers):
+    return {name: value for name, value in (headers or {}).items()
+            if not name.startswith(":") and name.lower() not in _SKIP_HEADERS and not name.lower().startswith("sec-")}
+
+
+def variant(request, template, target):
+    """テンプレートの施設の問い合わせを、対象の施設の問い合わせに置き換える。置き換えられなければ None"""
+    try:
+        substitution = _Substitution(template, target)
+        parts = urlsplit(request["url"])
+        query = urlencode(substitution.pairs(parse_qsl(parts.query, keep_blank_values=True)))
+        body = request.get("body")
+        headers = _headers(request.get("headers"))
+        content_type = next((value for name, value in headers.items() if name.lower() == "content-type"), "")
+        if body and "json" in content_type:
+            body = json.dumps(substitution.json(json.loads(body)), ensure_ascii=False)
+        elif body and "x-www-form-urlencoded" in content_type:
+            body = urlencode(substitution.pairs(parse_qsl(body, keep_blank_values=True)))
+        elif body:
+            # 形のわからない本文は置き換えられない
+            raise _Unsupported(f"本文の形式に対応していません: {content_type or '不明'}")
+    except (_Unsupported, ValueError) as e:
+        print(f"  ➡ 問い合わせを置き換えられません: {e}")
+        return None
+    if substitution.count == 0:
+        print("  ➡ 問い合わせに施設・部屋の値が含まれていません")
+        return None
+    return {"url": urlunsplit(parts._replace(query=query)), "method": request["method"],
+            "headers": headers, "body": body}
+
+
+def fetch_all(page, requests, limit=None, timeout=30000, deadline=None):
+    """ページから requests を同時数 limit で呼び出し、[{status, json}, ...] を返す（ホストのレート制限を通す）
+
+    レート制限の待ちが deadline（run_deadline.Deadline）を過ぎるなら DeadlineExceeded を送出する。
+    """
+    limit = limit or concurrency()
+    results = []
+    for start in range(0, len(requests), limit):
+        chunk = requests[start:start + limit]
+        for request in chunk:
+            rate_limit.acquire(urlsplit(request["url"]).hostname or "", deadline=deadline)
+        results += page.evaluate(FETCH_BATCH_JS, [chunk, limit, timeout])
+    return results
+
+
+def _target(catalog, facility_key):
+    facility = FACILITIES[facility_key]
+    return catalog.resolve(facility["name"], facility["rooms"])
+
+
+def fetch_facilities(page, templates, template_key, facility_keys, limit=None, timeout=30000, deadline=None):
+    """template_key の施設の問い合わせを置き換えて facility_keys の施設をまとめて取得する
+
+    {施設キー: parse_payloads と同じ形の結果 または None（まとめて取得できなかった）} を返す。
+    """
+    results = {key: None for key in facility_keys}
+    catalog = FacilityCatalog.load()
+    template = _target(catalog, template_key)
+    if not templates or template is None:
+        print("➡ まとめて取得するための問い合わせ・カタログがないため、1施設ずつ取得します")
+        return results
+
+    requests, owners = [], []
+    for key in facility_keys:
+        target = _target(catalog, key)
+        variants = [variant(request, template, target) for request in templates] if target else [None]
+        if None in variants:
+            print(f"➡ {key}: まとめて取得できないため、画面を操作して取得します")
+            continue
+        requests += variants
+        owners += [key] * len(variants)
+    if not requests:
+        return results
+
+    print(f"🚀 {len(set(owners))}施設の空き状況をページから{len(requests)}件まとめて取得中...")
+    payloads, failed = {}, set()
+    for key, response in zip(owners, fetch_all(page, requests, limit, timeout, deadline)):
+        if response.get("status") != 200 or response.get("json") is None:
+            print(f"⚠ {key}: 取得できませんでした（HTTP {response.get('status')} {response.get('error') or ''}）")
+            failed.add(key)
+        payloads.setdefault(key, []).append(response.get("json"))
+
+    for key, items in payloads.items():
+        if key in failed:
+            continue
+        results[key] = parse_payloads(items, key, FACILITIES[key]["rooms"])
+        if results[key] is None:
+            print(f"⚠ {key}: 応答から空き状況を推定できませんでした")
+    return results
@@ -0,0 +1,163 @@
+#!/usr/bin/env python3
+"""
+Playwrightの永続プロファイル（HTTPキャッシュ・V8のコードキャッシュを実行をまたいで残す）
+
+通常の browser.new_context() はキャッシュが空の状態で始まるため、杉並区サイトのVueアプリの
+JS・CSSを毎回ダウンロードしてコンパイルし直す。BROWSER_PROFILE=true のときは
+CHECKER_STATE_DIR 内のユーザーデータディレクトリで launch_persistent_context を使い、
+2回目以降の実行ではバンドルをディスクのキャッシュから読み込む。
+
+- サイズ管理: 起動前に合計サイズを測り、上限を超えていればキャッシュのディレクトリを消す
+- 破損からの復旧: 異常終了で残ったロックファイルを消してから起動し、それでも起動できなければ
+  プロファイルを作り直して1回だけ起動し直す
+- 同時実行: プロファイルは1プロセスしか使えないので、使用中なら通常の（使い捨ての）コンテキストで動く
+
+使い方:
+  launcher = BrowserLauncher(p, launch_args, context_options)
+  context = launcher.new_context()     # 作り直すときももう一度呼ぶ
+  ...
+  launcher.close()
+
+設定（環境変数）:
+  BROWSER_PROFILE          true で永続プロファイルを使う（デフォルト: false）
+  BROWSER_PROFILE_DIR      ユーザーデータディレクトリ（デフォルト: CHECKER_STATE_DIR/browser_profile）
+  BROWSER_PROFILE_MAX_MB   プロファイルの合計サイズの上限MB（デフォルト: 150）
+"""
+
+import fcntl
+import os
+import shutil
+
+from circuit_breaker import state_dir
+
+# サイズが上限を超えたときに消すディレクトリ（プロファイルからの相対パス）
+CACHE_DIRS = [
+    os.path.join("Default", "Cache"),
+    os.path.join("Default", "Code Cache"),
+    os.path.join("Default", "GPUCache"),
+    os.path.join("Default", "Service Worker", "CacheStorage"),
+    "ShaderCache",
+    "GrShaderCache",
+]
+
+# Chromiumが異常終了したときに残るロックファイル
+SINGLETON_FILES = ["SingletonLock", "SingletonSocket", "SingletonCookie"]
+
+
+def enabled():
+    return os.getenv("BROWSER_PROFILE", "false").lower() == "true"
+
+
+def profile_dir():
+    return os.getenv("BROWSER_PROFILE_DIR") or os.path.join(state_dir(), "browser_profile")
+
+
+def dir_size(path):
+    total = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            try:
+                total += os.lstat(os.path.join(root, name)).st_size
+            except OSError:
+                pass
+    return total
+
+
+def enforce_size(path, max_bytes=None):
+    """上限を超えていればキャッシュを消し、それでも超えていればプロファイルごと消す。消した後のサイズを返す"""
+    if max_bytes is None:
+        max_bytes = float(os.getenv("BROWSER_PROFILE_MAX_MB", "150")) * 1024 * 1024
+    size = dir_size(path)
+    if size <= max_bytes:
+        return size
+    print(f"🧹 ブラウザプロファイルが {size / 1024 / 1024:.0f}MB のためキャッシュを消します")
+    for relative in CACHE_DIRS:
+        shutil.rmtree(os.path.join(path, relative), ignore_errors=True)
+    size = dir_size(path)
+    if size > max_bytes:
+        reset(path)
+        size = 0
+    return size
+
+
+def reset(path):
+    """プロファイルを作り直す（破損時など）"""
+    print(f"🧹 ブラウザプロファイルを作り直します: {path}")
+    shutil.rmtree(path, ignore_errors=True)
+    os.makedirs(path, exist_ok=True)
+
+
+def _clear_singleton(path):
+    for name in SINGLETON_FILES:
+        target = os.path.join(path, name)
+        if os.path.lexists(target):
+            os.remove(target)
+
+
+class BrowserLauncher:
+    """永続プロファイル（使えなければ通常のブラウザ）でコンテキストを作る"""
+
+    def __init__(self, playwright, launch_args=None, context_options=None, headless=True):
+        self.playwright = playwright
+        self.launch_args = launch_args or []
+        self.context_options = context_options or {}
+        self.headless = headless
+        self.persistent = False
+        self.warm = False
+        self._lock_file = None
+        self._browser = None
+        self._context = None
+
+        if enabled():
+            self.path = profile_dir()
+            os.makedirs(self.path, exist_ok=True)
+            # プロファイルを作り直しても消えないよう、ロックファイルはプロファイルの外に置く
+            self._lock_file = open(f"{self.path}.lock", "w")
+            try:
+                fcntl.flock(self._lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                self.persistent = True
+            except OSError:
+                print("⚠ ブラウザプロファイルは他の実行が使用中のため、キャッシュなしで起動します")
+                self._lock_file.close()
+                self._lock_file = None
+
+        if self.persistent:
+            self.warm = enforce_size(self.path) > 0 and os.path.isdir(os.path.join(self.path, "Default"))
+            print(f"🗂 ブラウザプロファイル: {self.path}（{'キャッシュあり' if self.warm else '初回'}）")
+        else:
+            self._browser = playwright.chromium.launch(headless=headless, args=self.launch_args)
+
+    def _launch_persistent(self):
+        return self.playwright.chromium.launch_persistent_context(
+            self.path, headless=self.headless, args=self.launch_args, **self.context_options)
+
+    def new_context(self):
+        """新しいコンテキストを作る（永続プロファイルでは前のコンテキストを閉じて起動し直す）"""
+        if not self.persistent:
+            return self._browser.new_context(**self.context_options)
+
+        if self._context is not None:
+            self._context.close()
+            self._context = None
+        _clear_singleton(self.path)
+        try:
+            self._context = self._launch_persistent()
+        except Exception as e:
+            print(f"⚠ ブラウザプロファイルで起動できません（破損の可能性）: {str(e)[:200]}")
+            reset(self.path)
+            self.warm = False
+            self._context = self._launch_persistent()
+        return self._context
+
+    def close(self):
+        try:
+            if self._context is not None:
+                self._context.close()
+            if self._browser is not None:
+                self._browser.close()
+        finally:
+            self._context = self._browser = None
+            if self._lock_file is not None:
+                fcntl.flock(self._lock_file, fcntl.LOCK_UN)
+                self._lock_file.close()
+                self._lock_file = None
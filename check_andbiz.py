@@ -2,7 +2,7 @@ import os
 import time
 import json
 import hashlib
-import requests
+import rate_limit
 import chromedriver_autoinstaller
 from datetime import datetime
 from selenium import webdriver
@@ -34,7 +34,7 @@ def send_slack_notification(message):
     headers = {
         "Content-Type": "application/json"
     }
-    response = requests.post(WEBHOOK_URL, json=payload, headers=headers)
+    response = rate_limit.post(WEBHOOK_URL, json=payload, headers=headers)
     if response.status_code != 200:
         print(f"Failed to send notification: {response.status_code}, {response.text}")
 
@@ -57,7 +57,7 @@ def get_previous_dates_from_issue():
     }
 
     try:
-        response = requests.get(url, headers=headers)
+        response = rate_limit.get(url, headers=headers)
         if response.status_code == 200:
             issue = response.json()
             body = issue.get("body", "")
@@ -112,12 +112,12 @@ def save_dates_to_issue(dates_data):
 """
 
     # まずIssueが存在するか確認
-    response = requests.get(url, headers=headers)
+    response = rate_limit.get(url, headers=headers)
 
     if response.status_code == 200:
         # 既存のIssueを更新
         update_data = {"body": body}
-        response = requests.patch(url, headers=headers, json=update_data)
+        response = rate_limit.patch(url, headers=headers, json=update_data)
         if response.status_code == 200:
             print(f"✓ Issue #{issue_number} を更新しました")
             return True
@@ -129,7 +129,7 @@ def save_dates_to_issue(dates_data):
             "body": body,
             "labels": ["automated", "andbiz"]
         }
-        response = requests.post(create_url, headers=headers, json=create_data)
+        response = rate_limit.post(create_url, headers=headers, json=create_data)
         if response.status_code == 201:
             print(f"✓ 新しいIssue #{issue_number} を作成しました")
             return True
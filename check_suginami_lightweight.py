@@ -13,11 +13,13 @@
 """
 
 import os
-import json
-import requests
+import http_cache
+import rate_limit
 from datetime import datetime, timedelta
 from bs4 import BeautifulSoup
 
+from state_codec import encode_state, state_from_issue_body
+
 def get_previous_data_from_issue():
     """GitHub Issueから前回のデータを取得"""
     GITHUB_TOKEN = os.getenv("GITHUB_TOKEN")
@@ -35,16 +37,13 @@ def get_previous_data_from_issue():
     }
 
     try:
-        response = requests.get(url, headers=headers)
+        response = rate_limit.get(url, headers=headers)
         if response.status_code == 200:
             issue = response.json()
             body = issue.get("body", "")
 
-            if "```json" in body:
-                json_start = body.find("```json") + 7
-                json_end = body.find("```", json_start)
-                json_str = body[json_start:json_end].strip()
-                data = json.loads(json_str)
+            data = state_from_issue_body(body)
+            if data is not None:
                 print(f"✓ 前回のデータを取得しました (Issue #{issue_number})")
                 return data
         elif response.status_code == 404:
@@ -92,19 +91,21 @@ def save_data_to_issue(data):
 
 ## 詳細データ
 
-```json
-{json.dumps(data, ensure_ascii=False, indent=2)}
+圧縮形式: state_codec.py で読み書き
+
+```state
+{encode_state(data)}
 ```
 
 ---
 このIssueは自動的に更新されます。
 """
 
-    response = requests.get(url, headers=headers)
+    response = rate_limit.get(url, headers=headers)
 
     if response.status_code == 200:
         update_data = {"body": body}
-        response = requests.patch(url, headers=headers, json=update_data)
+        response = rate_limit.patch(url, headers=headers, json=update_data)
         if response.status_code == 200:
             print(f"✓ Issue #{issue_number} を更新しました")
             return True
@@ -115,7 +116,7 @@ def save_data_to_issue(data):
             "body": body,
             "labels": ["automated", "suginami"]
         }
-        response = requests.post(create_url, headers=headers, json=create_data)
+        response = rate_limit.post(create_url, headers=headers, json=create_data)
         if response.status_code == 201:
             print(f"✓ 新しいIssue #{issue_number} を作成しました")
             return True
@@ -133,7 +134,7 @@ def send_slack_notification(message):
     payload = {"text": message}
     headers = {"Content-Type": "application/json"}
 
-    response = requests.post(WEBHOOK_URL, json=payload, headers=headers)
+    response = rate_limit.post(WEBHOOK_URL, json=payload, headers=headers)
     if response.status_code != 200:
         print(f"⚠ Failed to send Slack notification: {response.status_code}")
     else:
@@ -157,7 +158,7 @@ def check_facility_simple(facility_name):
         print("サイトにアクセス中...")
         url = "https://www.shisetsuyoyaku.city.suginami.tokyo.jp/user/Home"
 
-        response = requests.get(url, headers=headers, timeout=30, allow_redirects=True)
+        response = rate_limit.get(url, headers=headers, timeout=30, allow_redirects=True)
 
         print(f"ステータスコード: {response.status_code}")
         print(f"URL: {response.url}")
@@ -271,6 +272,8 @@ def main():
     else:
         print("\n➡ 変更がないためIssue更新とSlack通知をスキップします")
 
+    stats = http_cache.report()
+    print(f"📈 HTTPキャッシュ: ヒット率 {stats['hit_ratio']}（304 {stats['hits']}件・取得 {stats['misses']}件）")
     return True
 
 if __name__ == "__main__":
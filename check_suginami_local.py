@@ -23,6 +23,9 @@ from selenium.webdriver.support.ui import WebDriverWait
 from selenium.webdriver.support import expected_conditions as EC
 import chromedriver_autoinstaller
 
+import low_memory
+from run_lock import RUN_LOCK_NAME, RunLock
+
 # ChromeDriverを自動インストール
 chromedriver_autoinstaller.install()
 
@@ -36,12 +39,16 @@ def get_chrome_driver():
     options.add_argument("--no-sandbox")
     options.add_argument("--disable-dev-shm-usage")
     options.add_argument("--disable-gpu")
-    options.add_argument("--window-size=1920,1080")
+    options.add_argument(low_memory.selenium_window_size())
     options.add_argument("--user-agent=Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36")
     options.add_argument("--disable-blink-features=AutomationControlled")
     options.add_experimental_option("excludeSwitches", ["enable-automation"])
     options.add_experimental_option('useAutomationExtension', False)
 
+    # 省メモリモード（LOW_MEMORY=true）の起動引数
+    for arg in low_memory.chromium_args():
+        options.add_argument(arg)
+
     driver = webdriver.Chrome(options=options)
     driver.execute_script("Object.defineProperty(navigator, 'webdriver', {get: () => undefined})")
 
@@ -117,6 +124,12 @@ def save_results(data, filename="suginami_availability.json"):
 def main():
     print("=== 杉並区施設予約チェック（ローカル版） ===\n")
 
+    with RunLock(RUN_LOCK_NAME) as lock:
+        if not lock.acquired:
+            return True
+        return _check_all()
+
+def _check_all():
     driver = None
     try:
         driver = get_chrome_driver()
@@ -3,15 +3,80 @@
 杉並区施設予約システムチェック（Playwright版）
 
 Playwrightを使用してGitHub Actionsで安定動作
+
+複数の施設をチェックする場合は、最初の施設だけ画面を操作し、
+残りの施設は同じページからまとめて取得する（batch_fetch.py）。
+1ヶ月より先まで監視する場合は、期間を1ヶ月ごとのシャードに分け、1つのブラウザでシャードごとに
+コンテキストを作って順に取得し、正規化した空き枠（Slot）で重複を除いてまとめる。
+杉並区サイトへのリクエストはシャード・施設・ワーカーのすべてが同じレート制限（rate_limit.py、0.5回/秒）を通るため、
+シャードごとにブラウザを起動して並行させてもリクエストの間隔は縮まらず、メモリだけが増える。
+シャードを増やすと1回の実行の画面操作も増えるので、RUN_DEADLINE_SECONDS に収まる数にする。
+
+設定（環境変数）:
+  CHECK_FACILITIES         チェックする施設キー（カンマ区切り。デフォルト: nishiogi）
+  SUGINAMI_HORIZON_MONTHS  監視する期間の月数（デフォルト: 1）
 """
 
+import hashlib
 import os
-import json
-import requests
+import sqlite3
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeout, wait
+from contextlib import contextmanager
 from datetime import datetime
 from playwright.sync_api import sync_playwright, TimeoutError as PlaywrightTimeout
 
-def send_slack_notification(new_slots):
+import batch_fetch
+import history_retention
+import history_store
+import http_cache
+from artifacts import ArtifactRecorder
+from browser_profile import BrowserLauncher
+import low_memory
+import rate_limit
+from circuit_breaker import CircuitBreaker
+import network_capture
+from facility_catalog import FacilityCatalog, default_category, select_by_key
+from run_deadline import Deadline, DeadlineExceeded, playwright_timeout, request_timeout
+from run_lock import RUN_LOCK_NAME, RunLock
+from notification_ledger import LEDGER_KEY, dump_ledger, load_ledger, filter_new_slots, prune_ledger
+from state_codec import encode_state, state_from_issue_body, write_state_cache
+from step_runner import Step, run_steps
+from suginami_slots import (FACILITIES, check_date_coverage, date_shards, filter_candidate_slots, horizon_months,
+                            merge_slots, slots_from_legacy, slots_to_legacy, watch_candidate_dates)
+
+SUGINAMI_HOST = "www.shisetsuyoyaku.city.suginami.tokyo.jp"
+SUGINAMI_HOME_URL = f"https://{SUGINAMI_HOST}/user/Home"
+
+# 状態データに保存する時間帯別空き状況の表のハッシュ（施設キーごと。西荻だけの頃は FINGERPRINT_KEY に保存していた）
+FINGERPRINT_KEY = "grid_fingerprint"
+FINGERPRINTS_KEY = "grid_fingerprints"
+
+# 取得できず前回の空き枠を引き継いでいる施設（施設キー → 最後に取得できた日時）
+STALE_KEY = "stale"
+
+
+def run_facility_keys():
+    keys = [key.strip() for key in os.getenv("CHECK_FACILITIES", "").split(",") if key.strip()]
+    return keys or ["nishiogi"]
+
+
+def previous_fingerprints(data):
+    """前回の状態データの {施設キー: 表のフィンガープリント}"""
+    if not data:
+        return {}
+    fingerprints = dict(data.get(FINGERPRINTS_KEY) or {})
+    if data.get(FINGERPRINT_KEY):
+        fingerprints.setdefault("nishiogi", data[FINGERPRINT_KEY])
+    return fingerprints
+
+
+def stale_since(previous_data, failed_keys):
+    """取得できなかった施設 → 最後に取得できた日時（STALE_KEY に記録する。前回も古ければその日時を引き継ぐ）"""
+    previous_stale = (previous_data or {}).get(STALE_KEY, {})
+    return {key: previous_stale.get(key) or (previous_data or {}).get("checked_at") for key in failed_keys}
+
+def send_slack_notification(new_slots, deadline=None):
     """Slackに通知を送信"""
     webhook_url = os.getenv("SLACK_WEBHOOK_URL")
     if not webhook_url:
@@ -28,12 +93,12 @@ def send_slack_notification(new_slots):
 
     payload = {"text": message}
     try:
-        requests.post(webhook_url, json=payload)
+        rate_limit.post(webhook_url, json=payload, timeout=request_timeout(deadline))
         print("✓ Slack通知を送信しました")
     except Exception as e:
         print(f"⚠ Slack通知失敗: {e}")
 
-def get_previous_data_from_issue():
+def get_previous_data_from_issue(deadline=None):
     """GitHub Issueから前回のデータを取得"""
     GITHUB_TOKEN = os.getenv("GITHUB_TOKEN")
     REPO = os.getenv("GITHUB_REPOSITORY", "manzoku-bukuro/taikukan")
@@ -50,16 +115,13 @@ def get_previous_data_from_issue():
     }
 
     try:
-        response = requests.get(url, headers=headers)
+        response = rate_limit.get(url, headers=headers, timeout=request_timeout(deadline))
         if response.status_code == 200:
             issue = response.json()
             body = issue.get("body", "")
 
-            if "```json" in body:
-                json_start = body.find("```json") + 7
-                json_end = body.find("```", json_start)
-                json_str = body[json_start:json_end].strip()
-                data = json.loads(json_str)
+            data = state_from_issue_body(body)
+            if data is not None:
                 print(f"✓ 前回のデータを取得しました (Issue #{issue_number})")
                 return data
     except Exception as e:
@@ -67,8 +129,8 @@ def get_previous_data_from_issue():
 
     return None
 
-def save_data_to_issue(data):
-    """GitHub Issueにデータを保存"""
+def save_data_to_issue(data, deadline=None):
+    """GitHub Issueにデータを保存（存在確認のGETは省き、直接PATCHする）"""
     GITHUB_TOKEN = os.getenv("GITHUB_TOKEN")
     REPO = os.getenv("GITHUB_REPOSITORY", "manzoku-bukuro/taikukan")
 
@@ -87,10 +149,12 @@ def save_data_to_issue(data):
     slots_text = ""
     for slot in data.get("availability", [])[:10]:  # 最初の10件
         slots_text += f"- {slot['date']} {slot['facility']} {slot['time_from']}-{slot['time_to']}\n"
+    stale_text = "".join(f"\n⚠ {key} は取得できず、{since or '前回'}時点の空き枠です" for key, since in
+                         data.get(STALE_KEY, {}).items())
 
     body = f"""# 杉並区施設予約 空き状況
 
-最終更新: {data['checked_at']}
+最終更新: {data['checked_at']}{stale_text}
 
 ## 直近の空き枠（最大10件）
 
@@ -98,22 +162,22 @@ def save_data_to_issue(data):
 
 ## 詳細データ
 
-```json
-{json.dumps(data, ensure_ascii=False, indent=2)}
+空き枠 {len(data.get("availability", []))}件（圧縮形式: state_codec.py で読み書き）
+
+```state
+{encode_state(data)}
 ```
 
 ---
 このIssueは自動的に更新されます。
 """
 
-    response = requests.get(url, headers=headers)
+    update_data = {"body": body}
+    response = rate_limit.patch(url, headers=headers, json=update_data, timeout=request_timeout(deadline))
 
     if response.status_code == 200:
-        update_data = {"body": body}
-        response = requests.patch(url, headers=headers, json=update_data)
-        if response.status_code == 200:
-            print(f"✓ Issue #{issue_number} を更新しました")
-            return True
+        print(f"✓ Issue #{issue_number} を更新しました")
+        return True
     elif response.status_code == 404:
         create_url = f"https://api.github.com/repos/{REPO}/issues"
         create_data = {
@@ -121,7 +185,7 @@ def save_data_to_issue(data):
             "body": body,
             "labels": ["automated", "suginami"]
         }
-        response = requests.post(create_url, headers=headers, json=create_data)
+        response = rate_limit.post(create_url, headers=headers, json=create_data, timeout=request_timeout(deadline))
         if response.status_code == 201:
             print(f"✓ 新しいIssue #{issue_number} を作成しました")
             return True
@@ -129,274 +193,718 @@ def save_data_to_issue(data):
     print(f"⚠ Failed to save to issue: {response.status_code}")
     return False
 
-def check_availability_with_playwright():
-    """Playwrightで空き状況をチェック（リトライ機能付き）"""
-    print("=== Playwright で杉並区施設予約をチェック ===\n")
+# ラベルに対応するチェックボックスを（未チェックの場合だけ）クリックする。何度呼んでも同じ状態になる
+ENSURE_LABEL_CHECKED_JS = """
+    ([text, exact]) => {
+        const label = Array.from(document.querySelectorAll('label'))
+            .find(l => exact ? l.textContent.trim() === text : l.textContent.includes(text));
+        if (!label) return false;
+        const input = label.control || label.querySelector('input');
+        if (input && input.checked) return true;
+        label.click();
+        return input ? input.checked : true;
+    }
+"""
 
-    max_retries = 3
-    for attempt in range(max_retries):
-        try:
-            return _try_check_availability(attempt + 1)
-        except Exception as e:
-            if attempt < max_retries - 1:
-                wait_time = (attempt + 1) * 10
-                print(f"⚠ 試行 {attempt + 1}/{max_retries} 失敗: {str(e)[:100]}")
-                print(f"  {wait_time}秒後に再試行...")
-                import time
-                time.sleep(wait_time)
-            else:
-                print(f"❌ 全ての試行が失敗しました")
-                return None
+IS_LABEL_CHECKED_JS = """
+    ([text, exact]) => {
+        const label = Array.from(document.querySelectorAll('label'))
+            .find(l => exact ? l.textContent.trim() === text : l.textContent.includes(text));
+        if (!label) return false;
+        const input = label.control || label.querySelector('input');
+        return !!(input && input.checked);
+    }
+"""
 
-def _try_check_availability(attempt_num):
-    """実際のチェック処理"""
-    print(f"[試行 {attempt_num}]")
+# 絞り込み条件（ラベル, 完全一致か）
+FILTER_LABELS = [("1ヶ月", True), ("土曜日", False), ("日曜日", False), ("祝日", False)]
+
+# 表示開始日の入力欄（表示されている最初の input[type=date]）を [値 'YYYY-MM-DD', 設定するか] にする・確かめる
+# Vueの v-model に伝わるよう、ネイティブのsetterで値を入れてから input・change を発生させる
+PERIOD_START_JS = """
+    ([value, apply]) => {
+        const input = Array.from(document.querySelectorAll('input[type="date"]')).find(i => i.offsetParent !== null);
+        if (!input) return false;
+        if (apply && input.value !== value) {
+            Object.getOwnPropertyDescriptor(HTMLInputElement.prototype, 'value').set.call(input, value);
+            input.dispatchEvent(new Event('input', {bubbles: true}));
+            input.dispatchEvent(new Event('change', {bubbles: true}));
+        }
+        return input.value === value;
+    }
+"""
 
-    with sync_playwright() as p:
-        # ブラウザ起動（headlessモード）
-        browser = p.chromium.launch(headless=True)
-        context = browser.new_context(
-            user_agent="Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36",
-            viewport={"width": 1920, "height": 1080},
-            locale="ja-JP",
-            timezone_id="Asia/Tokyo"
-        )
-        page = context.new_page()
+# 部屋名を含む行のチェックボックスを（未チェックの場合だけ）クリックし、チェック済みの数を返す
+SELECT_ROOMS_JS = """
+    ([roomNames, click]) => {
+        let count = 0;
+        document.querySelectorAll('tr td:first-child').forEach(td => {
+            if (!roomNames.some(name => td.textContent.includes(name))) return;
+            const checkbox = td.closest('tr').querySelector('input[type="checkbox"]');
+            if (!checkbox) return;
+            if (click && !checkbox.checked) checkbox.click();
+            if (checkbox.checked) count++;
+        });
+        return count;
+    }
+"""
 
-        try:
-            # ホームページにアクセス
-            print("サイトにアクセス中...")
-            page.goto("https://www.shisetsuyoyaku.city.suginami.tokyo.jp/user/Home",
-                     wait_until="domcontentloaded", timeout=60000)
-
-            # Vueアプリが読み込まれるまで待つ（集会施設ボタンが表示されるまで）
-            print("Vueアプリの初期化を待機中...")
-            page.wait_for_selector("button:text('集会施設')", timeout=30000, state="visible")
-            print(f"✓ ページタイトル: {page.title()}")
-
-            # 集会施設ボタンをクリック
-            print("集会施設を選択中...")
-            page.click("button:text('集会施設')")
-
-            # 施設選択画面が表示されるまで待つ
-            page.wait_for_selector("label:has-text('西荻地域区民センター・勤福会館')", timeout=15000, state="visible")
-
-            # 西荻地域区民センターを選択
-            print("西荻地域区民センターを選択中...")
-            page.click("label:has-text('西荻地域区民センター・勤福会館')")
-            page.wait_for_timeout(500)
+# 時間帯別空き状況の表（日付見出しと枠の並び）のハッシュ。前回と同じなら以降の処理を省く
+GRID_FINGERPRINT_JS = """
+    async () => {
+        const first = document.querySelector('div.events-date');
+        const root = first ? first.parentElement : document.body;
+        const bytes = new TextEncoder().encode(root.outerHTML);
+        const digest = await crypto.subtle.digest('SHA-256', bytes);
+        return Array.from(new Uint8Array(digest)).map(b => b.toString(16).padStart(2, '0')).join('');
+    }
+"""
 
-            # 次へボタン
-            page.click("button[aria-label='次へ進む']")
-            page.wait_for_selector("h2:text('施設別空き状況')", timeout=30000)
-            print("✓ 施設別空き状況ページに遷移")
-
-            # フィルター設定
-            print("フィルター設定中...")
-
-            # フィルター要素が表示されるまで待つ（Vueルーティング遷移）
-            page.wait_for_timeout(2000)  # Vueのマウント待ち
-
-            # JavaScriptで直接操作
-            page.evaluate("""
-                // 1ヶ月を選択
-                const monthLabel = Array.from(document.querySelectorAll('label')).find(l => l.textContent.trim() === '1ヶ月');
-                if (monthLabel) monthLabel.click();
-            """)
-            page.wait_for_timeout(1000)
-
-            # 曜日フィルタをJavaScriptで操作
-            page.evaluate("""
-                // 土曜日
-                const satLabel = Array.from(document.querySelectorAll('label')).find(l => l.textContent.includes('土曜日'));
-                if (satLabel) satLabel.click();
-            """)
-            page.wait_for_timeout(500)
+# 時間帯別空き状況から空き情報を取得（vacant以外も数える）
+EXTRACT_AVAILABILITY_JS = """
+    (facilityKey) => {
+        const debug = {
+            dateElementsCount: 0,
+            eventsGroupCount: 0,
+            totalSlotsCount: 0,
+            vacantSlotsCount: 0,
+            fullSlotsCount: 0,
+            otherSlotsCount: 0,
+            dates: [],
+            results: []
+        };
+
+        const dateElements = document.querySelectorAll('div.events-date');
+        debug.dateElementsCount = dateElements.length;
+
+        dateElements.forEach((dateElem, idx) => {
+            const dateText = dateElem.textContent.trim();
+            debug.dates.push(dateText);
+
+            // 次の兄弟要素を探す
+            let sibling = dateElem.nextElementSibling;
+            while (sibling && sibling.classList.contains('events-group')) {
+                debug.eventsGroupCount++;
+
+                const facilityNameElem = sibling.querySelector('div.top-info span.room-name span');
+                const facilityName = facilityNameElem ? facilityNameElem.textContent.trim() : '';
+
+                // 全てのスロットを探す
+                const allSlots = sibling.querySelectorAll('div.display-cells > div');
+                debug.totalSlotsCount += allSlots.length;
+
+                allSlots.forEach(slot => {
+                    const btnGroup = slot.querySelector('div.btn-group-toggle');
+                    if (btnGroup) {
+                        const isVacant = btnGroup.classList.contains('vacant');
+                        const isFull = btnGroup.classList.contains('full');
+
+                        if (isVacant) debug.vacantSlotsCount++;
+                        else if (isFull) debug.fullSlotsCount++;
+                        else debug.otherSlotsCount++;
+
+                        // vacantの場合のみ結果に追加
+                        if (isVacant) {
+                            const timeFromInput = slot.querySelector('input[name*="TimeFrom"]');
+                            const timeToInput = slot.querySelector('input[name*="TimeTo"]');
+
+                            if (timeFromInput && timeToInput) {
+                                const timeFrom = timeFromInput.value;
+                                const timeTo = timeToInput.value;
+
+                                const slotData = {
+                                    date: dateText,
+                                    facility: facilityName,
+                                    time_from: timeFrom.substring(0, 2) + ':' + timeFrom.substring(2),
+                                    time_to: timeTo.substring(0, 2) + ':' + timeTo.substring(2),
+                                    facility_key: facilityKey
+                                };
+                                debug.results.push(slotData);
+                            }
+                        }
+                    }
+                });
+
+                sibling = sibling.nextElementSibling;
+            }
+        });
 
-            page.evaluate("""
-                // 日曜日
-                const sunLabel = Array.from(document.querySelectorAll('label')).find(l => l.textContent.includes('日曜日'));
-                if (sunLabel) sunLabel.click();
-            """)
+        return debug;
+    }
+"""
+
+def build_navigation_steps(facility, target=None, capture=None, start=None, deadline=None):
+    """ホーム → 施設選択 → 絞り込み → 部屋選択 → 時間帯別空き状況 の各ステップ
+
+    target（FacilityCatalog.resolve() の結果）があれば施設と部屋をIDで選択し、
+    IDで選択できなかった・選んだものの名前が違ったときは、選択を外してカタログの記録を期限切れにし、
+    従来どおりラベル・部屋名の文字列で選択する。
+    capture（network_capture.ResponseCapture）は時間帯別空き状況へ進む直前に空にする。
+    start（date）を渡すと、絞り込みで表示開始日をその日にする（期間のシャード）。
+    各待機のタイムアウトは deadline（run_deadline.Deadline）までの残り時間に抑える。
+    """
+    facility_name = facility["name"]
+    room_names = facility["rooms"]
+    category = target["category"] if target else facility.get("category", default_category())
+
+    def ms(cap):
+        return playwright_timeout(deadline, cap)
+
+    def key_mismatch(what):
+        print(f"⚠ カタログのIDで{what}を選択できませんでした。名前で選択します")
+        FacilityCatalog.load().invalidate(facility_name)
+
+    def open_home(page):
+        print("サイトにアクセス中...")
+        started = time.monotonic()
+        page.goto(SUGINAMI_HOME_URL, wait_until="domcontentloaded", timeout=ms(60000))
+        # Vueアプリが読み込まれるまで待つ（分類ボタンが表示されるまで）
+        print("Vueアプリの初期化を待機中...")
+        page.wait_for_selector(f"button:text('{category}')", timeout=ms(30000), state="visible")
+        print(f"✓ ページタイトル: {page.title()}（操作できるまで {time.monotonic() - started:.1f}秒）")
+
+    def select_category(page):
+        print(f"{category}を選択中...")
+        page.click(f"button:text('{category}')")
+        page.wait_for_selector(f"label:has-text('{facility_name}')", timeout=ms(15000), state="visible")
+
+    def select_facility(page):
+        print(f"{facility_name}を選択中...")
+        if not (target and select_by_key(page, [target["facility"]], [facility_name])):
+            if target:
+                key_mismatch("施設")
+            page.evaluate(ENSURE_LABEL_CHECKED_JS, [facility_name, False])
+        page.wait_for_timeout(500)
+
+    def go_to_facility_availability(page):
+        page.click("button[aria-label='次へ進む']")
+        page.wait_for_selector("h2:text('施設別空き状況')", timeout=ms(30000))
+        print("✓ 施設別空き状況ページに遷移")
+
+    def filters_applied(page):
+        return all(page.evaluate(IS_LABEL_CHECKED_JS, [label, exact]) for label, exact in FILTER_LABELS) \
+            and (start is None or page.evaluate(PERIOD_START_JS, [start.isoformat(), False])) \
+            and page.is_visible("tr td:first-child")
+
+    def apply_filters(page):
+        print("フィルター設定中...")
+        # フィルター要素が表示されるまで待つ（Vueルーティング遷移）
+        page.wait_for_selector("label:has-text('1ヶ月')", timeout=ms(30000))
+        for label, exact in FILTER_LABELS:
+            page.evaluate(ENSURE_LABEL_CHECKED_JS, [label, exact])
             page.wait_for_timeout(500)
+        if start is not None:
+            if not page.evaluate(PERIOD_START_JS, [start.isoformat(), True]):
+                raise RuntimeError(f"表示開始日を {start.isoformat()} にできません")
+            print(f"✓ 表示開始日: {start.isoformat()}")
+
+        # 表示ボタンをクリック
+        page.click("button:text('表示')")
+        page.wait_for_selector("tr td:first-child", timeout=ms(30000))
+        print("✓ 空き状況を表示")
+
+    def select_rooms(page):
+        print("体育室を選択中...")
+        checked = select_by_key(page, target["rooms"], room_names) if target else 0
+        if not checked:
+            if target:
+                key_mismatch("部屋")
+            checked = page.evaluate(SELECT_ROOMS_JS, [room_names, True])
+        print(f"✓ 体育室チェックボックスを選択: {checked}個")
+        page.wait_for_timeout(1000)
+
+    def go_to_time_availability(page):
+        if capture:
+            capture.clear()
+        page.click("button[aria-label='次へ進む']")
+        page.wait_for_selector("h2:text('時間帯別空き状況')", timeout=ms(30000))
+        print("✓ 時間帯別空き状況ページに遷移")
+
+    return [
+        Step("ホームを開く", open_home,
+             lambda page: page.is_visible(f"button:text('{category}')")),
+        Step("分類を選択", select_category,
+             lambda page: page.is_visible(f"label:has-text('{facility_name}')")),
+        Step("施設を選択", select_facility,
+             lambda page: page.evaluate(IS_LABEL_CHECKED_JS, [facility_name, False])),
+        Step("施設別空き状況へ進む", go_to_facility_availability,
+             lambda page: page.is_visible("h2:text('施設別空き状況')")),
+        Step("絞り込んで表示", apply_filters, filters_applied),
+        Step("体育室を選択", select_rooms,
+             lambda page: page.evaluate(SELECT_ROOMS_JS, [room_names, False]) > 0),
+        Step("時間帯別空き状況へ進む", go_to_time_availability,
+             lambda page: page.is_visible("h2:text('時間帯別空き状況')")),
+    ]
+
+def extract_availability(page, facility_key, cell_counts=None, recorder=None, debug_info=None, start=None,
+                         shown_dates=None):
+    """時間帯別空き状況ページから空き枠を取得
+
+    cell_counts に辞書を渡すと、空き・満室・その他のセル数を書き込む（履歴の記録用）。
+    recorder（ArtifactRecorder）を渡すと、表示されない対象日があった場合に画面と異常を記録する。
+    debug_info にネットワークの応答から作った結果（network_capture.parse_payloads）を渡すとDOMを読まない。
+    start は表示開始日（シャード。None なら今日）で、監視対象日との突き合わせに使う。
+    shown_dates にリストを渡すと、表示された日付を追加する（シャードをまとめた後の突き合わせ用）。
+    """
+    print("空き情報を取得中...")
+    if debug_info is None:
+        debug_info = page.evaluate(EXTRACT_AVAILABILITY_JS, facility_key)
+    if shown_dates is not None:
+        shown_dates.extend(debug_info['dates'])
+    if cell_counts is not None:
+        cell_counts.update({
+            "vacant": debug_info['vacantSlotsCount'],
+            "full": debug_info['fullSlotsCount'],
+            "other": debug_info['otherSlotsCount'],
+            "total": debug_info['totalSlotsCount'],
+        })
+
+    availability_data = debug_info['results']
+    print(f"📊 デバッグ情報:")
+    print(f"  - 日付要素: {debug_info['dateElementsCount']}個")
+    print(f"  - 施設: {debug_info['eventsGroupCount']}個")
+    print(f"  - 総スロット数: {debug_info['totalSlotsCount']}個")
+    print(f"  - 空き: {debug_info['vacantSlotsCount']}個")
+    print(f"  - 満室: {debug_info['fullSlotsCount']}個")
+    print(f"  - その他: {debug_info['otherSlotsCount']}個")
+
+    # 祝日カレンダーから求めた監視対象日と突き合わせる（欠けた日・対象外の日を検出）
+    candidates = watch_candidate_dates(facility_key, start)
+    covered, missing, unexpected = check_date_coverage(debug_info['dates'], candidates)
+    print(f"  - 対象日: {len(covered)}/{len(candidates)}日")
+    if missing:
+        print(f"⚠ 表示されなかった対象日: {', '.join(day.strftime('%m/%d') for day in missing)}")
+        if recorder:
+            # 成功時は画面を記録しない（DOMとスクリーンショットの取得は重い）。異常のときだけ残す
+            recorder.capture_page(page, "時間帯別空き状況")
+            recorder.anomaly(f"表示されなかった対象日: {', '.join(day.isoformat() for day in missing)}")
+    if unexpected:
+        print(f"  - 対象外の日付（除外）: {len(unexpected)}日")
+        availability_data = filter_candidate_slots(availability_data, candidates)
+
+    print(f"✓ 空き枠を{len(availability_data)}件取得しました")
+
+    # デバッグ: 最初の数件を表示
+    if availability_data:
+        for slot in availability_data[:3]:
+            print(f"  - {slot['date']} {slot['facility']} {slot['time_from']}-{slot['time_to']}")
+    else:
+        print("  （空き枠なし）")
 
-            page.evaluate("""
-                // 祝日
-                const holLabel = Array.from(document.querySelectorAll('label')).find(l => l.textContent.includes('祝日'));
-                if (holLabel) holLabel.click();
-            """)
-            page.wait_for_timeout(1000)
-
-            # 表示ボタンをクリック
-            page.click("button:text('表示')")
-            page.wait_for_timeout(3000)
-            print("✓ 空き状況を表示")
-
-            # 体育室を選択
-            print("体育室を選択中...")
-
-            # JavaScriptで体育室のチェックボックスを直接操作
-            checkboxes_count = page.evaluate("""
-                (() => {
-                    const checkboxes = document.querySelectorAll('tr td:first-child');
-                    let count = 0;
-                    checkboxes.forEach(td => {
-                        if (td.textContent.includes('体育室半面')) {
-                            const checkbox = td.closest('tr').querySelector('input[type="checkbox"]');
-                            if (checkbox) {
-                                checkbox.click();
-                                count++;
-                            }
-                        }
-                    });
-                    return count;
-                })()
-            """)
-            print(f"✓ 体育室チェックボックスをクリック: {checkboxes_count}個")
-            page.wait_for_timeout(1000)
-
-            # 次へ
-            page.click("button[aria-label='次へ進む']")
-            page.wait_for_selector("h2:text('時間帯別空き状況')", timeout=30000)
-            print("✓ 時間帯別空き状況ページに遷移")
-
-            # 空き情報を取得
-            print("空き情報を取得中...")
-
-            # JavaScriptで空き情報を取得（vacant以外も含む）
-            debug_info = page.evaluate("""
-                (() => {
-                    const debug = {
-                        dateElementsCount: 0,
-                        eventsGroupCount: 0,
-                        totalSlotsCount: 0,
-                        vacantSlotsCount: 0,
-                        fullSlotsCount: 0,
-                        otherSlotsCount: 0,
-                        results: []
-                    };
-
-                    const dateElements = document.querySelectorAll('div.events-date');
-                    debug.dateElementsCount = dateElements.length;
-
-                    dateElements.forEach((dateElem, idx) => {
-                        const dateText = dateElem.textContent.trim();
-
-                        // 次の兄弟要素を探す
-                        let sibling = dateElem.nextElementSibling;
-                        while (sibling && sibling.classList.contains('events-group')) {
-                            debug.eventsGroupCount++;
-
-                            const facilityNameElem = sibling.querySelector('div.top-info span.room-name span');
-                            const facilityName = facilityNameElem ? facilityNameElem.textContent.trim() : '';
-
-                            // 全てのスロットを探す
-                            const allSlots = sibling.querySelectorAll('div.display-cells > div');
-                            debug.totalSlotsCount += allSlots.length;
-
-                            allSlots.forEach(slot => {
-                                const btnGroup = slot.querySelector('div.btn-group-toggle');
-                                if (btnGroup) {
-                                    const isVacant = btnGroup.classList.contains('vacant');
-                                    const isFull = btnGroup.classList.contains('full');
-
-                                    if (isVacant) debug.vacantSlotsCount++;
-                                    else if (isFull) debug.fullSlotsCount++;
-                                    else debug.otherSlotsCount++;
-
-                                    // vacantの場合のみ結果に追加
-                                    if (isVacant) {
-                                        const timeFromInput = slot.querySelector('input[name*="TimeFrom"]');
-                                        const timeToInput = slot.querySelector('input[name*="TimeTo"]');
-
-                                        if (timeFromInput && timeToInput) {
-                                            const timeFrom = timeFromInput.value;
-                                            const timeTo = timeToInput.value;
-
-                                            const slotData = {
-                                                date: dateText,
-                                                facility: facilityName,
-                                                time_from: timeFrom.substring(0, 2) + ':' + timeFrom.substring(2),
-                                                time_to: timeTo.substring(0, 2) + ':' + timeTo.substring(2),
-                                                facility_key: 'nishiogi'
-                                            };
-                                            debug.results.push(slotData);
-                                        }
-                                    }
-                                }
-                            });
-
-                            sibling = sibling.nextElementSibling;
-                        }
-                    });
-
-                    return debug;
-                })()
-            """)
-
-            availability_data = debug_info['results']
-            print(f"📊 デバッグ情報:")
-            print(f"  - 日付要素: {debug_info['dateElementsCount']}個")
-            print(f"  - 施設: {debug_info['eventsGroupCount']}個")
-            print(f"  - 総スロット数: {debug_info['totalSlotsCount']}個")
-            print(f"  - 空き: {debug_info['vacantSlotsCount']}個")
-            print(f"  - 満室: {debug_info['fullSlotsCount']}個")
-            print(f"  - その他: {debug_info['otherSlotsCount']}個")
-
-            print(f"✓ 空き枠を{len(availability_data)}件取得しました")
-
-            # デバッグ: 最初の数件を表示
-            if availability_data:
-                for slot in availability_data[:3]:
-                    print(f"  - {slot['date']} {slot['facility']} {slot['time_from']}-{slot['time_to']}")
-            else:
-                print("  （空き枠なし）")
+    return availability_data
 
-            browser.close()
+def check_availability_with_playwright(facility_key="nishiogi", get_previous_fingerprint=None, watchdog=None,
+                                      cell_counts=None, batch=None, deadline=None):
+    """Playwrightで空き状況をチェック（ステップ単位のリトライ・サーキットブレーカー付き）
 
-            return availability_data
+    get_previous_fingerprint は前回の表のフィンガープリントを返す関数。
+    画面遷移が終わった時点で初めて呼ぶので、前回データの取得と並行してブラウザを動かせる。
+    (表のフィンガープリント, 空き枠のリスト) を返す。
+    表が前回と同じ場合は空き枠の取得を省いて (フィンガープリント, None) を、エラー時は None を返す。
+    batch を渡すと、同じページから他の施設もまとめて取得する（check_facilities_with_playwright を参照）。
+    deadline（run_deadline.Deadline）を過ぎたら中断して None を返す（サイトの障害とはみなさない）。
+    """
+    print("=== Playwright で杉並区施設予約をチェック ===\n")
 
+    breaker = CircuitBreaker(SUGINAMI_HOST)
+    allowed, reason = breaker.allow()
+    if not allowed:
+        print(f"⏭ {SUGINAMI_HOST} へのアクセスを見送りました: {reason}")
+        return None
+
+    try:
+        # 施設・部屋のIDはシャードより前に1回だけカタログから引く（見つからなければここで巡回し直す）
+        facility = FACILITIES[facility_key]
+        target = FacilityCatalog.load().ensure(None, facility["name"], facility["rooms"], facility.get("category"),
+                                               deadline)
+        shards = date_shards()
+        if len(shards) == 1:
+            result = _check_facility(facility_key, get_previous_fingerprint, watchdog, cell_counts, batch,
+                                     deadline=deadline, target=target)
+        else:
+            result = _check_shards(facility_key, shards, get_previous_fingerprint, watchdog, cell_counts, batch,
+                                   deadline, target)
+    except DeadlineExceeded as e:
+        print(f"⏱ {facility_key}: {e}")
+        return None
+    except rate_limit.RateLimited as e:
+        # 自分のレート制限で待ちきれなかっただけで、サイトの障害ではない
+        print(f"⏭ {facility_key}: {e}")
+        return None
+    except Exception as e:
+        breaker.record_failure()
+        print(f"❌ エラー: {str(e)[:200]}")
+        return None
+
+    breaker.record_success()
+    return result
+
+def check_facilities_with_playwright(facility_keys, get_previous_fingerprints=None, watchdog=None, cell_counts=None,
+                                     deadline=None):
+    """複数の施設をチェックし、{施設キー: check_availability_with_playwright と同じ結果} を返す
+
+    EXTRACTION_MODE=network かつ BATCH_FETCH=true なら最初の施設だけ画面を操作し、同じページから残りの施設をまとめて取得する。
+    まとめて取得できなかった施設は1施設ずつ画面を操作して取得する。
+    get_previous_fingerprints は {施設キー: 前回のフィンガープリント} を返す関数。
+    cell_counts に辞書を渡すと、施設キーごとのセル数の辞書を書き込む。
+    deadline を過ぎた後の施設はチェックせずに None とする。
+    """
+    cell_counts = {} if cell_counts is None else cell_counts
+
+    def previous(facility_key):
+        return (get_previous_fingerprints() or {}).get(facility_key) if get_previous_fingerprints else None
+
+    first, rest = facility_keys[0], list(facility_keys[1:])
+    batch = {"keys": rest, "previous": previous, "cell_counts": cell_counts, "results": {}} \
+        if rest and batch_fetch.enabled() else None
+    results = {first: check_availability_with_playwright(first, lambda: previous(first), watchdog,
+                                                         cell_counts.setdefault(first, {}), batch, deadline)}
+    for facility_key in rest:
+        if batch and batch["results"].get(facility_key) is not None:
+            results[facility_key] = batch["results"][facility_key]
+            continue
+        if deadline and deadline.expired():
+            print(f"⏭ {facility_key}: 制限時間を過ぎたためチェックしません")
+            results[facility_key] = None
+            continue
+        results[facility_key] = check_availability_with_playwright(
+            facility_key, lambda key=facility_key: previous(key), watchdog, cell_counts.setdefault(facility_key, {}),
+            deadline=deadline)
+    return results
+
+def _merge_shards(facility_key, results, previous_fingerprint=None, cell_counts=None, shard_counts=(),
+                  shown_dates=()):
+    """シャードごとの (フィンガープリント, 空き枠) をまとめる。1つでも取得できていなければ None
+
+    shown_dates（全シャードで表示された日付）を監視する期間全体の対象日と突き合わせ、シャードの間の欠けを検出する。
+    """
+    if any(result is None for result in results):
+        return None
+    if cell_counts is not None:
+        for counts in shard_counts:
+            for name, count in counts.items():
+                cell_counts[name] = cell_counts.get(name, 0) + count
+    candidates = watch_candidate_dates(facility_key, months=horizon_months())
+    covered, missing, _ = check_date_coverage(shown_dates, candidates)
+    print(f"  - 期間全体の対象日: {len(covered)}/{len(candidates)}日")
+    if missing:
+        print(f"⚠ どのシャードにも表示されなかった対象日: {', '.join(day.strftime('%m/%d') for day in missing)}")
+    fingerprint = hashlib.sha256("".join(result[0] for result in results).encode("utf-8")).hexdigest()
+    if previous_fingerprint and fingerprint == previous_fingerprint:
+        print(f"✓ 空き状況の表は前回と同じです（{fingerprint[:12]}）")
+        return fingerprint, None
+    # 最後のシャードの表示期間は監視する期間の終わりを越えることがあるので、期間全体の対象日で絞る
+    availability = filter_candidate_slots(merge_slots(*(result[1] for result in results)), candidates)
+    print(f"✓ {len(results)}個のシャードから空き枠を{len(availability)}件取得しました（重複を除く）")
+    return fingerprint, availability
+
+def _check_shards(facility_key, shards, get_previous_fingerprint=None, watchdog=None, cell_counts=None, batch=None,
+                  deadline=None, target=None):
+    """期間のシャード（date_shards）を1つのブラウザでシャードごとのコンテキストで順に取得し、重複を除いてまとめる
+
+    シャードは前回のフィンガープリントと比べずに空き枠を取得し、全シャードのフィンガープリントを
+    まとめたものを前回と比べる。batch の施設も同じようにシャードごとに取得してまとめる。
+    シャードの画面操作はすべて同じホストのレート制限を通るので、並行させずにブラウザを1つだけ起動する。
+    """
+    shard_counts = [{} for _ in shards]
+    shard_dates = [[] for _ in shards]
+    shard_batches = [dict(batch, previous=lambda key: None, cell_counts={}, results={}, shown_dates={})
+                     if batch else None for _ in shards]
+    print(f"🗂 期間を{len(shards)}個のシャードに分けて取得します")
+    with _browser() as launcher:
+        results = [_check_facility(facility_key, None, watchdog, counts, shard_batch, start, deadline, dates, target,
+                                   launcher)
+                   for start, counts, shard_batch, dates in zip(shards, shard_counts, shard_batches, shard_dates)]
+
+    if batch:
+        for key in batch["keys"]:
+            merged = _merge_shards(key, [shard_batch["results"].get(key) for shard_batch in shard_batches],
+                                   batch["previous"](key), batch["cell_counts"].setdefault(key, {}),
+                                   [shard_batch["cell_counts"].get(key, {}) for shard_batch in shard_batches],
+                                   [day for shard_batch in shard_batches
+                                    for day in shard_batch["shown_dates"].get(key, [])])
+            if merged is not None:
+                batch["results"][key] = merged
+    previous_fingerprint = get_previous_fingerprint() if get_previous_fingerprint else None
+    return _merge_shards(facility_key, results, previous_fingerprint, cell_counts, shard_counts,
+                         [day for dates in shard_dates for day in dates])
+
+def _fetch_batch(page, capture, facility_key, batch, start=None, deadline=None):
+    """画面を操作した施設の問い合わせを置き換えて、batch["keys"] の施設をまとめて取得する"""
+    if deadline:
+        deadline.check("まとめて取得")
+    parsed = batch_fetch.fetch_facilities(page, capture.templates() if capture else [], facility_key, batch["keys"],
+                                          timeout=playwright_timeout(deadline, 30000), deadline=deadline)
+    for key, network in parsed.items():
+        if network is None:
+            continue
+        fingerprint = network["fingerprint"]
+        if fingerprint == batch["previous"](key):
+            print(f"✓ {key}: 空き状況の表は前回と同じです（{fingerprint[:12]}）")
+            batch["results"][key] = fingerprint, None
+            continue
+        print(f"\n--- {key}（まとめて取得） ---")
+        batch["results"][key] = fingerprint, extract_availability(
+            page, key, batch["cell_counts"].setdefault(key, {}), debug_info=network, start=start,
+            shown_dates=batch.get("shown_dates", {}).setdefault(key, []))
+
+@contextmanager
+def _browser():
+    """ブラウザを起動して BrowserLauncher を返す（headlessモード。BROWSER_PROFILE=true なら永続プロファイルでキャッシュを残す）"""
+    with sync_playwright() as p:
+        launcher = BrowserLauncher(p, low_memory.chromium_args(), dict(
+            user_agent="Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36",
+            viewport=low_memory.viewport(),
+            locale="ja-JP",
+            timezone_id="Asia/Tokyo"
+        ))
+        try:
+            yield launcher
+        finally:
+            launcher.close()
+
+def _check_facility(facility_key, get_previous_fingerprint=None, watchdog=None, cell_counts=None, batch=None,
+                    start=None, deadline=None, shown_dates=None, target=None, launcher=None):
+    """ブラウザのコンテキストを1つ作り、失敗したステップから再開しながら空き枠を取得
+
+    画面の記録はメモリに溜めておき、失敗・異常時だけ保存する（artifacts.py）。
+    start（date）を渡すと、表示開始日をその日にしたシャードを取得する。
+    shown_dates は extract_availability に渡す（表示された日付を集める）。
+    target は呼び出し側がカタログから引いた施設・部屋のID（FacilityCatalog.ensure() の結果。None なら名前で選択）。
+    launcher（BrowserLauncher）を渡すとそのブラウザにコンテキストを作る（シャード）。None ならブラウザを起動する。
+    """
+    if launcher is None:
+        with _browser() as launcher:
+            return _check_facility(facility_key, get_previous_fingerprint, watchdog, cell_counts, batch, start,
+                                   deadline, shown_dates, target, launcher)
+
+    facility = FACILITIES[facility_key]
+    recorder = ArtifactRecorder(f"suginami-{facility_key}" + (f"-{start:%Y%m%d}" if start else ""))
+    capture = network_capture.ResponseCapture(SUGINAMI_HOST) if network_capture.enabled() else None
+
+    def new_context():
+        context = launcher.new_context()
+        # ルーティングを有効にするとHTTPキャッシュが使われないので、永続プロファイルでは画像の遮断を起動引数に任せる
+        if not launcher.persistent:
+            low_memory.block_heavy_resources(context)
+        if capture:
+            capture.attach(context)
+        recorder.start_trace(context)
+        return context
+
+    def recover(page):
+        # 失敗した時点の画面を記録してから、ページがクラッシュ・クローズしていたら作り直す（ステップはホームから再開される）
+        if not page.is_closed():
+            recorder.capture_page(page, "ステップ失敗")
+        return page.context.new_page() if page.is_closed() else page
+
+    def before_step(page):
+        # 各ステップの画面操作もホストのレート制限を通す
+        rate_limit.acquire(SUGINAMI_HOST, deadline=deadline)
+        # メモリ上限に近づいたらコンテキストごと作り直す（無限に繰り返さないよう2回まで）
+        if watchdog is not None and watchdog.recycles < 2 and watchdog.should_recycle():
+            watchdog.recycles += 1
+            print(f"♻ メモリ使用量 {watchdog.current_mb:.0f}MB のためブラウザコンテキストを作り直します")
+            recorder.discard_trace(page.context)
+            page.context.close()
+            page = new_context().new_page()
+        # クリック・evaluate など個別にタイムアウトを指定しない操作も締め切りまでに抑える
+        page.set_default_timeout(playwright_timeout(deadline, 30000))
+        return page
+
+    page = new_context().new_page()
+    failed = True
+    try:
+        page = run_steps(build_navigation_steps(facility, target, capture, start, deadline), page,
+                         recover=recover, between_steps=before_step, deadline=deadline)
+
+        # 空き状況のJSONを推定できればDOMを読まない（できなければ従来どおりDOMから）
+        network = capture.result(page, facility_key, facility["rooms"]) if capture else None
+        if network:
+            print("✓ ネットワークの応答から空き状況を取得しました")
+            fingerprint = network["fingerprint"]
+        else:
+            if capture:
+                print("➡ ネットワークの応答から空き状況を推定できないため、DOMから取得します")
+            fingerprint = page.evaluate(GRID_FINGERPRINT_JS)
+        previous_fingerprint = get_previous_fingerprint() if get_previous_fingerprint else None
+        if previous_fingerprint and fingerprint == previous_fingerprint:
+            print(f"✓ 空き状況の表は前回と同じです（{fingerprint[:12]}）")
+            result = fingerprint, None
+        else:
+            result = fingerprint, extract_availability(page, facility_key, cell_counts, recorder, network, start,
+                                                      shown_dates)
+        failed = False
+
+        # 残りの施設は同じページからまとめて取得する（失敗しても画面を操作した施設の結果は使う）
+        if batch and batch["keys"]:
+            try:
+                _fetch_batch(page, capture, facility_key, batch, start, deadline)
+            except Exception as e:
+                print(f"⚠ まとめて取得できませんでした: {str(e)[:200]}")
+        return result
+    except Exception as e:
+        recorder.note_exception(e)
+        if not page.is_closed():
+            recorder.capture_page(page, "エラー")
+        # IDで選択した画面遷移が失敗したら、次回はカタログを巡回し直す（サイトの改修でIDが変わった場合）
+        if target is not None and not isinstance(e, (DeadlineExceeded, rate_limit.RateLimited)):
+            FacilityCatalog.load().invalidate(facility["name"])
+        raise
+    finally:
+        try:
+            recorder.finish(failed, context=None if page.is_closed() else page.context)
         except Exception as e:
-            print(f"❌ エラー: {e}")
-            browser.close()
-            return None
+            print(f"⚠ 調査用の記録を保存できませんでした: {e}")
+        # このシャードのコンテキストだけ閉じる（ブラウザは呼び出し側が閉じる）
+        try:
+            if not page.is_closed():
+                page.context.close()
+        except Exception:
+            pass
+
+def record_history(checked_at, facility_key, availability=None, cell_counts=None):
+    """履歴（SUGINAMI_HISTORY_DB）に記録する。availability が None なら前回と同じ空き枠として記録"""
+    if not history_store.history_path():
+        return
+    try:
+        conn = history_store.connect()
+        try:
+            if availability is None:
+                history_store.record_unchanged(conn, checked_at, facility_key)
+            else:
+                history_store.record_snapshot(conn, checked_at, facility_key, availability, cell_counts)
+        finally:
+            conn.close()
+    except sqlite3.Error as e:
+        print(f"⚠ 履歴の記録失敗: {e}")
+
+def compact_history():
+    """履歴の古いスナップショットを少しずつ縮約する（history_retention.py）"""
+    if not history_store.history_path():
+        return
+    try:
+        conn = history_store.connect()
+        try:
+            result = history_retention.compact(conn)
+        finally:
+            conn.close()
+        if result["snapshots"] or result["expired"]:
+            print(f"🧹 履歴を縮約しました（スナップショット {result['snapshots']}件・削除 {result['expired']}件）")
+    except sqlite3.Error as e:
+        print(f"⚠ 履歴の縮約失敗: {e}")
+
+def print_cache_report():
+    stats = http_cache.report()
+    if stats["hit_ratio"] is not None:
+        print(f"📈 HTTPキャッシュ: ヒット率 {stats['hit_ratio']:.0%}（304 {stats['hits']}件・取得 {stats['misses']}件、"
+              f"{stats['bytes_saved'] / 1024:.0f}KB節約）")
 
 def main():
     print(f"実行環境: {'GitHub Actions' if os.getenv('GITHUB_ACTIONS') else 'ローカル'}\n")
 
-    # 空き状況をチェック
-    availability = check_availability_with_playwright()
+    lock = RunLock(RUN_LOCK_NAME)
+    if not lock.acquire():
+        return True
+
+    deadline = Deadline()
+    watchdog = low_memory.RssWatchdog().start()
+    executor = ThreadPoolExecutor(max_workers=2)
+    try:
+        return _run(executor, deadline, watchdog)
+    finally:
+        lock.release()
+        # 締め切りを過ぎて残った処理は待たない
+        executor.shutdown(wait=False, cancel_futures=True)
+        watchdog.stop()
+        print(f"📈 ピークメモリ: {watchdog.peak_mb:.0f}MB（コンテキスト再作成 {watchdog.recycles}回）")
+        print_cache_report()
+
+def _run(executor, deadline, watchdog):
+    """前回データの取得とスクレイピング、保存とSlack通知をそれぞれ並行して実行"""
+    # 前回のデータ取得はブラウザ起動・画面遷移と並行して行う
+    previous_future = executor.submit(get_previous_data_from_issue, deadline)
+
+    def wait_previous_data():
+        try:
+            return previous_future.result(timeout=deadline.remaining())
+        except FutureTimeout:
+            print("⚠ 前回のデータ取得が制限時間内に終わりませんでした")
+            return None
 
-    if availability is None:
-        print("⚠ エラーが発生しました")
+    # 空き状況をチェック（締め切りを過ぎても取得済みの施設を保存・通知できるよう、その時間を残して打ち切る）
+    facility_keys = run_facility_keys()
+    cell_counts = {}
+    results = check_facilities_with_playwright(
+        facility_keys, get_previous_fingerprints=lambda: previous_fingerprints(wait_previous_data()),
+        watchdog=watchdog, cell_counts=cell_counts, deadline=deadline.reserve())
+
+    failed = [key for key, result in results.items() if result is None]
+    if len(failed) == len(results):
+        # すべて失敗しても前回の空き枠を引き継ぎ、古いデータであることを記録して保存する
+        print("⚠ エラーが発生しました（すべての施設を取得できませんでした）")
+
+    checked_at = datetime.now().isoformat()
+    for facility_key, result in results.items():
+        if result is not None:
+            record_history(checked_at, facility_key, result[1], cell_counts.get(facility_key))
+    compact_history()
+
+    previous_data = wait_previous_data()
+    if previous_data is None and len(failed) == len(results):
+        # 引き継ぐ前回のデータもなければ、空の結果で上書きしない
         return False
+    previous_stale = (previous_data or {}).get(STALE_KEY, {})
+    stale = stale_since(previous_data, failed)
+    if all(result is None or result[1] is None for result in results.values()) and set(stale) == set(previous_stale):
+        print("➡ 変化がないため差分検出・Issue更新・Slack通知をスキップします")
+        return not failed
+
+    # 変化なし・失敗した施設は前回の空き枠を引き継ぐ（失敗した施設は古いデータとして記録する）
+    fingerprints = previous_fingerprints(previous_data)
+    availability = []
+    for facility_key, result in results.items():
+        if result is not None:
+            fingerprints[facility_key] = result[0]
+        if result is not None and result[1] is not None:
+            availability += result[1]
+            continue
+        if result is None:
+            print(f"⚠ {facility_key}: 取得できなかったため前回の空き枠を引き継ぎます（{stale[facility_key] or '不明'} 時点）")
+        availability += [slot for slot in (previous_data or {}).get("availability", [])
+                         if slot["facility_key"] == facility_key]
 
     if len(availability) == 0:
         print("ℹ️  空き枠はありませんが、チェックは正常に完了しました")
 
     # 現在のデータ
     current_data = {
-        "checked_at": datetime.now().isoformat(),
+        "checked_at": checked_at,
         "availability": availability,
-        "count": len(availability)
+        "count": len(availability),
+        FINGERPRINTS_KEY: fingerprints,
+        STALE_KEY: stale,
+        "metrics": dict(watchdog.report(), http_cache=http_cache.report())
     }
+    publish_results(executor, deadline, previous_data, current_data)
+    return not failed
 
-    # 前回のデータを取得
-    previous_data = get_previous_data_from_issue()
+def publish_results(executor, deadline, previous_data, current_data):
+    """新しい空き枠を検出し、イベント発行・キャッシュ・Issue更新・Slack通知を行う
 
-    # 新しいスロットを検出
-    new_slots = []
-    if previous_data:
-        previous_slots = set()
-        for slot in previous_data.get("availability", []):
-            slot_id = f"{slot['facility_key']}_{slot['date']}_{slot['facility']}_{slot['time_from']}_{slot['time_to']}"
-            previous_slots.add(slot_id)
+    current_data は "checked_at" と "availability" を持つ保存用のデータ（通知済み台帳はここで追加する）。
+    ジョブキューで複数のワーカーが取得した結果をまとめる場合（check_worker.py）も使う。
+    """
+    availability = current_data["availability"]
 
-        for slot in availability:
-            slot_id = f"{slot['facility_key']}_{slot['date']}_{slot['facility']}_{slot['time_from']}_{slot['time_to']}"
-            if slot_id not in previous_slots:
-                new_slots.append(slot)
+    # 新しいスロットを検出（通知済み台帳と照合して、揺れている枠の再通知を抑える）
+    # 前回の空き枠は、表が変わらずスキップした回の間も空いていたものとして扱う
+    previous_slots = set(slots_from_legacy(previous_data.get("availability", []))) if previous_data else set()
+    ledger = load_ledger(previous_data)
+    new_slots = slots_to_legacy(filter_new_slots(ledger, slots_from_legacy(availability), previous_slots))
+    current_data[LEDGER_KEY] = dump_ledger(prune_ledger(ledger))
 
+    if previous_data:
         if new_slots:
             print(f"\n✓ 新しい空き枠: {len(new_slots)}件")
             for slot in new_slots[:5]:
@@ -405,16 +913,25 @@ def main():
             print("\n➡ 新しい空き枠はありません")
     else:
         print("\n✓ 初回実行")
-        new_slots = availability
 
-    # Issueを更新
-    save_data_to_issue(current_data)
+    # 問い合わせAPI（availability_api.py）用のローカルキャッシュ
+    try:
+        write_state_cache(current_data)
+    except OSError as e:
+        print(f"⚠ 状態キャッシュの書き込み失敗: {e}")
 
-    # 新しい空き枠があればSlack通知
+    # Issueの更新とSlack通知は並行して行い、実行全体の締め切りまで待つ
+    futures = {executor.submit(save_data_to_issue, current_data, deadline): "Issue更新"}
     if new_slots:
-        send_slack_notification(new_slots)
-
-    return True
+        futures[executor.submit(send_slack_notification, new_slots, deadline)] = "Slack通知"
+
+    done, not_done = wait(futures, timeout=deadline.remaining())
+    for future in not_done:
+        print(f"⚠ {futures[future]}が制限時間内に終わりませんでした")
+        future.cancel()
+    for future in done:
+        if future.exception():
+            print(f"⚠ {futures[future]}でエラー: {future.exception()}")
 
 if __name__ == "__main__":
     import sys
@@ -0,0 +1,247 @@
+#!/usr/bin/env python3
+"""
+施設チェックを複数のワーカーで分担する（ジョブキュー版）
+
+スケジューラーが間隔（デフォルト30分）ごとに施設ごとのチェックジョブを登録し、
+ワーカーがキューから取り出して既存のPlaywrightのフローで空き状況を取得する。
+まとめ役（collect）が全施設の結果を集めて、差分検出・Issue更新・Slack通知を1回だけ行う。
+ジョブIDは「施設キー＋間隔の開始時刻」なので、スケジューラーが何台あっても各施設は間隔ごとに1回だけチェックされる。
+
+使い方:
+  python check_worker.py schedule            # 今の間隔のジョブを登録
+  python check_worker.py work [--once]       # ジョブを処理し続ける（--once はキューが空になったら終了）
+  python check_worker.py collect             # 今の間隔の結果をまとめてIssue更新・Slack通知
+  python check_worker.py run                 # schedule + collect（cronで実行する場合）
+  python check_worker.py dead [--requeue ID] # デッドレターの一覧・再投入
+
+設定（環境変数）:
+  WORK_QUEUE_URL               キューの場所（work_queue.py を参照）
+  WORK_QUEUE_INTERVAL_MINUTES  チェックの間隔（デフォルト: 30）
+  CHECK_FACILITIES             チェックする施設キー（カンマ区切り。デフォルト: すべて）
+  WORKER_ID                    ワーカーの名前（デフォルト: ホスト名-PID）
+  WORKER_POLL_SECONDS          キューが空のときに待つ秒数（デフォルト: 5）
+  RUN_DEADLINE_SECONDS         ジョブ1件の制限時間（デフォルト: 1500。リース期間 WORK_QUEUE_VISIBILITY_SECONDS を超えない）
+"""
+
+import argparse
+import os
+import socket
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+import low_memory
+from check_suginami_playwright import (FINGERPRINTS_KEY, STALE_KEY, check_availability_with_playwright,
+                                       get_previous_data_from_issue, publish_results, record_history, stale_since)
+from circuit_breaker import backoff_delay
+from run_deadline import Deadline
+from run_lock import RUN_LOCK_NAME, RunLock
+from suginami_slots import FACILITIES
+from work_queue import open_queue
+
+def interval_seconds():
+    return int(os.getenv("WORK_QUEUE_INTERVAL_MINUTES", "30")) * 60
+
+
+def current_interval(now=None):
+    """今の間隔の開始時刻（epoch秒）"""
+    now = time.time() if now is None else now
+    return int(now // interval_seconds()) * interval_seconds()
+
+
+def facility_keys():
+    keys = [key.strip() for key in os.getenv("CHECK_FACILITIES", "").split(",") if key.strip()]
+    return keys or list(FACILITIES)
+
+
+def job_id(facility_key, interval):
+    return f"check:{facility_key}:{interval}"
+
+
+def schedule(queue, previous_data=None):
+    """今の間隔の施設チェックジョブを登録する（登録済みなら何もしない）"""
+    interval = current_interval()
+    fingerprints = (previous_data or {}).get(FINGERPRINTS_KEY, {})
+    for facility_key in facility_keys():
+        payload = {"facility_key": facility_key, "interval": interval,
+                   "previous_fingerprint": fingerprints.get(facility_key)}
+        if queue.enqueue(job_id(facility_key, interval), payload):
+            print(f"✓ ジョブを登録しました: {facility_key}")
+        else:
+            print(f"➡ 登録済みです: {facility_key}")
+    return interval
+
+
+def _visibility_seconds():
+    return float(os.getenv("WORK_QUEUE_VISIBILITY_SECONDS", "900"))
+
+
+def _heartbeat(queue, job, stop, deadline):
+    """処理中はリース期間の1/3ごとにリースを延長する（失ったら締め切りにして処理を打ち切らせる）"""
+    period = _visibility_seconds() / 3
+    while not stop.wait(period):
+        if not queue.extend(job):
+            print(f"⚠ リースを失いました: {job.id}")
+            deadline.expire()
+            return
+
+
+def process(queue, job, watchdog=None):
+    """ジョブを1件処理する"""
+    payload = job.payload
+    facility_key = payload["facility_key"]
+
+    # 前の間隔のジョブが残っていた場合は、次の間隔のジョブに任せる
+    if payload["interval"] < current_interval() - interval_seconds():
+        print(f"⏭ 古い間隔のジョブを見送りました: {job.id}")
+        queue.ack(job, {"skipped": True})
+        return
+
+    print(f"\n▶ {job.id}（{job.attempts}回目）")
+    # ジョブ1件の締め切り（リース期間を超えない。履歴の記録と ack の時間を残してスクレイピングを打ち切る）
+    deadline = Deadline(min(float(os.getenv("RUN_DEADLINE_SECONDS", "1500")), _visibility_seconds()))
+    stop = threading.Event()
+    threading.Thread(target=_heartbeat, args=(queue, job, stop, deadline), daemon=True).start()
+    try:
+        cell_counts = {}
+        result = check_availability_with_playwright(
+            facility_key, get_previous_fingerprint=lambda: payload.get("previous_fingerprint"),
+            watchdog=watchdog, cell_counts=cell_counts, deadline=deadline.reserve())
+    finally:
+        stop.set()
+
+    if result is None:
+        delay = backoff_delay(job.attempts - 1, base=30.0, cap=300.0)
+        queue.nack(job, "空き状況の取得に失敗しました", delay=delay)
+        print(f"⚠ {job.id} を{delay:.0f}秒後に再試行します")
+        return
+
+    checked_at = datetime.now().isoformat()
+    fingerprint, availability = result
+    record_history(checked_at, facility_key, availability, cell_counts)
+    if queue.ack(job, {"checked_at": checked_at, "fingerprint": fingerprint, "availability": availability}):
+        print(f"✓ {job.id} 完了")
+    else:
+        print(f"⚠ {job.id} はリース切れのため結果を破棄しました")
+
+
+def work(queue, once=False):
+    """ジョブを取り出して処理し続ける"""
+    worker_id = os.getenv("WORKER_ID") or f"{socket.gethostname()}-{os.getpid()}"
+    poll_seconds = float(os.getenv("WORKER_POLL_SECONDS", "5"))
+    watchdog = low_memory.RssWatchdog().start()
+    print(f"🚀 ワーカー {worker_id} を開始しました")
+    try:
+        while True:
+            job = queue.lease(worker=worker_id)
+            if job is None:
+                if once:
+                    return
+                time.sleep(poll_seconds)
+                continue
+            try:
+                process(queue, job, watchdog)
+            except Exception as e:
+                queue.nack(job, str(e)[:500], delay=backoff_delay(job.attempts - 1, base=30.0, cap=300.0))
+                print(f"❌ {job.id}: {str(e)[:200]}")
+    finally:
+        watchdog.stop()
+
+
+def collect(queue, interval, deadline):
+    """間隔の全施設の結果を待ってまとめ、差分検出・Issue更新・Slack通知を行う
+
+    取得できた施設の結果は保存するが、失敗（デッドレター）・未完了の施設が1つでもあれば False を返す。
+    失敗・未完了の施設は前回の空き枠を引き継ぎ、_run と同じく STALE_KEY に古いデータとして記録する。
+    """
+    keys = facility_keys()
+    statuses = {}
+    while True:
+        statuses = {key: queue.status(job_id(key, interval)) for key in keys}
+        pending = [key for key, status in statuses.items() if status and status["state"] in ("ready", "leased")]
+        if not pending or deadline.remaining() < 60:
+            break
+        time.sleep(min(10, deadline.remaining() - 60))
+
+    previous_data = get_previous_data_from_issue(deadline) or {}
+    previous_slots = previous_data.get("availability", [])
+    fingerprints = dict(previous_data.get(FINGERPRINTS_KEY, {}))
+    availability = []
+    changed = False
+    incomplete = []
+
+    for key in keys:
+        status = statuses.get(key) or {"state": "missing"}
+        result = status.get("result") or {}
+        if status["state"] == "done" and result.get("availability") is not None:
+            availability += result["availability"]
+            fingerprints[key] = result["fingerprint"]
+            changed = True
+            continue
+        # 変化なし・失敗・未完了の施設は前回の空き枠を引き継ぐ
+        if status["state"] != "done":
+            incomplete.append(key)
+            print(f"⚠ {key}: {status['state']}（{status.get('error') or '結果なし'}）— 前回の空き枠を引き継ぎます")
+        availability += [slot for slot in previous_slots if slot["facility_key"] == key]
+
+    stale = stale_since(previous_data, incomplete)
+    # 前回のデータを取得できなかったときは、引き継ぐものがないので古いデータの記録だけで上書きしない
+    if not changed and (not previous_data or set(stale) == set(previous_data.get(STALE_KEY, {}))):
+        print("➡ 変化がないため差分検出・Issue更新・Slack通知をスキップします")
+        return not incomplete
+
+    current_data = {
+        "checked_at": datetime.now().isoformat(),
+        "availability": availability,
+        "count": len(availability),
+        FINGERPRINTS_KEY: fingerprints,
+        STALE_KEY: stale,
+        "jobs": {key: (statuses.get(key) or {}).get("state", "missing") for key in keys},
+    }
+    executor = ThreadPoolExecutor(max_workers=2)
+    try:
+        publish_results(executor, deadline, previous_data or None, current_data)
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
+    if incomplete:
+        print(f"❌ 取得できなかった施設があります: {', '.join(incomplete)}")
+    return not incomplete
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="施設チェックのジョブキュー")
+    parser.add_argument("command", choices=["schedule", "work", "collect", "run", "dead"])
+    parser.add_argument("--once", action="store_true", help="work: キューが空になったら終了")
+    parser.add_argument("--requeue", metavar="JOB_ID", help="dead: デッドレターのジョブを戻す")
+    args = parser.parse_args(argv)
+
+    queue = open_queue()
+    try:
+        if args.command == "schedule":
+            schedule(queue, get_previous_data_from_issue())
+        elif args.command == "work":
+            work(queue, once=args.once)
+        elif args.command in ("collect", "run"):
+            # まとめ役は Issue #2 を更新するので、他のチェッカーと同じロックを取る
+            with RunLock(RUN_LOCK_NAME) as lock:
+                if not lock.acquired:
+                    return 0
+                deadline = Deadline()
+                interval = current_interval()
+                if args.command == "run":
+                    interval = schedule(queue, get_previous_data_from_issue(deadline))
+                return 0 if collect(queue, interval, deadline) else 1
+        elif args.requeue:
+            print("✓ 戻しました" if queue.requeue(args.requeue) else "⚠ デッドレターにありません")
+        else:
+            for letter in queue.dead_letters():
+                print(f"💀 {letter['id']}（{letter['attempts']}回）: {letter['error']}")
+        return 0
+    finally:
+        queue.close()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,193 @@
+#!/usr/bin/env python3
+"""
+対象ホストごとのサーキットブレーカーと指数バックオフ
+
+サイト障害中や、設定したサービス停止時間帯に、タイムアウト待ちで何分も浪費しないための仕組み。
+直近の成功・失敗をホストごとにファイルへ記録し、失敗率が閾値を超えたらブレーカーを開く。
+開いている間はブラウザを起動せずに即座に失敗を返す。
+
+状態: closed（通常） → open（即時失敗） → half_open（1回だけ試行） → closed / open
+状態ファイルの読み書きは fcntl.flock で直列にし、half_open の試行は最初に許可された1回だけにする
+（試行した実行が結果を記録しないまま BREAKER_TRIAL_SECONDS が過ぎたら、次の呼び出しに試行させる）。
+
+設定（環境変数）:
+  CHECKER_STATE_DIR              実行をまたいで保持する状態の保存先（デフォルト: .checker_state）
+  BREAKER_WINDOW                 失敗率を計算する直近の試行数（デフォルト: 10）
+  BREAKER_MIN_CALLS              ブレーカーを開く判定に必要な最小試行数（デフォルト: 3）
+  BREAKER_FAILURE_RATE           ブレーカーを開く失敗率（デフォルト: 0.5）
+  BREAKER_OPEN_SECONDS           最初に開いている時間。連続して開くたびに倍増（デフォルト: 300）
+  BREAKER_MAX_OPEN_SECONDS       開いている時間の上限（デフォルト: 3600）
+  BREAKER_TRIAL_SECONDS          half_open の試行の結果を待つ秒数（デフォルト: 1800）
+  SUGINAMI_MAINTENANCE_WINDOWS   杉並区サイトの停止時間帯（JST, "HH:MM-HH:MM" をカンマ区切り。デフォルト: なし）
+"""
+
+import fcntl
+import json
+import os
+import random
+import tempfile
+import time
+from contextlib import contextmanager
+from datetime import datetime, timedelta, timezone
+
+JST = timezone(timedelta(hours=9))
+
+# ホストごとの停止時間帯を指定する環境変数（JST。設定しなければ停止時間帯はない）
+MAINTENANCE_WINDOW_ENV = {
+    "www.shisetsuyoyaku.city.suginami.tokyo.jp": "SUGINAMI_MAINTENANCE_WINDOWS",
+}
+
+
+def state_dir():
+    """実行をまたいで保持する状態ファイルのディレクトリ"""
+    path = os.getenv("CHECKER_STATE_DIR", ".checker_state")
+    os.makedirs(path, exist_ok=True)
+    return path
+
+
+def write_json_atomic(path, data):
+    """JSONを一時ファイル経由で書き込む（書き込み途中のファイルを読ませない）"""
+    directory = os.path.dirname(path) or "."
+    fd, tmp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+    try:
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump(data, f, ensure_ascii=False)
+        os.replace(tmp_path, path)
+    except Exception:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def parse_windows(spec):
+    """"HH:MM-HH:MM,..." を [(開始分, 終了分), ...] に変換する"""
+    windows = []
+    for part in (spec or "").split(","):
+        part = part.strip()
+        if not part:
+            continue
+        start, end = part.split("-")
+        start_h, start_m = start.split(":")
+        end_h, end_m = end.split(":")
+        windows.append((int(start_h) * 60 + int(start_m), int(end_h) * 60 + int(end_m)))
+    return windows
+
+
+def maintenance_windows(host):
+    """ホストの停止時間帯 [(開始分, 終了分), ...]（呼ばれるたびに環境変数を読む）"""
+    name = MAINTENANCE_WINDOW_ENV.get(host)
+    return parse_windows(os.getenv(name, "")) if name else []
+
+
+def in_maintenance_window(host, now=None):
+    """ホストが停止時間帯に入っているか"""
+    now = now or datetime.now(JST)
+    minute = now.hour * 60 + now.minute
+    for start, end in maintenance_windows(host):
+        if start <= end:
+            if start <= minute < end:
+                return True
+        elif minute >= start or minute < end:  # 日付をまたぐ時間帯
+            return True
+    return False
+
+
+def backoff_delay(attempt, base=5.0, cap=60.0):
+    """指数バックオフ（フルジッター）の待ち時間を返す。attemptは0始まり"""
+    return random.uniform(0, min(cap, base * (2 ** attempt)))
+
+
+class CircuitBreaker:
+    """ホスト単位のサーキットブレーカー（状態はファイルで全実行から共有）"""
+
+    def __init__(self, host, path=None):
+        self.host = host
+        self.path = path or os.path.join(state_dir(), "circuit_breaker.json")
+        self.window = int(os.getenv("BREAKER_WINDOW", "10"))
+        self.min_calls = int(os.getenv("BREAKER_MIN_CALLS", "3"))
+        self.failure_rate = float(os.getenv("BREAKER_FAILURE_RATE", "0.5"))
+        self.open_seconds = float(os.getenv("BREAKER_OPEN_SECONDS", "300"))
+        self.max_open_seconds = float(os.getenv("BREAKER_MAX_OPEN_SECONDS", "3600"))
+        self.trial_seconds = float(os.getenv("BREAKER_TRIAL_SECONDS", "1800"))
+
+    @contextmanager
+    def _locked(self):
+        """状態ファイルの読み込みから書き込みまでを直列にする（隣のファイルに fcntl.flock）"""
+        with open(f"{self.path}.lock", "w") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def _load_all(self):
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def _load(self):
+        state = self._load_all().get(self.host, {})
+        state.setdefault("state", "closed")
+        state.setdefault("results", [])
+        state.setdefault("trips", 0)
+        state.setdefault("open_until", 0)
+        state.setdefault("trial_until", 0)
+        return state
+
+    def _save(self, state):
+        all_states = self._load_all()
+        all_states[self.host] = state
+        write_json_atomic(self.path, all_states)
+
+    def allow(self):
+        """試行してよいかを返す。(許可, 理由)"""
+        if in_maintenance_window(self.host):
+            return False, "サービス停止時間帯"
+
+        with self._locked():
+            state = self._load()
+            now = time.time()
+            if state["state"] == "open":
+                remaining = state["open_until"] - now
+                if remaining > 0:
+                    return False, f"ブレーカー開放中（残り{int(remaining)}秒）"
+                state["state"] = "half_open"
+            elif state["state"] == "half_open":
+                # 他の実行が試行中なら、その結果が出るまで待たせる
+                if state["trial_until"] > now:
+                    return False, f"ブレーカー半開で試行中（残り{int(state['trial_until'] - now)}秒）"
+            else:
+                return True, state["state"]
+            state["trial_until"] = now + self.trial_seconds
+            self._save(state)
+        return True, state["state"]
+
+    def record_success(self):
+        with self._locked():
+            state = self._load()
+            state["results"] = (state["results"] + [1])[-self.window:]
+            state["state"] = "closed"
+            state["trips"] = 0
+            state["trial_until"] = 0
+            self._save(state)
+
+    def record_failure(self):
+        with self._locked():
+            state = self._load()
+            state["results"] = (state["results"] + [0])[-self.window:]
+            results = state["results"]
+            failures = results.count(0)
+
+            should_open = state["state"] == "half_open" or (
+                len(results) >= self.min_calls and failures / len(results) >= self.failure_rate
+            )
+            if should_open:
+                open_for = min(self.max_open_seconds, self.open_seconds * (2 ** state["trips"]))
+                state["state"] = "open"
+                state["trips"] += 1
+                state["open_until"] = time.time() + open_for
+                state["trial_until"] = 0
+                print(f"⚠ {self.host} のブレーカーを開きました（{int(open_for)}秒間、失敗 {failures}/{len(results)}）")
+            self._save(state)
@@ -0,0 +1,114 @@
+#!/usr/bin/env python3
+"""
+空き枠の差分イベントのプロセス内イベントバス
+
+availability_api.py が状態データを読み直したときに、前回読んだ状態との差分（空き枠の追加・削除）を
+1件ずつイベントとして発行し、/events がServer-Sent Eventsで配信する。
+チェッカーは別プロセス（GitHub Actions・cron）で動くので、イベントはチェッカーが状態を保存してから
+APIが読み直すまで遅れる（ローカルキャッシュなら AVAILABILITY_API_REFRESH_SECONDS の2秒、Issueなら60秒以内）。
+直近のイベントはリングバッファに残し、再接続したクライアントはカーソル
+（SSEの Last-Event-ID）から続きを受け取れる。バッファから溢れた古いカーソルや、
+プロセスの再起動前のカーソルには "reset" イベントを返す（/availability を取り直す合図）。
+
+イベントの形式:
+  {"id": "<バスの起動時刻>-<連番>", "type": "added" | "removed", "checked_at": ..., "slot": {従来の空き枠の辞書}}
+
+設定（環境変数）:
+  EVENT_BUS_BUFFER   保持するイベント数（デフォルト: 1000）
+"""
+
+import os
+import threading
+import time
+from collections import deque
+
+from suginami_slots import slots_from_legacy, slots_to_legacy
+
+
+class EventBus:
+    """イベントの発行と、カーソル以降のイベントの待ち受け（スレッドセーフ）"""
+
+    def __init__(self, size=None):
+        self.epoch = str(int(time.time() * 1000))
+        self._events = deque(maxlen=size or int(os.getenv("EVENT_BUS_BUFFER", "1000")))
+        self._seq = 0
+        self._last_checked_at = None
+        self._condition = threading.Condition()
+
+    def publish(self, event_type, slot, checked_at=None):
+        with self._condition:
+            self._seq += 1
+            self._events.append({
+                "id": f"{self.epoch}-{self._seq}",
+                "seq": self._seq,
+                "type": event_type,
+                "checked_at": checked_at,
+                "slot": slot,
+            })
+            self._condition.notify_all()
+
+    def publish_diff(self, checked_at, previous_availability, availability):
+        """前回と今回の空き枠の差分を発行する。同じ checked_at の差分は1度だけ発行する
+
+        発行したイベント数を返す。
+        """
+        previous = set(slots_from_legacy(previous_availability))
+        current = slots_from_legacy(availability)
+        current_set = set(current)
+        added = [slot for slot in current if slot not in previous]
+        removed = [slot for slot in previous if slot not in current_set]
+
+        with self._condition:
+            if checked_at is not None and checked_at == self._last_checked_at:
+                return 0
+            self._last_checked_at = checked_at
+            for slot in slots_to_legacy(added):
+                self.publish("added", slot, checked_at)
+            for slot in slots_to_legacy(removed):
+                self.publish("removed", slot, checked_at)
+        return len(added) + len(removed)
+
+    def cursor(self):
+        """現在の末尾を指すカーソル（これ以降のイベントだけを受け取る）"""
+        with self._condition:
+            return f"{self.epoch}-{self._seq}"
+
+    def _after(self, seq):
+        return [event for event in self._events if event["seq"] > seq]
+
+    def wait(self, cursor=None, timeout=15.0):
+        """cursor より後のイベントを返す。なければ timeout 秒まで待つ
+
+        (イベントのリスト, 取りこぼしがあるか) を返す。
+        取りこぼしがある場合（再起動前のカーソル、またはバッファから溢れたカーソル）は
+        保持している全イベントを返す。
+        """
+        with self._condition:
+            epoch, _, seq_text = (cursor or "").rpartition("-")
+            if not cursor:
+                seq, missed = self._seq, False
+            elif epoch != self.epoch or not seq_text.isdigit():
+                seq, missed = 0, True
+            else:
+                seq = int(seq_text)
+                oldest = self._events[0]["seq"] if self._events else self._seq + 1
+                missed = seq < oldest - 1
+
+            events = self._after(seq)
+            if not events:
+                self._condition.wait_for(lambda: self._seq > seq, timeout=timeout)
+                events = self._after(seq)
+            return events, missed
+
+
+_default_bus = None
+_default_lock = threading.Lock()
+
+
+def default_bus():
+    """プロセス共通のイベントバス"""
+    global _default_bus
+    with _default_lock:
+        if _default_bus is None:
+            _default_bus = EventBus()
+        return _default_bus
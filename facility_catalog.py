@@ -0,0 +1,412 @@
+#!/usr/bin/env python3
+"""
+杉並区施設予約サイトの施設・部屋カタログ（IDの索引）
+
+分類（集会施設など）→ 施設 → 部屋 を一度だけ巡回して、施設と部屋のチェックボックスのID・値を記録する。
+チェック時は部屋名の文字列で表を走査せず、記録したIDで施設と部屋を1回の操作で選択する。
+カタログはファイルにキャッシュし、有効期限が切れた施設や、見つからない施設・部屋を引いたときだけ
+その分類・施設を巡回し直す（refresh on miss）。
+巡回し直す・記録を期限切れにするときは、カタログのファイルを fcntl.flock で直列にして読み直してから書くので、
+並行するシャード・ワーカーが同時に巡回したり、互いの書き込みを消したりしない。
+
+使い方:
+  python facility_catalog.py crawl [--category 集会施設] [--facility セシオン杉並]   # 巡回してキャッシュを更新
+  python facility_catalog.py list                                                  # キャッシュの一覧
+  python facility_catalog.py find 体育室                                           # 施設名・部屋名で検索
+
+  catalog = FacilityCatalog.load()
+  target = catalog.ensure(page, "セシオン杉並", ["体育室全面"])   # 見つからなければ巡回し直す（page=None ならその時だけブラウザを起動）
+  # → {"category": "集会施設", "facility": {...}, "rooms": [{...}, ...]} または None（文字列で選択する）
+  select_by_key(page, target["rooms"], ["体育室全面"])          # 選んだ行の部屋名を確かめる。違えば 0
+
+設定（環境変数）:
+  FACILITY_CATALOG_TTL_HOURS   施設・部屋の記録の有効期限（デフォルト: 168 = 1週間）
+  FACILITY_CATALOG_CATEGORY    分類の指定がない施設の分類（デフォルト: 集会施設）
+"""
+
+import argparse
+import fcntl
+import json
+import os
+import sys
+import time
+from contextlib import contextmanager
+
+import rate_limit
+from circuit_breaker import state_dir, write_json_atomic
+from run_deadline import playwright_timeout
+
+SUGINAMI_HOST = "www.shisetsuyoyaku.city.suginami.tokyo.jp"
+SUGINAMI_HOME_URL = f"https://{SUGINAMI_HOST}/user/Home"
+CATALOG_FILE = "facility_catalog.json"
+CATALOG_VERSION = 2
+
+# 見つからなかった施設を巡回し直す最短の間隔（存在しない部屋を毎回巡回しないため）
+MISS_REFRESH_SECONDS = 3600
+
+
+def default_category():
+    return os.getenv("FACILITY_CATALOG_CATEGORY", "集会施設")
+
+
+def ttl_seconds():
+    return float(os.getenv("FACILITY_CATALOG_TTL_HOURS", "168")) * 3600
+
+
+def catalog_path():
+    return os.path.join(state_dir(), CATALOG_FILE)
+
+
+# 分類ボタン（既定の分類ボタンと同じ並びにあるボタン）の名前
+LIST_CATEGORIES_JS = """
+    (anchor) => {
+        const button = Array.from(document.querySelectorAll('button')).find(b => b.textContent.trim() === anchor);
+        if (!button) return [];
+        return Array.from(button.parentElement.querySelectorAll('button'))
+            .map(b => b.textContent.trim()).filter(text => text);
+    }
+"""
+
+# チェックボックス付きのラベル（名前・ID・値・name 属性）
+LIST_LABELS_JS = """
+    () => Array.from(document.querySelectorAll('label')).map(label => {
+        const input = label.control || label.querySelector('input');
+        if (!input || input.type !== 'checkbox') return null;
+        return {name: label.textContent.trim(), id: input.id || '', value: input.value || '', param: input.name || ''};
+    }).filter(item => item && item.name)
+"""
+
+# 施設別空き状況の表の各行（部屋名と、行の最初のチェックボックスのID・値・name 属性）
+LIST_ROOMS_JS = """
+    () => Array.from(document.querySelectorAll('tr')).map(row => {
+        const cell = row.querySelector('td:first-child');
+        const input = row.querySelector('input[type="checkbox"]');
+        if (!cell || !input) return null;
+        return {name: cell.textContent.trim(), id: input.id || '', value: input.value || '', param: input.name || ''};
+    }).filter(item => item && item.name)
+"""
+
+# 記録したID・値のチェックボックスを（未チェックの場合だけ）クリックし、チェック済みの数を返す
+CHECK_BY_KEY_JS = """
+    ([targets, click]) => {
+        let count = 0;
+        targets.forEach(([by, key]) => {
+            const input = by === 'id'
+                ? document.getElementById(key)
+                : document.querySelector(`input[type="checkbox"][value="${CSS.escape(key)}"]`);
+            if (!input) return;
+            if (click && !input.checked) {
+                const label = input.closest('label') || (input.id && document.querySelector(`label[for="${CSS.escape(input.id)}"]`));
+                (label || input).click();
+            }
+            if (input.checked) count++;
+        });
+        return count;
+    }
+"""
+
+# 記録したID・値のチェックボックスのうち、チェック済みのものをクリックして外す
+UNCHECK_BY_KEY_JS = """
+    (targets) => {
+        targets.forEach(([by, key]) => {
+            const input = by === 'id'
+                ? document.getElementById(key)
+                : document.querySelector(`input[type="checkbox"][value="${CSS.escape(key)}"]`);
+            if (!input || !input.checked) return;
+            const label = input.closest('label') || (input.id && document.querySelector(`label[for="${CSS.escape(input.id)}"]`));
+            (label || input).click();
+        });
+    }
+"""
+
+# 記録したID・値のチェックボックスがすべてチェック済みで、そのラベルか行に names のいずれかを含むか
+VERIFY_BY_KEY_JS = """
+    ([targets, names]) => targets.every(([by, key]) => {
+        const input = by === 'id'
+            ? document.getElementById(key)
+            : document.querySelector(`input[type="checkbox"][value="${CSS.escape(key)}"]`);
+        if (!input || !input.checked) return false;
+        const label = input.closest('label') || (input.id && document.querySelector(`label[for="${CSS.escape(input.id)}"]`));
+        const texts = [label, input.closest('tr')].filter(node => node).map(node => node.textContent);
+        return texts.some(text => names.some(name => text.includes(name)));
+    })
+"""
+
+
+def _with_keys(items):
+    """各項目に選択に使う識別子（by: "value" / "id", key）を付ける
+
+    値が一意ならチェックボックスの値、そうでなければID。どちらも使えない項目は key が None になる。
+    """
+    values = [item["value"] for item in items]
+    ids = [item["id"] for item in items]
+    result = []
+    for item in items:
+        entry = {"name": item["name"], "id": item["id"], "value": item["value"], "param": item.get("param", ""),
+                 "by": None, "key": None}
+        if item["value"] and item["value"] != "on" and values.count(item["value"]) == 1:
+            entry["by"], entry["key"] = "value", item["value"]
+        elif item["id"] and ids.count(item["id"]) == 1:
+            entry["by"], entry["key"] = "id", item["id"]
+        result.append(entry)
+    return result
+
+
+def selectors(entries):
+    """CHECK_BY_KEY_JS に渡す [[by, key], ...]"""
+    return [[entry["by"], entry["key"]] for entry in entries]
+
+
+def select_by_key(page, entries, names):
+    """記録したIDで選択し、選んだチェックボックスのラベル・行が names のいずれかを含むか確かめる
+
+    チェック済みの数を返す。選べない・別の施設や部屋を選んでいた（IDが使い回された）ときは
+    選択を外して 0 を返す（呼び出し側は文字列で選択し直す）。
+    """
+    targets = selectors(entries)
+    checked = page.evaluate(CHECK_BY_KEY_JS, [targets, True])
+    if checked == len(targets) and page.evaluate(VERIFY_BY_KEY_JS, [targets, names]):
+        return checked
+    page.evaluate(UNCHECK_BY_KEY_JS, targets)
+    return 0
+
+
+def _open_category(page, category, deadline=None):
+    rate_limit.acquire(SUGINAMI_HOST, deadline=deadline)
+    page.goto(SUGINAMI_HOME_URL, wait_until="domcontentloaded", timeout=playwright_timeout(deadline, 60000))
+    page.wait_for_selector(f"button:text('{default_category()}')", timeout=playwright_timeout(deadline, 30000),
+                           state="visible")
+    before = {item["name"] for item in page.evaluate(LIST_LABELS_JS)}
+    page.click(f"button:text('{category}')")
+    page.wait_for_selector("label", timeout=playwright_timeout(deadline, 15000), state="visible")
+    page.wait_for_timeout(500)
+    # 分類を選ぶ前からあるラベルは施設ではない
+    return [item for item in page.evaluate(LIST_LABELS_JS) if item["name"] not in before]
+
+
+def _crawl_rooms(page, category, facility, deadline=None):
+    _open_category(page, category, deadline)
+    if not select_by_key(page, [facility], [facility["name"]]):
+        raise RuntimeError(f"施設を選択できません: {facility['name']}")
+    rate_limit.acquire(SUGINAMI_HOST, deadline=deadline)
+    page.click("button[aria-label='次へ進む']")
+    page.wait_for_selector("h2:text('施設別空き状況')", timeout=playwright_timeout(deadline, 30000))
+    rate_limit.acquire(SUGINAMI_HOST, deadline=deadline)
+    page.click("button:text('表示')")
+    try:
+        page.wait_for_selector("tr td:first-child", timeout=playwright_timeout(deadline, 30000))
+    except Exception:
+        # 部屋の表が出ない施設（予約対象の部屋がない）
+        return []
+    return _with_keys(page.evaluate(LIST_ROOMS_JS))
+
+
+class FacilityCatalog:
+    """施設・部屋のIDの索引（facility_catalog.json）"""
+
+    def __init__(self, data=None, path=None):
+        self.path = path or catalog_path()
+        self.data = data or {"version": CATALOG_VERSION, "categories": {}, "facilities": {}}
+
+    @classmethod
+    def load(cls, path=None):
+        path = path or catalog_path()
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            if data.get("version") == CATALOG_VERSION:
+                return cls(data, path)
+        except (OSError, ValueError):
+            pass
+        return cls(path=path)
+
+    def save(self):
+        write_json_atomic(self.path, self.data)
+
+    @contextmanager
+    def locked(self):
+        """他の実行・スレッドと直列にしてファイルから読み直す（隣のファイルに fcntl.flock）"""
+        with open(f"{self.path}.lock", "w") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                self.data = FacilityCatalog.load(self.path).data
+                yield self
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+    @property
+    def facilities(self):
+        return self.data["facilities"]
+
+    def _fresh(self, crawled_at):
+        return crawled_at is not None and time.time() - crawled_at < ttl_seconds()
+
+    def facility(self, facility_name):
+        """施設名（完全一致、なければ部分一致）の記録。なければ None"""
+        if facility_name in self.facilities:
+            return self.facilities[facility_name]
+        matches = [entry for name, entry in self.facilities.items() if facility_name in name]
+        return matches[0] if len(matches) == 1 else None
+
+    def resolve(self, facility_name, room_names):
+        """施設と、部屋名を含む部屋の記録を返す
+
+        記録がない・期限切れ・IDで選択できない場合は None を返す（呼び出し側は巡回し直すか文字列で選択する）。
+        """
+        facility = self.facility(facility_name)
+        if not facility or not facility["key"] or not self._fresh(facility.get("rooms_crawled_at")):
+            return None
+        rooms = [room for room in facility["rooms"] if any(name in room["name"] for name in room_names)]
+        if not rooms or not all(room["key"] for room in rooms):
+            return None
+        return {"category": facility["category"], "facility": facility, "rooms": rooms}
+
+    def crawl(self, page, categories=None, facility_names=None, deadline=None):
+        """分類・施設・部屋を巡回して記録を更新する
+
+        categories が None ならサイトの全分類、facility_names が None なら巡回した分類の全施設の部屋を調べる。
+        deadline（run_deadline.Deadline）を渡すと、各ページの待機を残り時間までに抑える。
+        """
+        if categories is None:
+            page.goto(SUGINAMI_HOME_URL, wait_until="domcontentloaded", timeout=playwright_timeout(deadline, 60000))
+            page.wait_for_selector(f"button:text('{default_category()}')", timeout=playwright_timeout(deadline, 30000),
+                                   state="visible")
+            categories = page.evaluate(LIST_CATEGORIES_JS, default_category())
+
+        for category in categories:
+            print(f"🗂 分類「{category}」の施設を巡回中...")
+            now = time.time()
+            listed = _with_keys(_open_category(page, category, deadline))
+            # 分類から消えた施設の記録を捨てる
+            names = {facility["name"] for facility in listed}
+            for name in [name for name, entry in self.facilities.items()
+                         if entry["category"] == category and name not in names]:
+                del self.facilities[name]
+            for facility in listed:
+                previous = self.facilities.get(facility["name"], {})
+                facility.update(category=category,
+                                rooms=previous.get("rooms", []),
+                                rooms_crawled_at=previous.get("rooms_crawled_at"))
+                self.facilities[facility["name"]] = facility
+            self.data["categories"][category] = now
+
+            for name, facility in self.facilities.items():
+                if facility["category"] != category or not facility["key"]:
+                    continue
+                if facility_names is not None and not any(target in name for target in facility_names):
+                    continue
+                try:
+                    if deadline:
+                        deadline.check(f"{name}の部屋の巡回")
+                    facility["rooms"] = _crawl_rooms(page, category, facility, deadline)
+                    facility["rooms_crawled_at"] = time.time()
+                    print(f"  ✓ {name}: 部屋 {len(facility['rooms'])}件")
+                except Exception as e:
+                    print(f"  ⚠ {name}: 部屋を取得できませんでした: {str(e)[:100]}")
+
+        self.data["crawled_at"] = time.time()
+        self.save()
+
+    def ensure(self, page, facility_name, room_names, category=None, deadline=None):
+        """resolve() して、見つからなければその施設の分類だけ巡回し直してもう一度引く
+
+        巡回はカタログのロックの中で行うので、同時に呼んだ他の実行は巡回を待ってその結果を使う。
+        page が None なら、巡回が必要なときだけ巡回用のブラウザを起動する。
+        巡回に失敗しても（締め切りを過ぎても）例外は出さずに None を返す（文字列での選択に任せる）。
+        """
+        target = self.resolve(facility_name, room_names)
+        if target is not None:
+            return target
+
+        with self.locked():
+            target = self.resolve(facility_name, room_names)
+            if target is not None:
+                return target
+            known = self.facility(facility_name)
+            if known and known.get("rooms_crawled_at") and time.time() - known["rooms_crawled_at"] < MISS_REFRESH_SECONDS:
+                return None
+            categories = [category or (known or {}).get("category") or default_category()]
+            print(f"🗂 カタログに {facility_name} の部屋がないため巡回し直します")
+            try:
+                if page is None:
+                    with crawl_page() as page:
+                        self.crawl(page, categories=categories, facility_names=[facility_name], deadline=deadline)
+                else:
+                    self.crawl(page, categories=categories, facility_names=[facility_name], deadline=deadline)
+            except Exception as e:
+                print(f"⚠ カタログを更新できませんでした: {str(e)[:200]}")
+                return None
+
+        target = self.resolve(facility_name, room_names)
+        if target is None:
+            print(f"⚠ カタログに {facility_name} の {', '.join(room_names)} が見つかりません。部屋名で選択します")
+        return target
+
+    def invalidate(self, facility_name):
+        """施設の部屋の記録を期限切れにする（次に ensure() したときに巡回し直す）"""
+        with self.locked():
+            facility = self.facility(facility_name)
+            if facility and facility.get("rooms_crawled_at") is not None:
+                facility["rooms_crawled_at"] = None
+                self.save()
+                print(f"🗂 カタログの {facility['name']} の記録を次回巡回し直します")
+
+    def find(self, text):
+        """施設名か部屋名に text を含む (分類, 施設, 部屋) の一覧"""
+        results = []
+        for name, facility in self.facilities.items():
+            for room in facility["rooms"]:
+                if text in name or text in room["name"]:
+                    results.append((facility["category"], facility, room))
+        return results
+
+
+@contextmanager
+def crawl_page():
+    """巡回用のブラウザを起動してページを返す"""
+    from playwright.sync_api import sync_playwright
+
+    import low_memory
+
+    with sync_playwright() as p:
+        browser = p.chromium.launch(headless=True, args=low_memory.chromium_args())
+        try:
+            context = browser.new_context(viewport=low_memory.viewport(), locale="ja-JP", timezone_id="Asia/Tokyo")
+            low_memory.block_heavy_resources(context)
+            yield context.new_page()
+        finally:
+            browser.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="施設・部屋カタログ")
+    parser.add_argument("command", choices=["crawl", "list", "find"])
+    parser.add_argument("text", nargs="?", help="find: 施設名・部屋名の一部")
+    parser.add_argument("--category", action="append", help="crawl: 巡回する分類（複数可。デフォルト: すべて）")
+    parser.add_argument("--facility", action="append", help="crawl: 部屋を調べる施設（複数可。デフォルト: すべて）")
+    args = parser.parse_args(argv)
+
+    catalog = FacilityCatalog.load()
+
+    if args.command == "crawl":
+        with catalog.locked(), crawl_page() as page:
+            catalog.crawl(page, categories=args.category, facility_names=args.facility)
+        print(f"✓ {len(catalog.facilities)}施設を記録しました: {catalog.path}")
+        return 0
+
+    if args.command == "find" and not args.text:
+        parser.error("find には検索する文字列が必要です")
+
+    if args.command == "list":
+        for name, facility in sorted(catalog.facilities.items(), key=lambda item: (item[1]["category"], item[0])):
+            print(f"[{facility['category']}] {name}（{facility['by']}={facility['key']}）")
+            for room in facility["rooms"]:
+                print(f"    {room['name']}（{room['by']}={room['key']}）")
+    else:
+        for category, facility, room in catalog.find(args.text):
+            print(f"[{category}] {facility['name']} / {room['name']}（{room['by']}={room['key']}）")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,277 @@
+#!/usr/bin/env python3
+"""
+空き状況の履歴（history_store.py）の保持期間と縮約
+
+30分ごとのスナップショットをすべて残すと、履歴のファイルは際限なく大きくなる。
+直近（HISTORY_FULL_DAYS日）はスナップショットと空き枠をそのまま残し、それより古いものは
+  - 空き枠の変化（空いた・埋まった時刻）だけを slot_changes に
+  - 1時間ごとの空き枠数・セル数の合計を aggregates に
+まとめてから削除する。HISTORY_HOURLY_DAYS日より古い1時間ごとの合計は1日ごとの合計にまとめ直す。
+1回に縮約するスナップショットの数に上限があるので、チェッカーの実行ごとに少しずつ進む（incremental）。
+削除した領域はファイルの中で再利用し、auto_vacuum=INCREMENTAL のファイルではディスクにも返す。
+
+使い方:
+  python history_retention.py compact [--all] [--vacuum]   # 縮約する（--all は残りがなくなるまで）
+  python history_retention.py stats                        # 行数とファイルサイズ
+  python history_retention.py trend [--facility nishiogi] [--since YYYY-MM-DD]   # 日ごとの空き枠数・満室率
+  共通オプション: --db 履歴ファイル（デフォルト: SUGINAMI_HISTORY_DB）
+
+設定（環境変数）:
+  HISTORY_FULL_DAYS        スナップショットをそのまま残す日数（デフォルト: 14）
+  HISTORY_HOURLY_DAYS      1時間ごとの合計を残す日数。これより古いものは1日ごと（デフォルト: 90）
+  HISTORY_RETENTION_DAYS   変化・1日ごとの合計を残す日数。0 なら削除しない（デフォルト: 730）
+  HISTORY_COMPACT_BATCH    1回に縮約する施設ごとのスナップショットの数（デフォルト: 500）
+"""
+
+import argparse
+import os
+import sys
+import time
+from datetime import date, timedelta
+
+import history_store
+from circuit_breaker import state_dir
+from suginami_slots import FACILITIES
+
+# 日ごとの区切りは日本時間の0時
+JST_OFFSET = 9 * 3600
+DAY = 86400
+HOUR = 3600
+
+# aggregates の合計する列（snapshots 以降）
+AGGREGATE_COLUMNS = ["snapshots", "slots", "counted", "vacant", "full", "other", "total"]
+
+UPSERT_AGGREGATE = f"""
+    INSERT INTO aggregates (facility, period, bucket, {", ".join(AGGREGATE_COLUMNS)})
+    VALUES (?, ?, ?, {", ".join("?" for _ in AGGREGATE_COLUMNS)})
+    ON CONFLICT (facility, period, bucket) DO UPDATE SET
+    {", ".join(f"{column} = {column} + excluded.{column}" for column in AGGREGATE_COLUMNS)}
+"""
+
+
+def _days(name, default):
+    return float(os.getenv(name, default))
+
+
+def day_bucket(epoch):
+    """epoch秒 → その日（日本時間）の0時のepoch秒"""
+    return (epoch + JST_OFFSET) // DAY * DAY - JST_OFFSET
+
+
+def _rehome_slots(conn, ids):
+    """削除するスナップショット ids の空き枠を、まだ指している（same_as）残りのスナップショットに移す
+
+    指しているうち最も古いスナップショットが空き枠を持ち、ほかはそれを指し直す。
+    """
+    deleted = set(ids)
+    for source in ids:
+        referrers = [row[0] for row in conn.execute(
+            "SELECT id FROM snapshots WHERE same_as = ? ORDER BY checked_at, id", (source,)) if row[0] not in deleted]
+        if not referrers:
+            continue
+        owner = referrers[0]
+        conn.execute("UPDATE slots SET snapshot = ? WHERE snapshot = ?", (owner, source))
+        conn.execute("UPDATE snapshots SET same_as = NULL WHERE id = ?", (owner,))
+        conn.execute("UPDATE snapshots SET same_as = ? WHERE same_as = ? AND id != ?", (owner, source, owner))
+
+
+def compact_facility(conn, facility, cutoff, batch):
+    """1施設の cutoff より古いスナップショットを最大 batch 件、変化と1時間ごとの合計に縮約する。縮約した件数を返す"""
+    with conn:
+        snapshots = conn.execute(
+            "SELECT id, checked_at, vacant, full, other, total FROM snapshots"
+            " WHERE facility = ? AND checked_at < ? ORDER BY checked_at, id LIMIT ?",
+            (facility, cutoff, batch),
+        ).fetchall()
+        if not snapshots:
+            return 0
+
+        previous = set(conn.execute(
+            "SELECT room, day, start, end FROM retention_baseline WHERE facility = ?", (facility,)))
+        changes = []
+        buckets = {}
+        for snapshot_id, checked_at, vacant, full, other, total in snapshots:
+            current = set(conn.execute(
+                f"SELECT room, day, start, end FROM snapshots JOIN slots ON slots.snapshot = {history_store.SLOTS_OF}"
+                " WHERE snapshots.id = ?", (snapshot_id,)))
+            changes += [(checked_at, facility, *slot, 1) for slot in current - previous]
+            changes += [(checked_at, facility, *slot, 0) for slot in previous - current]
+            previous = current
+
+            sums = buckets.setdefault(checked_at // HOUR * HOUR, [0] * len(AGGREGATE_COLUMNS))
+            counted = total is not None
+            for index, value in enumerate((1, len(current), int(counted), vacant or 0, full or 0, other or 0,
+                                           total or 0)):
+                sums[index] += value
+
+        conn.executemany(
+            "INSERT INTO slot_changes (checked_at, facility, room, day, start, end, vacant) VALUES (?, ?, ?, ?, ?, ?, ?)",
+            changes)
+        conn.executemany(UPSERT_AGGREGATE, [(facility, "hour", bucket, *sums) for bucket, sums in buckets.items()])
+        conn.execute("DELETE FROM retention_baseline WHERE facility = ?", (facility,))
+        conn.executemany("INSERT INTO retention_baseline (facility, room, day, start, end) VALUES (?, ?, ?, ?, ?)",
+                         [(facility, *slot) for slot in previous])
+        ids = [(snapshot[0],) for snapshot in snapshots]
+        _rehome_slots(conn, [snapshot[0] for snapshot in snapshots])
+        conn.executemany("DELETE FROM slots WHERE snapshot = ?", ids)
+        conn.executemany("DELETE FROM snapshots WHERE id = ?", ids)
+    return len(snapshots)
+
+
+def rollup_daily(conn, cutoff):
+    """cutoff より古い1時間ごとの合計を1日ごとの合計にまとめる。まとめた行数を返す"""
+    with conn:
+        rows = conn.execute(
+            f"SELECT facility, bucket, {', '.join(AGGREGATE_COLUMNS)} FROM aggregates"
+            " WHERE period = 'hour' AND bucket < ?", (day_bucket(cutoff),)).fetchall()
+        if not rows:
+            return 0
+        days = {}
+        for facility, bucket, *values in rows:
+            sums = days.setdefault((facility, day_bucket(bucket)), [0] * len(AGGREGATE_COLUMNS))
+            for index, value in enumerate(values):
+                sums[index] += value
+        conn.executemany(UPSERT_AGGREGATE, [(facility, "day", bucket, *sums) for (facility, bucket), sums in days.items()])
+        conn.execute("DELETE FROM aggregates WHERE period = 'hour' AND bucket < ?", (day_bucket(cutoff),))
+    return len(rows)
+
+
+def expire(conn, cutoff):
+    """cutoff より古い変化と合計を削除する。削除した行数を返す"""
+    with conn:
+        removed = conn.execute("DELETE FROM slot_changes WHERE checked_at < ?", (cutoff,)).rowcount
+        removed += conn.execute("DELETE FROM aggregates WHERE bucket < ?", (day_bucket(cutoff),)).rowcount
+    return removed
+
+
+def reclaim(conn, vacuum=False):
+    """削除した領域をディスクに返す
+
+    auto_vacuum=INCREMENTAL のファイルは空きページだけを返す。それ以外のファイルは vacuum=True のときだけ
+    VACUUM で作り直す（以後は INCREMENTAL になる）。
+    """
+    if vacuum:
+        conn.execute("PRAGMA auto_vacuum=INCREMENTAL")
+        conn.execute("VACUUM")
+    elif conn.execute("PRAGMA auto_vacuum").fetchone()[0] == 2:
+        conn.execute("PRAGMA incremental_vacuum")
+    conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+
+
+def compact(conn, now=None, batch=None, vacuum=False):
+    """保持期間に従って縮約する（施設ごとに最大 batch 件）。{縮約したスナップショット, まとめた行, 削除した行} を返す"""
+    now = int(time.time() if now is None else now)
+    batch = batch or int(os.getenv("HISTORY_COMPACT_BATCH", "500"))
+    full_cutoff = now - int(_days("HISTORY_FULL_DAYS", "14") * DAY)
+    hourly_cutoff = now - int(_days("HISTORY_HOURLY_DAYS", "90") * DAY)
+    retention_days = _days("HISTORY_RETENTION_DAYS", "730")
+
+    result = {"snapshots": 0, "rolled_up": 0, "expired": 0}
+    for facility in history_store.names(conn, "facility"):
+        result["snapshots"] += compact_facility(conn, facility, full_cutoff, batch)
+    result["rolled_up"] = rollup_daily(conn, hourly_cutoff)
+    if retention_days > 0:
+        result["expired"] = expire(conn, now - int(retention_days * DAY))
+    if any(result.values()) or vacuum:
+        reclaim(conn, vacuum)
+    return result
+
+
+def pending(conn, now=None):
+    """まだ縮約していない、保持期間を過ぎたスナップショットの数"""
+    now = int(time.time() if now is None else now)
+    cutoff = now - int(_days("HISTORY_FULL_DAYS", "14") * DAY)
+    return conn.execute("SELECT COUNT(*) FROM snapshots WHERE checked_at < ?", (cutoff,)).fetchone()[0]
+
+
+def compacted_before(conn, facility_key):
+    """施設のスナップショットを縮約した境界（epoch秒。これより前のスナップショットはもうない）
+
+    縮約していなければ None。スナップショットがすべて縮約済みなら現在時刻。
+    """
+    facility_ids = {name: key for key, name in history_store.names(conn, "facility").items()}
+    facility = facility_ids.get(facility_key)
+    if facility is None or not conn.execute(
+            "SELECT 1 FROM aggregates WHERE facility = ? LIMIT 1", (facility,)).fetchone():
+        return None
+    oldest = conn.execute("SELECT MIN(checked_at) FROM snapshots WHERE facility = ?", (facility,)).fetchone()[0]
+    return int(time.time()) if oldest is None else oldest
+
+
+def daily_trend(conn, facility_key, since=None):
+    """日ごとの (日付, スナップショット数, 平均空き枠数, 満室率%) の一覧
+
+    縮約済みの合計と、まだ縮約していないスナップショットを合わせて集計する。
+    """
+    facility_ids = {name: key for key, name in history_store.names(conn, "facility").items()}
+    if facility_key not in facility_ids:
+        return []
+    facility = facility_ids[facility_key]
+    start = (since - date(1970, 1, 1)).days * DAY - JST_OFFSET if since else 0
+    rows = conn.execute(
+        f"""
+        SELECT day, SUM(snapshots), SUM(slots), SUM(full), SUM(total) FROM (
+            SELECT (bucket + ?) / ? AS day, snapshots, slots, full, total
+            FROM aggregates WHERE facility = ? AND bucket >= ?
+            UNION ALL
+            SELECT (checked_at + ?) / ?, 1, (SELECT COUNT(*) FROM slots WHERE snapshot = {history_store.SLOTS_OF}),
+                   COALESCE(full, 0), COALESCE(total, 0)
+            FROM snapshots WHERE facility = ? AND checked_at >= ?
+        ) GROUP BY day ORDER BY day
+        """,
+        (JST_OFFSET, DAY, facility, start, JST_OFFSET, DAY, facility, start),
+    ).fetchall()
+    epoch = date(1970, 1, 1)
+    return [(epoch + timedelta(days=day), count, slots / count, full / total * 100 if total else None)
+            for day, count, slots, full, total in rows]
+
+
+def stats(conn, path):
+    tables = ["snapshots", "slots", "slot_changes", "aggregates", "retention_baseline"]
+    counts = {table: conn.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0] for table in tables}
+    size = sum(os.path.getsize(f"{path}{suffix}") for suffix in ("", "-wal") if os.path.exists(f"{path}{suffix}"))
+    return counts, size
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="空き状況の履歴の保持期間と縮約")
+    parser.add_argument("command", choices=["compact", "stats", "trend"])
+    parser.add_argument("--db", help="履歴のSQLiteファイル（デフォルト: SUGINAMI_HISTORY_DB）")
+    parser.add_argument("--all", action="store_true", help="縮約するスナップショットがなくなるまで繰り返す")
+    parser.add_argument("--vacuum", action="store_true", help="VACUUMでファイルを作り直す（以後は少しずつ返す）")
+    parser.add_argument("--facility", default="nishiogi", choices=sorted(FACILITIES))
+    parser.add_argument("--since", help="この日以降（YYYY-MM-DD）")
+    args = parser.parse_args(argv)
+
+    path = args.db or history_store.history_path() or os.path.join(state_dir(), "history.sqlite3")
+    conn = history_store.connect(path)
+    try:
+        if args.command == "compact":
+            while True:
+                result = compact(conn, vacuum=args.vacuum)
+                print(f"🧹 縮約: スナップショット {result['snapshots']}件・1日ごとにまとめた行 {result['rolled_up']}件・"
+                      f"削除 {result['expired']}件（残り {pending(conn)}件）")
+                args.vacuum = False
+                if not args.all or not result["snapshots"]:
+                    break
+        elif args.command == "stats":
+            counts, size = stats(conn, path)
+            for table, count in counts.items():
+                print(f"  {table}: {count}行")
+            print(f"📈 ファイルサイズ: {size / 1024 / 1024:.1f}MB")
+        else:
+            since = date.fromisoformat(args.since) if args.since else None
+            rows = daily_trend(conn, args.facility, since)
+            if not rows:
+                print(f"⚠ {args.facility} の履歴がありません")
+                return 1
+            print("  日付        回数  平均空き枠  満室率(%)")
+            for day, count, slots, full in rows:
+                print(f"  {day.isoformat()}  {count:>4}  {slots:>9.1f}  {'-' if full is None else f'{full:.1f}':>8}")
+    finally:
+        conn.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
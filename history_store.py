@@ -0,0 +1,179 @@
+#!/usr/bin/env python3
+"""
+空き状況の履歴（SQLite）
+
+チェッカーの実行ごとに、施設単位のスナップショット（確認時刻と、時間帯別空き状況の
+空き・満室・その他のセル数）と、その時点の空き枠を記録する。
+availability_analytics.py がこの履歴を読み込んで集計する。
+表が前回と同じで空き枠の取得を省いた回も、前回の空き枠を引き継いだスナップショットとして記録する。
+その場合は空き枠を複製せず、same_as に空き枠を持つスナップショットのIDを入れる
+（空き枠を読むときは COALESCE(same_as, id) の slots を読む。SLOTS_OF を参照）。
+
+テーブル:
+  names      (id, kind, name)         施設キー・部屋名の辞書
+  snapshots  (id, checked_at, facility, vacant, full, other, total, same_as)
+  slots      (snapshot, room, day, start, end)   day は日付の序数、start・end は0時からの分
+
+古いスナップショットは history_retention.py が次の形に縮約する:
+  slot_changes        (checked_at, facility, room, day, start, end, vacant)   空いた(1)・埋まった(0)時刻
+  aggregates          (facility, period, bucket, snapshots, slots, counted, vacant, full, other, total)
+                      1時間（period="hour"）・1日（"day"）ごとの合計
+  retention_baseline  (facility, room, day, start, end)   最後に縮約したスナップショットの空き枠
+
+設定（環境変数）:
+  SUGINAMI_HISTORY_DB   履歴のSQLiteファイル。未設定なら記録しない
+                        （"default" で CHECKER_STATE_DIR/history.sqlite3）
+"""
+
+import os
+import sqlite3
+from datetime import datetime
+
+from circuit_breaker import state_dir
+from suginami_slots import Slot
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS names (
+    id INTEGER PRIMARY KEY,
+    kind TEXT NOT NULL,
+    name TEXT NOT NULL,
+    UNIQUE (kind, name)
+);
+CREATE TABLE IF NOT EXISTS snapshots (
+    id INTEGER PRIMARY KEY,
+    checked_at INTEGER NOT NULL,
+    facility INTEGER NOT NULL,
+    vacant INTEGER,
+    full INTEGER,
+    other INTEGER,
+    total INTEGER,
+    same_as INTEGER
+);
+CREATE INDEX IF NOT EXISTS snapshots_facility_time ON snapshots (facility, checked_at);
+CREATE TABLE IF NOT EXISTS slots (
+    snapshot INTEGER NOT NULL,
+    room INTEGER NOT NULL,
+    day INTEGER NOT NULL,
+    start INTEGER NOT NULL,
+    end INTEGER NOT NULL,
+    PRIMARY KEY (snapshot, room, day, start, end)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS slot_changes (
+    checked_at INTEGER NOT NULL,
+    facility INTEGER NOT NULL,
+    room INTEGER NOT NULL,
+    day INTEGER NOT NULL,
+    start INTEGER NOT NULL,
+    end INTEGER NOT NULL,
+    vacant INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS slot_changes_facility_time ON slot_changes (facility, checked_at);
+CREATE TABLE IF NOT EXISTS aggregates (
+    facility INTEGER NOT NULL,
+    period TEXT NOT NULL,
+    bucket INTEGER NOT NULL,
+    snapshots INTEGER NOT NULL,
+    slots INTEGER NOT NULL,
+    counted INTEGER NOT NULL,
+    vacant INTEGER NOT NULL,
+    full INTEGER NOT NULL,
+    other INTEGER NOT NULL,
+    total INTEGER NOT NULL,
+    PRIMARY KEY (facility, period, bucket)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS retention_baseline (
+    facility INTEGER NOT NULL,
+    room INTEGER NOT NULL,
+    day INTEGER NOT NULL,
+    start INTEGER NOT NULL,
+    end INTEGER NOT NULL,
+    PRIMARY KEY (facility, room, day, start, end)
+) WITHOUT ROWID;
+"""
+
+
+# スナップショット（snapshots の行）の空き枠を持つスナップショットのID
+SLOTS_OF = "COALESCE(snapshots.same_as, snapshots.id)"
+
+
+def history_path():
+    """履歴ファイルのパス（記録しない設定なら None）"""
+    path = os.getenv("SUGINAMI_HISTORY_DB", "")
+    if not path:
+        return None
+    if path == "default":
+        return os.path.join(state_dir(), "history.sqlite3")
+    return path
+
+
+def connect(path=None):
+    conn = sqlite3.connect(path or history_path() or os.path.join(state_dir(), "history.sqlite3"))
+    # 新しいファイルは削除した領域を少しずつ返せるようにする（既存のファイルは VACUUM するまで変わらない）
+    conn.execute("PRAGMA auto_vacuum=INCREMENTAL")
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.executescript(SCHEMA)
+    # same_as のない古いファイルに列を足す
+    if "same_as" not in {row[1] for row in conn.execute("PRAGMA table_info(snapshots)")}:
+        conn.execute("ALTER TABLE snapshots ADD COLUMN same_as INTEGER")
+    conn.execute("CREATE INDEX IF NOT EXISTS snapshots_same_as ON snapshots (same_as) WHERE same_as IS NOT NULL")
+    return conn
+
+
+def name_id(conn, kind, name):
+    row = conn.execute("SELECT id FROM names WHERE kind = ? AND name = ?", (kind, name)).fetchone()
+    if row:
+        return row[0]
+    return conn.execute("INSERT INTO names (kind, name) VALUES (?, ?)", (kind, name)).lastrowid
+
+
+def names(conn, kind):
+    """{id: 名前}"""
+    return dict(conn.execute("SELECT id, name FROM names WHERE kind = ?", (kind,)))
+
+
+def _epoch(checked_at):
+    return int(datetime.fromisoformat(checked_at).timestamp())
+
+
+def record_snapshot(conn, checked_at, facility_key, availability, cell_counts=None):
+    """1施設分のスナップショットを記録する。日付を解釈できない空き枠は記録しない"""
+    reference = datetime.fromisoformat(checked_at).date()
+    counts = cell_counts or {}
+    with conn:
+        snapshot_id = conn.execute(
+            "INSERT INTO snapshots (checked_at, facility, vacant, full, other, total) VALUES (?, ?, ?, ?, ?, ?)",
+            (_epoch(checked_at), name_id(conn, "facility", facility_key), counts.get("vacant"),
+             counts.get("full"), counts.get("other"), counts.get("total")),
+        ).lastrowid
+        rows = set()
+        for legacy in availability:
+            if legacy["facility_key"] != facility_key:
+                continue
+            slot = Slot.from_legacy(legacy, reference)
+            if slot.date > 0:
+                rows.add((snapshot_id, name_id(conn, "room", legacy["facility"]), slot.date, slot.start, slot.end))
+        conn.executemany("INSERT INTO slots (snapshot, room, day, start, end) VALUES (?, ?, ?, ?, ?)", rows)
+    return snapshot_id
+
+
+def record_unchanged(conn, checked_at, facility_key):
+    """空き枠が前回と同じだった回を、前回と同じ空き枠を指すスナップショットとして記録する（空き枠は複製しない）
+
+    前回のスナップショットがなければ何もせず None を返す。
+    """
+    facility = name_id(conn, "facility", facility_key)
+    previous = conn.execute(
+        f"SELECT {SLOTS_OF}, vacant, full, other, total FROM snapshots WHERE facility = ?"
+        " ORDER BY checked_at DESC, id DESC LIMIT 1",
+        (facility,),
+    ).fetchone()
+    if previous is None:
+        return None
+
+    with conn:
+        snapshot_id = conn.execute(
+            "INSERT INTO snapshots (checked_at, facility, vacant, full, other, total, same_as)"
+            " VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (_epoch(checked_at), facility, *previous[1:], previous[0]),
+        ).lastrowid
+    return snapshot_id
@@ -0,0 +1,218 @@
+#!/usr/bin/env python3
+"""
+requests 用のディスクキャッシュ（条件付きGET）
+
+GETの応答を ETag・Last-Modified とともにSQLiteへ保存し、次回は If-None-Match・If-Modified-Since を付けて取得する。
+304 が返れば保存済みの本文を 200 の応答として返す（変わっていないページは本文を転送しない）。
+GitHub API のように max-age 内でも内容が変わる応答があるので、保存済みの応答も毎回サーバーに確認する。
+保存先の合計サイズに上限があり、超えたら最後に使ったのが古いものから削除する（LRU）。
+呼び出し側が自分で If-None-Match などを付けたリクエストはそのまま送る。
+Authorization を付けたリクエスト（GitHub API など）もキャッシュしない。GitHub Actions の GITHUB_TOKEN は
+ジョブごとに変わるので、トークンごとに保存しても次の実行では使われず、期限切れのトークンを含む応答が溜まるだけになる。
+ヒット率などの件数は report() で実行メトリクスに含める。
+
+使い方:
+  session = requests.Session()
+  http_cache.install(session)        # rate_limit.get などは自動で通る
+
+設定（環境変数）:
+  HTTP_CACHE          true でキャッシュする（デフォルト: true）
+  HTTP_CACHE_DB       保存先のSQLiteファイル（デフォルト: CHECKER_STATE_DIR/http_cache.sqlite3）
+  HTTP_CACHE_MAX_MB   保存先の本文の合計サイズの上限MB（デフォルト: 50）
+"""
+
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+from requests.adapters import HTTPAdapter
+from requests.structures import CaseInsensitiveDict
+from requests.utils import get_encoding_from_headers
+
+from circuit_breaker import state_dir
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS responses (
+    key TEXT PRIMARY KEY,
+    url TEXT NOT NULL,
+    etag TEXT,
+    last_modified TEXT,
+    headers TEXT NOT NULL,
+    body BLOB NOT NULL,
+    size INTEGER NOT NULL,
+    accessed REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS responses_accessed ON responses (accessed);
+"""
+
+# 保存しない応答ヘッダー（本文は展開済みで保存する）
+_DROP_HEADERS = {"content-encoding", "content-length", "transfer-encoding", "connection"}
+
+# 実行中の件数（hits: 304 で保存済みの本文を使った / misses: 本文を取得した / stored: 保存した件数）
+_stats = {"hits": 0, "misses": 0, "stored": 0, "bytes_saved": 0}
+_stats_lock = threading.Lock()
+
+
+def enabled():
+    return os.getenv("HTTP_CACHE", "true").lower() == "true"
+
+
+def cache_path():
+    return os.getenv("HTTP_CACHE_DB") or os.path.join(state_dir(), "http_cache.sqlite3")
+
+
+def _count(name, amount=1):
+    with _stats_lock:
+        _stats[name] += amount
+
+
+def report():
+    """実行メトリクス用の辞書"""
+    with _stats_lock:
+        stats = dict(_stats)
+    total = stats["hits"] + stats["misses"]
+    stats["hit_ratio"] = round(stats["hits"] / total, 3) if total else None
+    return stats
+
+
+def _key(request):
+    """URLと、応答を変えるヘッダー（Accept）からキャッシュのキーを作る（認証付きのリクエストはキャッシュしない）"""
+    parts = [request.url, request.headers.get("Accept", "")]
+    return hashlib.sha256("\n".join(parts).encode("utf-8")).hexdigest()
+
+
+class CachingAdapter(HTTPAdapter):
+    """GETの応答を保存し、条件付きGETで再検証する HTTPAdapter"""
+
+    def __init__(self, path=None, max_bytes=None, **kwargs):
+        super().__init__(**kwargs)
+        self.path = path or cache_path()
+        if max_bytes is None:
+            max_bytes = float(os.getenv("HTTP_CACHE_MAX_MB", "50")) * 1024 * 1024
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._conn = None
+
+    def _db(self):
+        if self._conn is None:
+            self._conn = sqlite3.connect(self.path, timeout=30, isolation_level=None, check_same_thread=False)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.executescript(SCHEMA)
+        return self._conn
+
+    def _lookup(self, key):
+        with self._lock:
+            return self._db().execute(
+                "SELECT etag, last_modified, headers, body FROM responses WHERE key = ?", (key,)).fetchone()
+
+    def _touch(self, key):
+        with self._lock:
+            self._db().execute("UPDATE responses SET accessed = ? WHERE key = ?", (time.time(), key))
+
+    def _store(self, key, response):
+        headers = {name: value for name, value in response.headers.items() if name.lower() not in _DROP_HEADERS}
+        body = response.content
+        with self._lock:
+            conn = self._db()
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                conn.execute(
+                    "INSERT OR REPLACE INTO responses (key, url, etag, last_modified, headers, body, size, accessed)"
+                    " VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                    (key, response.url, response.headers.get("ETag"), response.headers.get("Last-Modified"),
+                     json.dumps(headers), body, len(body), time.time()))
+                self._evict(conn)
+                conn.execute("COMMIT")
+            except sqlite3.Error:
+                conn.execute("ROLLBACK")
+                raise
+        _count("stored")
+
+    def _evict(self, conn):
+        """合計サイズが上限を超えていたら、最後に使ったのが古いものから削除する"""
+        total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        for key, size in conn.execute("SELECT key, size FROM responses ORDER BY accessed").fetchall():
+            conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+            total -= size
+            if total <= self.max_bytes:
+                break
+
+    def _from_cache(self, response, request, row):
+        """304 の応答を、保存済みの本文を持つ 200 の応答に置き換える"""
+        _, _, headers, body = row
+        # 304 の（空の）本文を読み切って接続をプールに戻す
+        response.content
+        merged = CaseInsensitiveDict(json.loads(headers))
+        merged.update({name: value for name, value in response.headers.items() if name.lower() not in _DROP_HEADERS})
+        response.status_code = 200
+        response.reason = "OK"
+        response.headers = merged
+        response.encoding = get_encoding_from_headers(merged)
+        response._content = body
+        response.from_cache = True
+        return response
+
+    def send(self, request, **kwargs):
+        conditional = "If-None-Match" in request.headers or "If-Modified-Since" in request.headers
+        if request.method != "GET" or conditional or "Authorization" in request.headers or not enabled():
+            return super().send(request, **kwargs)
+
+        key = _key(request)
+        try:
+            row = self._lookup(key)
+        except sqlite3.Error as e:
+            print(f"⚠ HTTPキャッシュを読めません: {e}")
+            return super().send(request, **kwargs)
+
+        if row is not None:
+            etag, last_modified = row[0], row[1]
+            if etag:
+                request.headers["If-None-Match"] = etag
+            if last_modified:
+                request.headers["If-Modified-Since"] = last_modified
+
+        response = super().send(request, **kwargs)
+
+        if response.status_code == 304 and row is not None:
+            _count("hits")
+            _count("bytes_saved", len(row[3]))
+            self._touch(key)
+            return self._from_cache(response, request, row)
+
+        _count("misses")
+        storable = "no-store" not in response.headers.get("Cache-Control", "").lower()
+        if response.status_code == 200 and storable and (
+                response.headers.get("ETag") or response.headers.get("Last-Modified")):
+            try:
+                self._store(key, response)
+            except sqlite3.Error as e:
+                print(f"⚠ HTTPキャッシュに保存できません: {e}")
+        return response
+
+
+_adapter = None
+_adapter_lock = threading.Lock()
+
+
+def shared_adapter():
+    """プロセス内で共有する CachingAdapter（接続プールも共有される）"""
+    global _adapter
+    with _adapter_lock:
+        if _adapter is None:
+            _adapter = CachingAdapter(pool_maxsize=10)
+        return _adapter
+
+
+def install(session, adapter=None):
+    """セッションの http・https にキャッシュを組み込む"""
+    if not enabled():
+        return session
+    adapter = adapter or shared_adapter()
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
@@ -0,0 +1,143 @@
+#!/usr/bin/env python3
+"""
+日本の祝日カレンダー（オフライン）と、監視対象日の事前計算
+
+「国民の祝日に関する法律」の規則から祝日を計算する（2007年〜2099年）。
+振替休日・国民の休日、2019年の改元と2020・2021年の東京五輪による移動にも対応する。
+春分・秋分の日は近似式で求める（正式には前年2月の官報で決まるため、それまでは推定値）。
+
+使い方:
+  python jp_holidays.py 2025          # その年の祝日一覧
+"""
+
+import calendar
+import sys
+from datetime import date, timedelta
+from functools import lru_cache
+
+FIRST_YEAR = 2007
+LAST_YEAR = 2099
+
+SATURDAY = 5
+SUNDAY = 6
+
+
+def _nth_monday(year, month, n):
+    first = date(year, month, 1)
+    offset = (0 - first.weekday()) % 7
+    return first + timedelta(days=offset + 7 * (n - 1))
+
+
+def _vernal_equinox_day(year):
+    return int(20.8431 + 0.242194 * (year - 1980) - int((year - 1980) / 4))
+
+
+def _autumnal_equinox_day(year):
+    return int(23.2488 + 0.242194 * (year - 1980) - int((year - 1980) / 4))
+
+
+def _fixed_holidays(year):
+    """振替休日・国民の休日を除いた祝日"""
+    holidays = {
+        date(year, 1, 1): "元日",
+        _nth_monday(year, 1, 2): "成人の日",
+        date(year, 2, 11): "建国記念の日",
+        date(year, 3, _vernal_equinox_day(year)): "春分の日",
+        date(year, 4, 29): "昭和の日",
+        date(year, 5, 3): "憲法記念日",
+        date(year, 5, 4): "みどりの日",
+        date(year, 5, 5): "こどもの日",
+        _nth_monday(year, 9, 3): "敬老の日",
+        date(year, 9, _autumnal_equinox_day(year)): "秋分の日",
+        date(year, 11, 3): "文化の日",
+        date(year, 11, 23): "勤労感謝の日",
+    }
+
+    if year <= 2018:
+        holidays[date(year, 12, 23)] = "天皇誕生日"
+    elif year >= 2020:
+        holidays[date(year, 2, 23)] = "天皇誕生日"
+
+    if year == 2019:
+        holidays[date(2019, 5, 1)] = "天皇の即位の日"
+        holidays[date(2019, 10, 22)] = "即位礼正殿の儀の行われる日"
+
+    # 海の日・山の日・スポーツの日（体育の日）。2020・2021年は東京五輪に合わせて移動
+    if year == 2020:
+        holidays[date(2020, 7, 23)] = "海の日"
+        holidays[date(2020, 7, 24)] = "スポーツの日"
+        holidays[date(2020, 8, 10)] = "山の日"
+    elif year == 2021:
+        holidays[date(2021, 7, 22)] = "海の日"
+        holidays[date(2021, 7, 23)] = "スポーツの日"
+        holidays[date(2021, 8, 8)] = "山の日"
+    else:
+        holidays[_nth_monday(year, 7, 3)] = "海の日"
+        holidays[_nth_monday(year, 10, 2)] = "スポーツの日" if year >= 2020 else "体育の日"
+        if year >= 2016:
+            holidays[date(year, 8, 11)] = "山の日"
+
+    return holidays
+
+
+@lru_cache(maxsize=None)
+def holidays_in_year(year):
+    """{日付: 祝日名}（振替休日・国民の休日を含む）"""
+    if not FIRST_YEAR <= year <= LAST_YEAR:
+        raise ValueError(f"{FIRST_YEAR}〜{LAST_YEAR}年のみ対応しています: {year}")
+
+    holidays = _fixed_holidays(year)
+
+    # 国民の休日: 前日と翌日が祝日で、それ自体は祝日でも日曜日でもない日
+    for day in sorted(holidays):
+        between = day + timedelta(days=1)
+        if between not in holidays and between + timedelta(days=1) in holidays and between.weekday() != SUNDAY:
+            holidays[between] = "国民の休日"
+
+    # 振替休日: 祝日が日曜日なら、その後の最初の祝日でない日
+    for day in sorted(holidays):
+        if day.weekday() == SUNDAY:
+            substitute = day + timedelta(days=1)
+            while substitute in holidays:
+                substitute += timedelta(days=1)
+            holidays[substitute] = "振替休日"
+
+    return dict(sorted(holidays.items()))
+
+
+def is_holiday(day):
+    return day in holidays_in_year(day.year)
+
+
+def holiday_name(day):
+    return holidays_in_year(day.year).get(day)
+
+
+def add_months(day, months):
+    """months か月後の同じ日（存在しなければ月末）"""
+    month_index = day.month - 1 + months
+    year, month = day.year + month_index // 12, month_index % 12 + 1
+    return date(year, month, min(day.day, calendar.monthrange(year, month)[1]))
+
+
+def candidate_dates(start, end, weekdays=(SATURDAY, SUNDAY), holidays=True):
+    """start 以上 end 未満のうち、指定曜日（0=月曜）または祝日の日付"""
+    weekdays = set(weekdays)
+    dates = []
+    day = start
+    while day < end:
+        if day.weekday() in weekdays or (holidays and is_holiday(day)):
+            dates.append(day)
+        day += timedelta(days=1)
+    return dates
+
+
+def main():
+    year = int(sys.argv[1]) if len(sys.argv) > 1 else date.today().year
+    weekday_names = "月火水木金土日"
+    for day, name in holidays_in_year(year).items():
+        print(f"{day.isoformat()}({weekday_names[day.weekday()]}) {name}")
+
+
+if __name__ == "__main__":
+    main()
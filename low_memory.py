@@ -0,0 +1,157 @@
+#!/usr/bin/env python3
+"""
+省メモリモードとRSS監視
+
+小さいcronインスタンス（Renderの最小プラン等）でChromiumがメモリ上限に近づくのを防ぐ。
+LOW_MEMORY=true のとき、ビューポートを小さくし、GPU・コンポジタを無効にし、
+レンダラープロセス数とJSヒープに上限をかける。
+RssWatchdog は自プロセスと子プロセス（Chromium）のRSS合計を監視し、
+閾値に近づいたらページ・コンテキストの作り直しを促す。ピーク値は実行ごとに報告する。
+
+設定（環境変数）:
+  LOW_MEMORY              true で省メモリモード（デフォルト: false）
+  LOW_MEMORY_VIEWPORT     省メモリモードのビューポート "幅x高さ"（デフォルト: 1024x768）
+  LOW_MEMORY_JS_HEAP_MB   V8のヒープ上限MB（デフォルト: 256）
+  RSS_LIMIT_MB            RSS合計の上限MB。超える前に作り直す（デフォルト: 省メモリ時 450 / 通常 0=監視のみ）
+  RSS_RECYCLE_RATIO       上限のこの割合を超えたら作り直す（デフォルト: 0.85）
+"""
+
+import os
+import resource
+import threading
+
+
+def enabled():
+    return os.getenv("LOW_MEMORY", "false").lower() == "true"
+
+
+def viewport():
+    """ブラウザのビューポート"""
+    if not enabled():
+        return {"width": 1920, "height": 1080}
+    width, height = os.getenv("LOW_MEMORY_VIEWPORT", "1024x768").split("x")
+    return {"width": int(width), "height": int(height)}
+
+
+def chromium_args():
+    """Chromiumの起動引数（Playwright・Selenium共通）"""
+    if not enabled():
+        return []
+    heap_mb = int(os.getenv("LOW_MEMORY_JS_HEAP_MB", "256"))
+    return [
+        "--disable-gpu",
+        "--disable-software-rasterizer",
+        "--disable-features=VizDisplayCompositor",
+        "--disable-dev-shm-usage",
+        "--renderer-process-limit=1",
+        f"--js-flags=--max-old-space-size={heap_mb}",
+        "--disable-extensions",
+        "--disable-background-networking",
+        "--disable-component-update",
+        "--disable-default-apps",
+        "--mute-audio",
+        "--no-first-run",
+        "--blink-settings=imagesEnabled=false",
+    ]
+
+
+def selenium_window_size():
+    """Seleniumの --window-size 引数"""
+    size = viewport()
+    return f"--window-size={size['width']},{size['height']}"
+
+
+def block_heavy_resources(context):
+    """省メモリモードでは画像・フォント・メディアを読み込まない（Playwrightのcontext）"""
+    if not enabled():
+        return
+    blocked = {"image", "font", "media"}
+    context.route("**/*", lambda route: route.abort() if route.request.resource_type in blocked else route.continue_())
+
+
+def _read_proc_tree_rss_kb(root_pid):
+    """root_pid とその子孫プロセスのRSS合計（KB）。/proc がなければ None"""
+    if not os.path.isdir("/proc"):
+        return None
+
+    children = {}
+    rss = {}
+    for name in os.listdir("/proc"):
+        if not name.isdigit():
+            continue
+        try:
+            with open(f"/proc/{name}/stat", "r") as f:
+                stat = f.read()
+            with open(f"/proc/{name}/statm", "r") as f:
+                resident_pages = int(f.read().split()[1])
+        except (OSError, ValueError, IndexError):
+            continue
+        # comm に空白や括弧が入ることがあるので、最後の ')' 以降を分割する
+        ppid = int(stat[stat.rfind(")") + 2:].split()[1])
+        pid = int(name)
+        children.setdefault(ppid, []).append(pid)
+        rss[pid] = resident_pages * (os.sysconf("SC_PAGE_SIZE") // 1024)
+
+    total = 0
+    stack = [root_pid]
+    while stack:
+        pid = stack.pop()
+        total += rss.get(pid, 0)
+        stack.extend(children.get(pid, []))
+    return total
+
+
+class RssWatchdog:
+    """自プロセス＋子プロセスのRSSを定期的に測り、ピークと上限超過を記録する"""
+
+    def __init__(self, interval=0.5):
+        default_limit = "450" if enabled() else "0"
+        self.limit_mb = float(os.getenv("RSS_LIMIT_MB", default_limit))
+        self.recycle_ratio = float(os.getenv("RSS_RECYCLE_RATIO", "0.85"))
+        self.interval = interval
+        self.current_mb = 0.0
+        self.peak_mb = 0.0
+        self.recycles = 0
+        self._stop = threading.Event()
+        self._thread = None
+
+    def sample(self):
+        kb = _read_proc_tree_rss_kb(os.getpid())
+        if kb is None:
+            # /proc がない環境では自プロセスと終了済み子プロセスの最大RSSで代用
+            kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss + resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+        self.current_mb = kb / 1024
+        self.peak_mb = max(self.peak_mb, self.current_mb)
+        return self.current_mb
+
+    def _loop(self):
+        while not self._stop.wait(self.interval):
+            self.sample()
+
+    def start(self):
+        self.sample()
+        self._thread = threading.Thread(target=self._loop, name="rss-watchdog", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        if self._thread:
+            self._thread.join(timeout=self.interval * 2)
+        self.sample()
+        return self.peak_mb
+
+    def should_recycle(self):
+        """上限に近づいていて、ページ・コンテキストを作り直すべきか"""
+        if self.limit_mb <= 0:
+            return False
+        return self.sample() >= self.limit_mb * self.recycle_ratio
+
+    def report(self):
+        """実行メトリクス用の辞書"""
+        return {
+            "peak_rss_mb": round(self.peak_mb, 1),
+            "rss_limit_mb": self.limit_mb,
+            "recycles": self.recycles,
+            "low_memory": enabled(),
+        }
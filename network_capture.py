@@ -0,0 +1,242 @@
+#!/usr/bin/env python3
+"""
+時間帯別空き状況をネットワークの応答から取得する
+
+Vueアプリは時間帯別空き状況のデータをXHR/fetchのJSONで受け取ってから描画する。
+page.on("response") でそのJSONを捕まえて空き枠の辞書に変換すれば、描画を待たずに済み、
+CSSクラス（div.events-group・div.display-cells など）が変わっても取得できる。
+JSONの形はキー名から推定する（日付・部屋名・開始・終了・空き状態）。
+推定できない形や、知らない空き状態の値を含む応答なら None を返し、呼び出し側は従来どおりDOMから取得する。
+応答の形はサイトで確かめられていないため、使うかどうかは EXTRACTION_MODE で選ぶ（デフォルトはDOM）。
+
+設定（環境変数）:
+  EXTRACTION_MODE   dom: 常にDOM（デフォルト） / network: ネットワークの応答から取得し、できなければDOM
+"""
+
+import hashlib
+import json
+import os
+import re
+from datetime import date
+from urllib.parse import urlsplit
+
+from suginami_slots import hhmm_from_minutes
+
+WEEKDAY_LABELS = "月火水木金土日"
+
+# キー名（英数字だけを小文字にしたもの）
+TIME_FROM_KEYS = {"timefrom", "fromtime", "starttime", "start", "begintime", "from"}
+TIME_TO_KEYS = {"timeto", "totime", "endtime", "end", "to"}
+DATE_KEYS = {"date", "usedate", "day", "targetdate", "reservedate", "yoyakudate"}
+ROOM_KEYS = {"roomname", "room", "shitsuname", "shisetsuname", "facilityname", "name"}
+STATUS_HINTS = ("status", "state", "vacant", "available", "aki")
+
+VACANT_VALUES = {"vacant", "available", "empty", "空き", "空", "○", "◯"}
+FULL_VALUES = {"full", "reserved", "occupied", "満", "満室", "予約済", "×"}
+# 予約できないが空きでも満室でもない枠（休館・受付期間外・抽選など）
+OTHER_VALUES = {"", "-", "－", "closed", "outofperiod", "lottery", "休館", "休", "受付外", "期間外", "抽選"}
+
+# 空き状態のキーだが値を判断できない（知らない値を 'other' として扱うと空きを見落とすため、推定をやめる）
+_UNRECOGNIZED = "unrecognized"
+
+
+def enabled():
+    return os.getenv("EXTRACTION_MODE", "dom").lower() == "network"
+
+
+def _normalize_key(key):
+    return re.sub(r"[^0-9a-z]", "", str(key).lower())
+
+
+def _parse_time(value):
+    """'0900', '9:00', '09:00:00', 900 → '09:00'（解釈できなければ None）"""
+    text = str(value).strip()
+    match = re.fullmatch(r"(\d{1,2}):?(\d{2})(?::\d{2})?", text)
+    if not match:
+        return None
+    hours, minutes = int(match.group(1)), int(match.group(2))
+    if hours > 24 or minutes >= 60:
+        return None
+    return hhmm_from_minutes(hours * 60 + minutes)
+
+
+def _parse_date(value):
+    """'2025-10-18', '2025/10/18', '20251018', '2025-10-18T00:00:00' → date"""
+    match = re.match(r"(\d{4})[-/]?(\d{1,2})[-/]?(\d{1,2})", str(value).strip())
+    if not match:
+        return None
+    try:
+        return date(int(match.group(1)), int(match.group(2)), int(match.group(3)))
+    except ValueError:
+        return None
+
+
+def date_label(day):
+    """サイトの日付表示と同じ形（'2025/10/18(土)'）"""
+    return f"{day:%Y/%m/%d}({WEEKDAY_LABELS[day.weekday()]})"
+
+
+def _status(key, value):
+    """空き状態を 'vacant' / 'full' / 'other' で返す
+
+    空き状態のキーでない（真偽値で空きを表すキーでない）なら None、知らない文字列なら _UNRECOGNIZED を返す。
+    """
+    if isinstance(value, bool):
+        if any(hint in key for hint in ("vacant", "available", "aki")):
+            return "vacant" if value else "full"
+        return None
+    if isinstance(value, str):
+        text = value.strip().lower()
+        if text in VACANT_VALUES:
+            return "vacant"
+        if text in FULL_VALUES:
+            return "full"
+        if text in OTHER_VALUES:
+            return "other"
+        return _UNRECOGNIZED
+    return None
+
+
+class _Unknown(Exception):
+    """JSONの形を推定できない"""
+
+
+def _walk(node, context, cells):
+    """JSONをたどり、親の日付・部屋名を引き継ぎながら開始・終了を持つ要素を枠として集める"""
+    if isinstance(node, list):
+        for item in node:
+            _walk(item, context, cells)
+        return
+    if not isinstance(node, dict):
+        return
+
+    context = dict(context)
+    fields = {}
+    for key, value in node.items():
+        normalized = _normalize_key(key)
+        if isinstance(value, (dict, list)):
+            continue
+        if normalized in DATE_KEYS and _parse_date(value):
+            context["date"] = _parse_date(value)
+        elif normalized in ROOM_KEYS and isinstance(value, str) and value.strip():
+            context["room"] = value.strip()
+        elif normalized in TIME_FROM_KEYS:
+            fields["time_from"] = _parse_time(value)
+        elif normalized in TIME_TO_KEYS:
+            fields["time_to"] = _parse_time(value)
+        elif any(hint in normalized for hint in STATUS_HINTS):
+            fields.setdefault("status", _status(normalized, value))
+
+    if fields.get("time_from") and fields.get("time_to"):
+        if "date" not in context or "room" not in context or fields.get("status") is None:
+            raise _Unknown("日付・部屋名・空き状態のいずれかを判断できません")
+        if fields["status"] == _UNRECOGNIZED:
+            raise _Unknown("知らない空き状態の値があります")
+        cells.append((context["date"], context["room"], fields["time_from"], fields["time_to"], fields["status"]))
+
+    for value in node.values():
+        if isinstance(value, (dict, list)):
+            _walk(value, context, cells)
+
+
+def parse_payloads(payloads, facility_key, room_names=None):
+    """捕まえたJSONから、DOMの取得（EXTRACT_AVAILABILITY_JS）と同じ形の結果を作る。推定できなければ None
+
+    room_names を渡すと、その部屋名を含む部屋の枠だけを使い、1つもなければ推定できなかったとみなす（部屋名の取り違え防止）。
+    """
+    cells = []
+    used = []
+    for payload in payloads:
+        found = []
+        try:
+            _walk(payload, {}, found)
+        except _Unknown:
+            return None
+        if found:
+            cells += found
+            used.append(payload)
+    if room_names:
+        cells = [cell for cell in cells if any(name in cell[1] for name in room_names)]
+    if not cells:
+        return None
+
+    cells = sorted(set(cells))
+    counts = {"vacant": 0, "full": 0, "other": 0}
+    results = []
+    for day, room, time_from, time_to, status in cells:
+        counts[status] += 1
+        if status == "vacant":
+            results.append({"date": date_label(day), "facility": room, "time_from": time_from,
+                            "time_to": time_to, "facility_key": facility_key})
+
+    days = sorted({cell[0] for cell in cells})
+    return {
+        "dateElementsCount": len(days),
+        "eventsGroupCount": len({(cell[0], cell[1]) for cell in cells}),
+        "totalSlotsCount": len(cells),
+        "vacantSlotsCount": counts["vacant"],
+        "fullSlotsCount": counts["full"],
+        "otherSlotsCount": counts["other"],
+        "dates": [date_label(day) for day in days],
+        "results": results,
+        "fingerprint": hashlib.sha256(json.dumps(used, sort_keys=True, ensure_ascii=False).encode("utf-8")).hexdigest(),
+    }
+
+
+class ResponseCapture:
+    """ページ（またはコンテキストの全ページ）のXHR/fetchのJSON応答を溜める"""
+
+    def __init__(self, host):
+        self.host = host
+        # (リクエスト, JSON) の組。リクエストは batch_fetch.py で同じ呼び出しを作り直すのに使う
+        self.entries = []
+
+    def attach(self, target):
+        """page または context の response イベントを購読する"""
+        target.on("response", self._on_response)
+        return self
+
+    @property
+    def payloads(self):
+        return [payload for _, payload in self.entries]
+
+    def clear(self):
+        self.entries = []
+
+    def templates(self):
+        """空き枠を含むJSONを返したリクエストの一覧"""
+        results = []
+        for request, payload in list(self.entries):
+            found = []
+            try:
+                _walk(payload, {}, found)
+            except _Unknown:
+                continue
+            if found:
+                results.append(request)
+        return results
+
+    def _on_response(self, response):
+        try:
+            if urlsplit(response.url).hostname != self.host:
+                return
+            if response.request.resource_type not in ("xhr", "fetch"):
+                return
+            if "json" not in (response.headers.get("content-type") or ""):
+                return
+            request = response.request
+            self.entries.append(({"url": request.url, "method": request.method, "headers": request.headers,
+                                  "body": request.post_data}, response.json()))
+        except Exception:
+            # 本文を読めない応答（リダイレクト・ページ遷移で破棄されたもの）は無視する
+            pass
+
+    def result(self, page, facility_key, room_names=None, timeout=2000):
+        """捕まえたJSONから空き状況を作る。timeout ミリ秒待っても推定できなければ None"""
+        waited = 0
+        while True:
+            parsed = parse_payloads(self.payloads, facility_key, room_names)
+            if parsed is not None or waited >= timeout:
+                return parsed
+            page.wait_for_timeout(250)
+            waited += 250
@@ -0,0 +1,155 @@
+#!/usr/bin/env python3
+"""
+通知済み空き枠の台帳（フラッピング抑止）
+
+空き → 満室 → 空き と短時間で揺れる枠を毎回通知しないよう、
+通知済みの枠を最終確認時刻つきで記録する。
+台帳は状態データ（Issue #2）に "notification_ledger" として一緒に保存する。
+
+メモリ上の台帳:
+  {Slot: [通知時刻(epoch秒), 最後に空きを確認した時刻(epoch秒)], ...}
+保存形式（古い通知から順）:
+  [[施設キー, 日付表示, 部屋名, 開始, 終了, 通知時刻, 最終確認時刻], ...]
+
+設定（環境変数）:
+  NOTIFY_LEDGER_TTL_HOURS     空きを確認しなくなってから台帳に残す時間（デフォルト: 24）
+  NOTIFY_LEDGER_MAX_ENTRIES   台帳の最大件数。超えた分は古い通知から削除（デフォルト: 5000）
+  NOTIFY_REALERT_POLICY       再通知ポリシー
+                                after_gap : 空きが消えてから一定時間後に再び空いたら再通知（デフォルト）
+                                never     : 台帳に残っている間は再通知しない
+  NOTIFY_REALERT_GAP_MINUTES  after_gap で再通知するまでの空白時間（デフォルト: 60）
+"""
+
+import os
+import time
+from datetime import datetime
+
+from suginami_slots import Slot, slot_key
+
+LEDGER_KEY = "notification_ledger"
+
+REALERT_POLICIES = ("after_gap", "never")
+
+
+def _ttl_seconds():
+    return float(os.getenv("NOTIFY_LEDGER_TTL_HOURS", "24")) * 3600
+
+
+def _max_entries():
+    return int(os.getenv("NOTIFY_LEDGER_MAX_ENTRIES", "5000"))
+
+
+def _realert_policy():
+    policy = os.getenv("NOTIFY_REALERT_POLICY", "after_gap")
+    if policy not in REALERT_POLICIES:
+        print(f"⚠ 不明な NOTIFY_REALERT_POLICY: {policy}（after_gap を使用）")
+        return "after_gap"
+    return policy
+
+
+def _realert_gap_seconds():
+    return float(os.getenv("NOTIFY_REALERT_GAP_MINUTES", "60")) * 60
+
+
+def load_ledger(previous_data):
+    """前回の状態データから台帳を取り出す
+
+    台帳を持たない旧形式のデータの場合は、前回の空き枠を通知済みとして登録する
+    （導入直後に全件を再通知しないため）。
+    """
+    if not previous_data:
+        return {}
+
+    ledger = previous_data.get(LEDGER_KEY)
+    if isinstance(ledger, list):
+        return {
+            Slot.from_legacy({"facility_key": row[0], "date": row[1], "facility": row[2],
+                              "time_from": row[3], "time_to": row[4]}): [row[5], row[6]]
+            for row in ledger
+        }
+
+    previous_slots = previous_data.get("availability", [])
+    if isinstance(ledger, dict):
+        # slot_key 文字列をキーにしていた形式。前回の空き枠から引けるものだけ引き継ぐ
+        by_key = {slot_key(slot): slot for slot in previous_slots}
+        return {Slot.from_legacy(by_key[key]): list(entry) for key, entry in ledger.items() if key in by_key}
+
+    seeded_at = int(time.time())
+    checked_at = previous_data.get("checked_at")
+    if checked_at:
+        try:
+            seeded_at = int(datetime.fromisoformat(checked_at).timestamp())
+        except ValueError:
+            pass
+
+    return {Slot.from_legacy(slot): [seeded_at, seeded_at] for slot in previous_slots}
+
+
+def dump_ledger(ledger):
+    """台帳を状態データに保存する形式に変換する"""
+    rows = []
+    for slot, (notified_at, seen_at) in ledger.items():
+        legacy = slot.to_legacy()
+        rows.append([legacy["facility_key"], legacy["date"], legacy["facility"],
+                     legacy["time_from"], legacy["time_to"], notified_at, seen_at])
+    return rows
+
+
+def filter_new_slots(ledger, slots, previous_slots=(), now=None):
+    """通知すべき空き枠（Slot）を返し、台帳を更新する
+
+    previous_slots は前回の状態データにあった空き枠（Slot の集合）。これらは前回から空きが
+    続いているとみなし、通知せずに最終確認時刻だけを更新する
+    （前回から今回の間に消えた枠も、直前まで空いていた扱いになる）。
+    1枠あたり辞書・集合の参照と更新が1回ずつ（O(1)）で判定する。
+    """
+    now = int(time.time()) if now is None else now
+    policy = _realert_policy()
+    gap = _realert_gap_seconds()
+
+    for slot in previous_slots:
+        entry = ledger.get(slot)
+        if entry is not None:
+            entry[1] = now
+
+    new_slots = []
+    for slot in slots:
+        entry = ledger.get(slot)
+
+        if slot in previous_slots:
+            notify = False
+        elif entry is None:
+            notify = True
+        elif policy == "after_gap":
+            notify = now - entry[1] >= gap
+        else:
+            notify = False
+
+        if notify:
+            # 通知した枠は末尾に移して、件数上限での削除対象を古い通知からにする
+            ledger.pop(slot, None)
+            ledger[slot] = [now, now]
+            new_slots.append(slot)
+        elif entry is None:
+            ledger[slot] = [now, now]
+        else:
+            entry[1] = now
+
+    return new_slots
+
+
+def prune_ledger(ledger, now=None):
+    """TTL切れのエントリと上限を超えた古いエントリを削除する"""
+    now = int(time.time()) if now is None else now
+    ttl = _ttl_seconds()
+
+    expired = [slot for slot, entry in ledger.items() if now - entry[1] > ttl]
+    for slot in expired:
+        del ledger[slot]
+
+    overflow = len(ledger) - _max_entries()
+    if overflow > 0:
+        for slot in list(ledger)[:overflow]:
+            del ledger[slot]
+
+    return ledger
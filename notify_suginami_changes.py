@@ -13,9 +13,11 @@
 
 import os
 import json
-import requests
+import rate_limit
 from datetime import datetime
 
+from state_codec import encode_state, state_from_issue_body
+
 def get_previous_data_from_issue():
     """GitHub Issueから前回のデータを取得"""
     GITHUB_TOKEN = os.getenv("GITHUB_TOKEN")
@@ -34,16 +36,13 @@ def get_previous_data_from_issue():
     }
 
     try:
-        response = requests.get(url, headers=headers)
+        response = rate_limit.get(url, headers=headers)
         if response.status_code == 200:
             issue = response.json()
             body = issue.get("body", "")
 
-            if "```json" in body:
-                json_start = body.find("```json") + 7
-                json_end = body.find("```", json_start)
-                json_str = body[json_start:json_end].strip()
-                data = json.loads(json_str)
+            data = state_from_issue_body(body)
+            if data is not None:
                 print(f"✓ 前回のデータを取得しました (Issue #{issue_number})")
                 return data
         elif response.status_code == 404:
@@ -86,19 +85,21 @@ def save_data_to_issue(data):
 
 ## 詳細データ
 
-```json
-{json.dumps(data, ensure_ascii=False, indent=2)}
+圧縮形式: state_codec.py で読み書き
+
+```state
+{encode_state(data)}
 ```
 
 ---
 このIssueは自動的に更新されます。
 """
 
-    response = requests.get(url, headers=headers)
+    response = rate_limit.get(url, headers=headers)
 
     if response.status_code == 200:
         update_data = {"body": body}
-        response = requests.patch(url, headers=headers, json=update_data)
+        response = rate_limit.patch(url, headers=headers, json=update_data)
         if response.status_code == 200:
             print(f"✓ Issue #{issue_number} を更新しました")
             return True
@@ -109,7 +110,7 @@ def save_data_to_issue(data):
             "body": body,
             "labels": ["automated", "suginami"]
         }
-        response = requests.post(create_url, headers=headers, json=create_data)
+        response = rate_limit.post(create_url, headers=headers, json=create_data)
         if response.status_code == 201:
             print(f"✓ 新しいIssue #{issue_number} を作成しました")
             return True
@@ -127,7 +128,7 @@ def send_slack_notification(message):
     payload = {"text": message}
     headers = {"Content-Type": "application/json"}
 
-    response = requests.post(WEBHOOK_URL, json=payload, headers=headers)
+    response = rate_limit.post(WEBHOOK_URL, json=payload, headers=headers)
     if response.status_code != 200:
         print(f"⚠ Failed to send Slack notification: {response.status_code}")
     else:
@@ -0,0 +1,231 @@
+#!/usr/bin/env python3
+"""
+ホストごとのレート制限（トークンバケット）
+
+杉並区サイト・11489.jp・GitHub API・Slackへのリクエストを、ホストごとのトークンバケットで間引く。
+バケットの状態はSQLiteに置くので、同じマシン上のスレッド・asyncio・複数プロセス（ワーカー）で共有される。
+トークンは先払い（予約）で、足りなければ次のトークンが貯まる時刻まで待つ。
+応答の Retry-After と、GitHubの X-RateLimit-Remaining / X-RateLimit-Reset を見て、
+指定された時刻までそのホストへのリクエストを止める。止めている間はトークンを貯めず、
+再開後は1つずつ間隔を空けて送る（待っていたリクエストが一斉に出ない）。
+
+使い方:
+  import rate_limit
+  rate_limit.get(url, headers=..., timeout=30)     # requests.get と同じ（post・patch・delete も同様）
+  rate_limit.acquire(host)                         # Playwrightの画面操作など、requests以外の前に呼ぶ
+  rate_limit.acquire(host, deadline=deadline)      # 締め切り（run_deadline.Deadline）までに間に合わなければ待たない
+  await rate_limit.acquire_async(host)             # asyncio
+
+設定（環境変数）:
+  RATE_LIMITS                  ホストごとの制限 "ホスト=毎秒の回数:バースト" をカンマ区切り（デフォルトに上書き）
+                                 例: www.11489.jp=0.5:2,api.github.com=2:10
+  RATE_LIMIT_DB                バケットの状態を置くSQLiteファイル（デフォルト: CHECKER_STATE_DIR/rate_limit.sqlite3）
+  RATE_LIMIT_MAX_WAIT_SECONDS  これより長く待つ必要があれば待たずに RateLimited を送出する（デフォルト: 120）
+"""
+
+import asyncio
+import os
+import sqlite3
+import threading
+import time
+from email.utils import parsedate_to_datetime
+from urllib.parse import urlsplit
+
+import requests
+
+import http_cache
+from circuit_breaker import state_dir
+from run_deadline import DeadlineExceeded
+
+# ホスト → (毎秒の回数, バースト)
+# 杉並区サイトは施設・期間のシャード・ワーカーがすべてこの1つのバケットを共有する（シャードを増やしても
+# 間隔は変わらない）。画面操作1回の取得はおよそ10リクエストなので、シャード1つで20秒ほど待つ。
+DEFAULT_LIMITS = {
+    "www.shisetsuyoyaku.city.suginami.tokyo.jp": (0.5, 3),
+    "www.11489.jp": (1.0, 3),
+    "api.github.com": (1.0, 5),
+    "hooks.slack.com": (1.0, 1),
+}
+
+# Retry-After のない 429 を受けたときに止める秒数
+DEFAULT_RETRY_AFTER = 60
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS buckets (
+    host TEXT PRIMARY KEY,
+    tokens REAL NOT NULL,
+    updated REAL NOT NULL,  -- トークンが貯まり始める時刻（止めている間は blocked_until）
+    blocked_until REAL NOT NULL DEFAULT 0
+);
+"""
+
+
+class RateLimited(requests.RequestException):
+    """待ち時間が上限（RATE_LIMIT_MAX_WAIT_SECONDS）を超える"""
+
+
+def limits():
+    """ホスト → (毎秒の回数, バースト)"""
+    result = dict(DEFAULT_LIMITS)
+    for part in os.getenv("RATE_LIMITS", "").split(","):
+        if "=" not in part:
+            continue
+        host, spec = part.split("=", 1)
+        rate, _, burst = spec.partition(":")
+        result[host.strip()] = (float(rate), float(burst or 1))
+    return result
+
+
+def _db_path():
+    return os.getenv("RATE_LIMIT_DB") or os.path.join(state_dir(), "rate_limit.sqlite3")
+
+
+_local = threading.local()
+
+
+def _connect():
+    """スレッドごとの接続"""
+    path = _db_path()
+    conn = getattr(_local, "conn", None)
+    if conn is None or getattr(_local, "path", None) != path:
+        conn = sqlite3.connect(path, timeout=30, isolation_level=None)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.executescript(SCHEMA)
+        _local.conn, _local.path = conn, path
+    return conn
+
+
+def reserve(host, max_wait=None, deadline=None):
+    """トークンを1つ予約し、リクエストしてよい時刻までの待ち秒数を返す（制限のないホストは0）
+
+    待ちが deadline（run_deadline.Deadline）の残り時間を超えるなら、予約せずに DeadlineExceeded を送出する。
+    """
+    limit = limits().get(host)
+    if limit is None:
+        return 0.0
+    rate, burst = limit
+    if max_wait is None:
+        max_wait = float(os.getenv("RATE_LIMIT_MAX_WAIT_SECONDS", "120"))
+
+    conn = _connect()
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        now = time.time()
+        row = conn.execute("SELECT tokens, updated, blocked_until FROM buckets WHERE host = ?", (host,)).fetchone()
+        tokens, updated, blocked_until = row or (burst, now, 0.0)
+        tokens = min(burst, tokens + max(0.0, now - updated) * rate) - 1
+        # 止めている間の後ろに、先に予約したリクエストの分（トークンの借り）を並べる
+        wait = max(0.0, blocked_until - now) + max(0.0, -tokens / rate)
+        if wait > max_wait:
+            conn.execute("ROLLBACK")
+            raise RateLimited(f"{host} のレート制限で{wait:.0f}秒待つ必要があります")
+        if deadline is not None and wait > deadline.remaining():
+            conn.execute("ROLLBACK")
+            raise DeadlineExceeded(f"{host} のレート制限で{wait:.0f}秒待つと締め切りを過ぎます")
+        conn.execute("INSERT OR REPLACE INTO buckets (host, tokens, updated, blocked_until) VALUES (?, ?, ?, ?)",
+                     (host, tokens, max(now, updated), blocked_until))
+        conn.execute("COMMIT")
+        return wait
+    except sqlite3.Error:
+        conn.execute("ROLLBACK")
+        raise
+
+
+def acquire(host, max_wait=None, deadline=None):
+    """リクエストしてよくなるまで待つ。待った秒数を返す"""
+    wait = reserve(host, max_wait, deadline)
+    if wait > 0:
+        time.sleep(wait)
+    return wait
+
+
+async def acquire_async(host, max_wait=None):
+    """acquire() の asyncio 版（SQLiteの操作はスレッドで行う）"""
+    wait = await asyncio.get_running_loop().run_in_executor(None, reserve, host, max_wait)
+    if wait > 0:
+        await asyncio.sleep(wait)
+    return wait
+
+
+def block(host, until):
+    """指定時刻（epoch秒）までホストへのリクエストを止める
+
+    止めている間はトークンを貯めず（updated を until に進める）、バーストも1つに抑える。
+    """
+    conn = _connect()
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        row = conn.execute("SELECT blocked_until FROM buckets WHERE host = ?", (host,)).fetchone()
+        if row is None:
+            conn.execute("INSERT INTO buckets (host, tokens, updated, blocked_until) VALUES (?, ?, ?, ?)",
+                         (host, 1.0, until, until))
+        elif until > row[0]:
+            conn.execute("UPDATE buckets SET tokens = MIN(tokens, 1), updated = MAX(updated, ?), blocked_until = ? "
+                         "WHERE host = ?", (until, until, host))
+        conn.execute("COMMIT")
+    except sqlite3.Error:
+        conn.execute("ROLLBACK")
+        raise
+
+
+def _retry_after(value):
+    """Retry-After（秒数またはHTTPの日付）を epoch秒に変換する"""
+    try:
+        return time.time() + float(value)
+    except ValueError:
+        pass
+    try:
+        return parsedate_to_datetime(value).timestamp()
+    except (TypeError, ValueError):
+        return None
+
+
+def observe(host, response):
+    """応答のヘッダーからサーバー側の制限を読み取り、必要ならホストへのリクエストを止める"""
+    headers = response.headers
+    until = None
+    if headers.get("Retry-After"):
+        until = _retry_after(headers["Retry-After"])
+    elif response.status_code == 429:
+        until = time.time() + DEFAULT_RETRY_AFTER
+    if headers.get("X-RateLimit-Remaining") == "0" and headers.get("X-RateLimit-Reset"):
+        reset = float(headers["X-RateLimit-Reset"])
+        until = max(until or 0, reset)
+    if until and until > time.time():
+        print(f"⚠ {host} のレート制限のため {time.strftime('%H:%M:%S', time.localtime(until))} まで待ちます")
+        block(host, until)
+
+
+class RateLimitedSession(requests.Session):
+    """リクエストの前にトークンを取り、応答の制限ヘッダーを記録する requests.Session"""
+
+    def request(self, method, url, *args, **kwargs):
+        host = urlsplit(url).hostname or ""
+        acquire(host)
+        response = super().request(method, url, *args, **kwargs)
+        observe(host, response)
+        return response
+
+
+def session():
+    """スレッドごとの RateLimitedSession（GETは http_cache のディスクキャッシュを通す）"""
+    current = getattr(_local, "session", None)
+    if current is None:
+        current = _local.session = http_cache.install(RateLimitedSession())
+    return current
+
+
+def get(url, **kwargs):
+    return session().get(url, **kwargs)
+
+
+def post(url, **kwargs):
+    return session().post(url, **kwargs)
+
+
+def patch(url, **kwargs):
+    return session().patch(url, **kwargs)
+
+
+def delete(url, **kwargs):
+    return session().delete(url, **kwargs)
@@ -0,0 +1,288 @@
+#!/usr/bin/env python3
+"""
+11489.jp（施設予約システム）の自治体共通エンジン
+
+同じベンダーのシステムが https://www.11489.jp/<自治体コード>/web/ で複数の自治体に提供されているので、
+画面の操作（ASP.NETのポストバック）を自治体コードで切り替えられる1つのエンジンにまとめる。
+ブラウザは使わず、requestsでフォームの hidden 項目（__VIEWSTATE など）を引き継いでポストバックする。
+実際のサイトではまだ確かめていないため、check_chuo.py では CHUO_ENGINE=requests のときだけ使う。
+接続プールは全自治体で共有し、Cookie（ASP.NETのセッション）は自治体ごとに分ける。
+複数の自治体を並行してチェックし、自治体ごとの施設カタログを <自治体コード小文字>_facilities.json に保存する。
+
+使い方:
+  python reservation_11489.py                 # MUNICIPALITIES_11489 の自治体をすべてチェック
+  python reservation_11489.py Chuo            # 自治体コードを指定
+
+機能:
+  - 空き照会・予約の申込 → 施設の分類一覧（チェックボックス）を取得
+  - 監視する分類（学校体育館など）を選択して施設一覧を取得
+  - 失敗・異常時だけ取得したHTMLを調査用の記録として保存（artifacts.py）
+
+設定（環境変数）:
+  MUNICIPALITIES_11489         チェックする自治体コード（カンマ区切り。デフォルト: MUNICIPALITIES のすべて）
+  RESERVATION_11489_WORKERS    同時にチェックする自治体の数（デフォルト: 4）
+"""
+
+import json
+import os
+import re
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from urllib.parse import urljoin
+
+from requests.adapters import HTTPAdapter
+from bs4 import BeautifulSoup
+
+from artifacts import ArtifactRecorder
+from circuit_breaker import CircuitBreaker
+from rate_limit import RateLimitedSession
+
+HOST = "www.11489.jp"
+USER_AGENT = "Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/141.0.0.0 Safari/537.36"
+
+# 自治体コード（URLのパス）→ 表示名と監視する施設の分類（分類一覧のボタンの表示名）
+MUNICIPALITIES = {
+    "Chuo": {"name": "中央区", "categories": ["学校体育館"]},
+}
+
+# 画面の要素のID（全自治体で共通）
+TITLE_ID = "ucPCHeader_lblTitle2"
+RESERVE_BUTTON_ID = "rbtnYoyaku"
+LIST_BUTTON_ID = "btnList"
+CATEGORY_PATTERN = re.compile(r"dgTable.*chkShisetsu")
+
+_DO_POSTBACK = re.compile(r"__doPostBack\('([^']*)','([^']*)'\)")
+
+_adapter = None
+_adapter_lock = threading.Lock()
+
+
+def _shared_adapter():
+    """全自治体で共有する接続プール"""
+    global _adapter
+    with _adapter_lock:
+        if _adapter is None:
+            workers = int(os.getenv("RESERVATION_11489_WORKERS", "4"))
+            _adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max(workers, 1))
+        return _adapter
+
+
+def new_session():
+    """接続プールを共有し、Cookieは別々のセッション（リクエストはホストのレート制限を通す）"""
+    session = RateLimitedSession()
+    session.mount("https://", _shared_adapter())
+    session.headers.update({"User-Agent": USER_AGENT, "Accept-Language": "ja"})
+    return session
+
+
+class PostbackForm:
+    """ASP.NET WebForms のページ（フォームの送信値とポストバック）"""
+
+    def __init__(self, url, html):
+        self.url = url
+        self.html = html
+        self.soup = BeautifulSoup(html, "html.parser")
+        form = self.soup.find("form")
+        if form is None:
+            raise ValueError(f"フォームがありません: {url}")
+        self.action = urljoin(url, form.get("action") or url)
+        self.fields = {}
+        for element in form.find_all(["input", "select", "textarea"]):
+            name = element.get("name")
+            if not name:
+                continue
+            kind = (element.get("type") or "text").lower()
+            if element.name == "select":
+                option = element.find("option", selected=True) or element.find("option")
+                self.fields[name] = option.get("value", option.text) if option else ""
+            elif kind in ("checkbox", "radio"):
+                if element.has_attr("checked"):
+                    self.fields[name] = element.get("value", "on")
+            elif kind not in ("submit", "button", "image", "reset"):
+                self.fields[name] = element.get("value", "") if element.name == "input" else element.text
+
+    def text(self, element_id):
+        element = self.soup.find(id=element_id)
+        return element.get_text(strip=True) if element else None
+
+    def items(self, pattern):
+        """IDが pattern に一致する入力要素（名前・ID・種類）の一覧。名前はボタンの値かラベルの文字列"""
+        results = []
+        for element in self.soup.find_all("input", id=pattern):
+            kind = (element.get("type") or "text").lower()
+            label = self.soup.find("label", attrs={"for": element["id"]})
+            name = label.get_text(strip=True) if label else element.get("value", "")
+            results.append({"name": name, "id": element["id"], "type": kind})
+        return results
+
+    def rows(self):
+        """表の各行の文字列（セルごと）。見出し行と空の行は除く"""
+        rows = []
+        for row in self.soup.find_all("tr"):
+            cells = [cell.get_text(" ", strip=True) for cell in row.find_all("td")]
+            if any(cells):
+                rows.append(cells)
+        return rows
+
+    def activate(self, element_id):
+        """要素を操作した送信値を返す。ポストバックが不要（チェックするだけ）なら None"""
+        element = self.soup.find(id=element_id)
+        if element is None:
+            raise ValueError(f"要素がありません: {element_id}")
+        data = dict(self.fields, __EVENTTARGET="", __EVENTARGUMENT="")
+        name = element.get("name")
+        kind = (element.get("type") or "").lower()
+        postback = _DO_POSTBACK.search(element.get("href", "") + element.get("onclick", ""))
+
+        if kind in ("checkbox", "radio"):
+            self.fields[name] = element.get("value", "on")
+            if not postback:
+                return None
+            data[name] = self.fields[name]
+        if postback:
+            data["__EVENTTARGET"], data["__EVENTARGUMENT"] = postback.groups()
+        elif kind == "image":
+            data[f"{name}.x"], data[f"{name}.y"] = "1", "1"
+        elif name:
+            data[name] = element.get("value", "")
+        return data
+
+
+class Engine11489:
+    """1つの自治体の 11489.jp を操作する"""
+
+    def __init__(self, code, session=None, recorder=None, timeout=30):
+        self.code = code
+        self.base_url = f"https://{HOST}/{code}/web/"
+        self.session = session or new_session()
+        self.recorder = recorder
+        self.timeout = timeout
+
+    def _load(self, response, label):
+        response.raise_for_status()
+        response.encoding = response.apparent_encoding if response.encoding in (None, "ISO-8859-1") else response.encoding
+        if self.recorder:
+            self.recorder.capture_html(response.url, response.text, f"{self.code}_{label}")
+        return PostbackForm(response.url, response.text)
+
+    def open(self):
+        """モード選択画面"""
+        response = self.session.get(urljoin(self.base_url, "Wg_ModeSelect.aspx"), timeout=self.timeout)
+        return self._load(response, "モード選択")
+
+    def postback(self, form, element_id, label):
+        """要素をクリックしたときのポストバックを送る（ポストバックが不要なら同じフォームを返す）"""
+        data = form.activate(element_id)
+        if data is None:
+            return form
+        response = self.session.post(form.action, data=data, timeout=self.timeout,
+                                     headers={"Referer": form.url})
+        return self._load(response, label)
+
+    def categories(self):
+        """空き照会・予約の申込 → 施設の分類一覧。(画面のタイトル, 分類のフォーム, 分類の一覧) を返す"""
+        form = self.open()
+        title = form.text(TITLE_ID)
+        form = self.postback(form, RESERVE_BUTTON_ID, "空き照会・予約の申込")
+        return title, form, form.items(CATEGORY_PATTERN)
+
+    def facilities(self, category_names):
+        """分類ごとに分類を選択して施設一覧を表示し、{分類: [施設一覧の行, ...]} を返す"""
+        results = {}
+        for category_name in category_names:
+            # 選択状態がポストバックで引き継がれるので、分類ごとに最初から開き直す
+            _, form, categories = self.categories()
+            matches = [item for item in categories if item["name"] == category_name]
+            if not matches:
+                results[category_name] = None
+                continue
+            form = self.postback(form, matches[0]["id"], f"{category_name}を選択")
+            form = self.postback(form, LIST_BUTTON_ID, f"{category_name}の施設一覧")
+            results[category_name] = form.rows()
+        return results
+
+
+def check_municipality(code, session=None):
+    """1つの自治体の施設カタログを取得して保存する。施設の分類を取得できなければ None を返す"""
+    municipality = MUNICIPALITIES.get(code, {"name": code, "categories": []})
+    recorder = ArtifactRecorder(f"11489-{code}")
+    engine = Engine11489(code, session=session, recorder=recorder)
+    result = None
+    try:
+        print(f"\n=== {municipality['name']}（{code}） ===")
+        title, _, categories = engine.categories()
+        print(f"✓ {title}")
+        checked_at = datetime.now().isoformat()
+        for i, category in enumerate(categories):
+            print(f"{i+1}. {category['name']} (ID: {category['id']})")
+        if not categories:
+            # 画面が変わった・エラーページが返った場合。空の結果で前回のファイルを上書きしない
+            raise ValueError("施設の分類を1件も取得できませんでした")
+
+        watched = engine.facilities(municipality["categories"])
+        for category_name, rows in watched.items():
+            if rows is None:
+                print(f"⚠ 分類「{category_name}」がありません")
+                recorder.anomaly(f"{code}: 分類「{category_name}」がありません")
+            else:
+                print(f"✓ {category_name}: {len(rows)}行")
+
+        result = {
+            "municipality": code,
+            "title": title,
+            "checked_at": checked_at,
+            "facilities": [{"name": item["name"], "id": item["id"], "checked_at": checked_at} for item in categories],
+            "total_count": len(categories),
+            "watched": watched,
+        }
+        path = f"{code.lower()}_facilities.json"
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(result, f, ensure_ascii=False, indent=2)
+        print(f"✓ 結果を保存しました: {path}（施設の分類 {len(categories)}件）")
+    except Exception as e:
+        print(f"❌ {code}: エラーが発生しました: {e}")
+        recorder.note_exception(e)
+    finally:
+        recorder.finish(failed=result is None)
+    return result
+
+
+def municipality_codes():
+    codes = [code.strip() for code in os.getenv("MUNICIPALITIES_11489", "").split(",") if code.strip()]
+    return codes or list(MUNICIPALITIES)
+
+
+def check_municipalities(codes=None):
+    """複数の自治体を並行してチェックする。{自治体コード: 結果または None}"""
+    codes = codes or municipality_codes()
+    breaker = CircuitBreaker(HOST)
+    allowed, reason = breaker.allow()
+    if not allowed:
+        print(f"⏭ {HOST} へのアクセスを見送りました: {reason}")
+        return {code: None for code in codes}
+
+    workers = max(1, min(len(codes), int(os.getenv("RESERVATION_11489_WORKERS", "4"))))
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        results = dict(zip(codes, executor.map(check_municipality, codes)))
+
+    # ブレーカーの状態ファイルは並行して書き換えないよう、まとめて記録する
+    if any(result is not None for result in results.values()):
+        breaker.record_success()
+    else:
+        breaker.record_failure()
+    return results
+
+
+def main(argv=None):
+    codes = (sys.argv[1:] if argv is None else argv) or None
+    results = check_municipalities(codes)
+    failed = [code for code, result in results.items() if result is None]
+    if failed:
+        print(f"\n⚠ 取得できなかった自治体: {', '.join(failed)}")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
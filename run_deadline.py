@@ -0,0 +1,74 @@
+#!/usr/bin/env python3
+"""
+実行全体の締め切り
+
+1回の実行（状態取得・スクレイピング・保存・通知）全体に1つの締め切りを設け、
+各処理のタイムアウトを「その処理の上限」と「締め切りまでの残り時間」の小さい方にする。
+スクレイピングには保存・通知の時間を残した締め切り（reserve）を渡し、
+締め切りを過ぎたら取得済みの施設だけを保存・通知する。
+
+設定（環境変数）:
+  RUN_DEADLINE_SECONDS          実行全体の制限時間（デフォルト: 1500 = 25分。30分間隔のcronに収める）
+  RUN_PUBLISH_RESERVE_SECONDS   保存・通知のために残す秒数（デフォルト: 120）
+"""
+
+import os
+import time
+
+
+class DeadlineExceeded(Exception):
+    """実行全体の締め切りを過ぎた"""
+
+
+class Deadline:
+    """実行全体の締め切り"""
+
+    def __init__(self, seconds=None):
+        if seconds is None:
+            seconds = float(os.getenv("RUN_DEADLINE_SECONDS", "1500"))
+        self.seconds = seconds
+        self.expires_at = time.monotonic() + seconds
+
+    def remaining(self):
+        """締め切りまでの残り秒数（過ぎていれば0）"""
+        return max(0.0, self.expires_at - time.monotonic())
+
+    def expired(self):
+        return self.remaining() <= 0
+
+    def timeout(self, cap):
+        """上限 cap 秒と残り時間の小さい方（秒）"""
+        return min(cap, self.remaining())
+
+    def reserve(self, seconds=None):
+        """保存・通知の時間（seconds 秒）を残した、この締め切りより早い締め切り"""
+        if seconds is None:
+            seconds = float(os.getenv("RUN_PUBLISH_RESERVE_SECONDS", "120"))
+        return Deadline(max(0.0, self.remaining() - seconds))
+
+    def expire(self):
+        """今すぐ締め切りにする（ワーカーがジョブのリースを失ったときなど）"""
+        self.expires_at = time.monotonic()
+
+    def sleep(self, seconds):
+        """seconds 秒と残り時間の短い方だけ待つ"""
+        time.sleep(self.timeout(seconds))
+
+    def check(self, what=""):
+        """締め切りを過ぎていれば DeadlineExceeded を送出する"""
+        if self.expired():
+            raise DeadlineExceeded(f"実行の制限時間（{int(self.seconds)}秒）を超えました{': ' + what if what else ''}")
+
+
+def request_timeout(deadline, cap=30):
+    """HTTPリクエストのタイムアウト秒数（締め切りがなければ cap）"""
+    if deadline is None:
+        return cap
+    return max(0.1, deadline.timeout(cap))
+
+
+def playwright_timeout(deadline, cap_ms):
+    """Playwrightのタイムアウト（ミリ秒。0は無制限になるので最小1）"""
+    if deadline is None:
+        return cap_ms
+    return max(1, int(deadline.timeout(cap_ms / 1000) * 1000))
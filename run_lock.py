@@ -0,0 +1,229 @@
+#!/usr/bin/env python3
+"""
+実行の重複を防ぐロック（有効期限付きのリース）
+
+GitHub Actions・Renderのcron・ローカル実行が同時に動くと、同じサイトを二重にスクレイピングし、
+Issue #2 や suginami_availability.json を互いに上書きしてしまう。
+実行の最初にロックを取り、取れなければ（他の実行が動いていれば）すぐに終了する。
+ロックには所有者IDと有効期限があり、所有者が異常終了しても期限が切れれば次の実行が取れる。
+
+バックエンド:
+  file  : CHECKER_STATE_DIR のファイル（同じマシン上の実行どうし。デフォルト）
+  issue : Issue #2 のコメントをロックの記録に使う（GitHub Actions・Render・ローカルの間で共有される）。
+          全員がコメントを書き込んでから一覧を読み、有効なロックのうち最も古いコメントの所有者が勝つ。
+          GitHub APIに届かないときはロックなしで続行する（fail-open）ので、明示して使う
+環境をまたぐ重複を防ぐため、GitHub Actions（suginami_cron.yml・suginami.yml）と Render（render.yaml）は
+RUN_LOCK_BACKEND=issue を設定している。ローカル実行も同じ設定と GITHUB_TOKEN で加わる（README_suginami.md）。
+file は同じマシン上の実行どうしにしか効かない。
+
+使い方:
+  with RunLock(RUN_LOCK_NAME) as lock:
+      if not lock.acquired:
+          return True   # 他の実行が動いている
+      ...
+
+設定（環境変数）:
+  RUN_LOCK_BACKEND       file（デフォルト） / issue / none
+  RUN_LOCK_TTL_SECONDS   ロックの有効期限（デフォルト: RUN_DEADLINE_SECONDS + 300）
+  RUN_LOCK_OWNER         所有者ID（デフォルト: ホスト名-PID-GitHub ActionsのランID）
+"""
+
+import fcntl
+import json
+import os
+import re
+import socket
+import time
+import uuid
+from contextlib import contextmanager
+from datetime import datetime, timezone
+
+import requests
+
+import rate_limit
+from circuit_breaker import JST, state_dir
+
+ISSUE_NUMBER = 2
+
+# 杉並区のチェック（Playwright版・ローカル版・Selenium版・ジョブキューのまとめ役）で共有するロック名
+RUN_LOCK_NAME = "suginami"
+_COMMENT_PATTERN = re.compile(r"run-lock name=(?P<name>\S+) owner=(?P<owner>\S+) expires=(?P<expires>\d+)")
+
+
+def _default_ttl():
+    return float(os.getenv("RUN_DEADLINE_SECONDS", "1500")) + 300
+
+
+def _default_owner():
+    parts = [socket.gethostname(), str(os.getpid())]
+    if os.getenv("GITHUB_RUN_ID"):
+        parts.append(f"gha{os.getenv('GITHUB_RUN_ID')}")
+    parts.append(uuid.uuid4().hex[:8])
+    return "-".join(parts)
+
+
+class RunLock:
+    """実行ロック。acquire() が False なら他の実行が所有している（holder にその所有者）"""
+
+    def __init__(self, name, ttl=None, owner=None, backend=None):
+        self.name = name
+        self.ttl = float(ttl or os.getenv("RUN_LOCK_TTL_SECONDS") or _default_ttl())
+        self.owner = owner or os.getenv("RUN_LOCK_OWNER") or _default_owner()
+        backend = backend or os.getenv("RUN_LOCK_BACKEND", "file")
+        if backend not in ("issue", "file", "none"):
+            raise ValueError(f"不明なロックのバックエンドです: {backend}")
+        self.backend = backend
+        self.acquired = False
+        self.holder = None
+        self._comment_id = None
+
+    # --- ファイル ---
+
+    def _path(self):
+        return os.path.join(state_dir(), f"run_lock_{self.name}.json")
+
+    @contextmanager
+    def _guard(self):
+        """ロックファイルの作成・取り直し・削除を直列にする（隣のファイルに fcntl.flock）"""
+        with open(f"{self._path()}.guard", "w") as guard:
+            fcntl.flock(guard, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(guard, fcntl.LOCK_UN)
+
+    def _read_file(self, path):
+        """ロックファイルの記録。空・壊れたファイルは、更新時刻から有効期限が切れるまで有効とみなす"""
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except ValueError:
+            return {"owner": "?", "expires": os.path.getmtime(path) + self.ttl}
+
+    def _acquire_file(self):
+        path = self._path()
+        # 記録を書き終えた一時ファイルをリンクするので、書き込み途中のロックファイルは読まれない
+        tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"owner": self.owner, "expires": time.time() + self.ttl}, f)
+        try:
+            with self._guard():
+                try:
+                    os.link(tmp_path, path)
+                    return True
+                except FileExistsError:
+                    pass
+                try:
+                    current = self._read_file(path)
+                except FileNotFoundError:
+                    current = {"expires": 0}
+                if current.get("expires", 0) > time.time():
+                    self.holder = current.get("owner")
+                    return False
+                # 期限切れのロックは guard を持ったまま置き換える（同時に取り直せるのは1つだけ）
+                os.replace(tmp_path, path)
+                return True
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+    def _release_file(self):
+        path = self._path()
+        with self._guard():
+            try:
+                if self._read_file(path).get("owner") == self.owner:
+                    os.remove(path)
+            except OSError:
+                pass
+
+    # --- Issueのコメント ---
+
+    def _api(self):
+        repo = os.getenv("GITHUB_REPOSITORY", "manzoku-bukuro/taikukan")
+        headers = {
+            "Authorization": f"token {os.getenv('GITHUB_TOKEN')}",
+            "Accept": "application/vnd.github.v3+json",
+        }
+        return f"https://api.github.com/repos/{repo}/issues", headers
+
+    def _acquire_issue(self):
+        base, headers = self._api()
+        expires = int(time.time() + self.ttl)
+        expires_text = datetime.fromtimestamp(expires, JST).strftime("%H:%M")
+        body = f"🔒 実行中（{expires_text} JST まで有効）\n\n`run-lock name={self.name} owner={self.owner} expires={expires}`"
+        response = rate_limit.post(f"{base}/{ISSUE_NUMBER}/comments", headers=headers, json={"body": body}, timeout=30)
+        response.raise_for_status()
+        self._comment_id = response.json()["id"]
+
+        # 有効期限内に作られたはずのコメントだけを読む
+        since = datetime.fromtimestamp(time.time() - self.ttl - 60, timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
+        response = rate_limit.get(f"{base}/{ISSUE_NUMBER}/comments", headers=headers,
+                                params={"since": since, "per_page": 100}, timeout=30)
+        response.raise_for_status()
+
+        live = []
+        for comment in response.json():
+            match = _COMMENT_PATTERN.search(comment.get("body") or "")
+            if not match or match.group("name") != self.name:
+                continue
+            if int(match.group("expires")) <= time.time():
+                # 異常終了した実行の期限切れのロックを片付ける
+                rate_limit.delete(f"{base}/comments/{comment['id']}", headers=headers, timeout=30)
+                continue
+            live.append((comment["id"], match.group("owner")))
+
+        winner = min(live) if live else (self._comment_id, self.owner)
+        if winner[0] == self._comment_id:
+            return True
+        self.holder = winner[1]
+        self._release_issue()
+        return False
+
+    def _release_issue(self):
+        if self._comment_id is None:
+            return
+        base, headers = self._api()
+        try:
+            rate_limit.delete(f"{base}/comments/{self._comment_id}", headers=headers, timeout=30)
+        except requests.RequestException as e:
+            print(f"⚠ ロックの解放失敗（期限切れで自動的に無効になります）: {e}")
+        self._comment_id = None
+
+    # ---
+
+    def acquire(self):
+        if self.backend == "none":
+            self.acquired = True
+        elif self.backend == "file":
+            self.acquired = self._acquire_file()
+        else:
+            try:
+                self.acquired = self._acquire_issue()
+            except (requests.RequestException, KeyError, ValueError) as e:
+                # ロックの記録先に届かない場合は実行を止めない。重複実行を防げないので目立つように残す
+                print(f"❌ 実行ロック（Issue #{ISSUE_NUMBER}）を確認できませんでした。"
+                      f"他の実行と重複するおそれがありますが、ロックなしで続行します: {e}")
+                if os.getenv("GITHUB_ACTIONS"):
+                    print(f"::warning title=実行ロック::ロックを確認できずロックなしで実行しました（{self.name}）")
+                self._release_issue()
+                self.acquired = True
+        if not self.acquired:
+            print(f"⏭ 他の実行（{self.holder}）が動いているため終了します")
+        return self.acquired
+
+    def release(self):
+        if not self.acquired:
+            return
+        if self.backend == "file":
+            self._release_file()
+        elif self.backend == "issue":
+            self._release_issue()
+        self.acquired = False
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *exc):
+        self.release()
+        return False
@@ -0,0 +1,176 @@
+#!/usr/bin/env python3
+"""
+空き状況の状態データのコンパクトな保存形式
+
+Issue本文に整形済みJSON（indent=2）を丸ごと埋め込むと、監視期間や部屋数に比例して
+本文が大きくなる（GitHub Issue本文の上限は65536文字）。
+この形式では施設キー・部屋名・日付を辞書化し、空き枠は整数5つの組で表す。
+
+  SGST1:<base64( zlib( JSON ) )>
+
+JSON（バージョン1）の中身:
+  {
+    "v": 1,
+    "kind": "full",
+    "meta": {checked_at などの空き枠以外の項目},
+    "keys": [施設キー, ...],
+    "rooms": [部屋名, ...],
+    "dates": [[日付の序数(date.toordinal, 不明なら0), サイトの表示文字列], ...],
+    "slots": [施設キー番号, 日付番号, 部屋番号, 開始分, 終了分, ...]   （5個ずつ平坦に並べる）
+  }
+
+標準ライブラリだけで読み書きでき、Issue本文にそのまま貼れるテキストになる。
+"""
+
+import base64
+import json
+import os
+import zlib
+from datetime import datetime
+
+from circuit_breaker import state_dir, write_json_atomic
+from suginami_slots import hhmm_from_minutes, minutes_from_hhmm, parse_date_label
+
+FORMAT_VERSION = 1
+HEADER = f"SGST{FORMAT_VERSION}:"
+STRIDE = 5
+
+# チェッカーが最後に保存した状態データのローカルキャッシュ（availability_api.py が読む）
+STATE_CACHE_FILE = "latest_state.json"
+
+
+class StateFormatError(ValueError):
+    """状態データを解釈できない"""
+
+
+def _reference_date(meta):
+    checked_at = meta.get("checked_at")
+    if checked_at:
+        try:
+            return datetime.fromisoformat(checked_at).date()
+        except ValueError:
+            pass
+    return None
+
+
+class _Tables:
+    """施設キー・部屋名・日付の辞書"""
+
+    def __init__(self, reference=None, keys=None, rooms=None, dates=None):
+        self.reference = reference
+        self.keys = list(keys or [])
+        self.rooms = list(rooms or [])
+        self.dates = [list(entry) for entry in (dates or [])]
+        self._key_index = {key: i for i, key in enumerate(self.keys)}
+        self._room_index = {room: i for i, room in enumerate(self.rooms)}
+        self._date_index = {label: i for i, (_, label) in enumerate(self.dates)}
+
+    def _intern(self, index, table, value):
+        position = index.get(value)
+        if position is None:
+            position = index[value] = len(table)
+            table.append(value)
+        return position
+
+    def _date_position(self, label):
+        position = self._date_index.get(label)
+        if position is None:
+            parsed = parse_date_label(label, self.reference)
+            position = self._date_index[label] = len(self.dates)
+            self.dates.append([parsed.toordinal() if parsed else 0, label])
+        return position
+
+    def pack_slot(self, slot):
+        return [
+            self._intern(self._key_index, self.keys, slot["facility_key"]),
+            self._date_position(slot["date"]),
+            self._intern(self._room_index, self.rooms, slot["facility"]),
+            minutes_from_hhmm(slot["time_from"]),
+            minutes_from_hhmm(slot["time_to"]),
+        ]
+
+    def pack_slots(self, slots):
+        flat = []
+        for slot in slots:
+            flat.extend(self.pack_slot(slot))
+        return flat
+
+    def unpack_slots(self, flat):
+        if len(flat) % STRIDE:
+            raise StateFormatError("空き枠の配列長が不正です")
+        slots = []
+        for i in range(0, len(flat), STRIDE):
+            key, date_i, room_i, time_from, time_to = flat[i:i + STRIDE]
+            slots.append({
+                "date": self.dates[date_i][1],
+                "facility": self.rooms[room_i],
+                "time_from": hhmm_from_minutes(time_from),
+                "time_to": hhmm_from_minutes(time_to),
+                "facility_key": self.keys[key],
+            })
+        return slots
+
+    def as_dict(self):
+        return {"keys": self.keys, "rooms": self.rooms, "dates": self.dates}
+
+
+def _pack(document):
+    raw = json.dumps(document, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+    return HEADER + base64.b64encode(zlib.compress(raw, 9)).decode("ascii")
+
+
+def _unpack(text):
+    text = text.strip()
+    if not text.startswith("SGST"):
+        raise StateFormatError("ヘッダーがありません")
+    version, _, payload = text[4:].partition(":")
+    if version != str(FORMAT_VERSION):
+        raise StateFormatError(f"未対応の形式バージョンです: {version}")
+    try:
+        document = json.loads(zlib.decompress(base64.b64decode(payload)).decode("utf-8"))
+    except (ValueError, zlib.error) as e:
+        raise StateFormatError(f"状態データを展開できません: {e}") from e
+    if document.get("v") != FORMAT_VERSION:
+        raise StateFormatError("形式バージョンが一致しません")
+    return document
+
+
+def encode_state(data):
+    """状態データ（"availability" を持つ辞書）を完全なスナップショットとして符号化する"""
+    meta = {key: value for key, value in data.items() if key != "availability"}
+    tables = _Tables(_reference_date(meta))
+    slots = tables.pack_slots(data.get("availability", []))
+    return _pack({"v": FORMAT_VERSION, "kind": "full", "meta": meta, **tables.as_dict(), "slots": slots})
+
+
+def decode_state(text):
+    """符号化された状態データを、従来と同じ辞書形式に戻す"""
+    document = _unpack(text)
+    if document.get("kind") != "full":
+        raise StateFormatError(f"不明な種類です: {document.get('kind')}")
+    tables = _Tables(keys=document.get("keys"), rooms=document.get("rooms"), dates=document.get("dates"))
+    data = dict(document.get("meta", {}))
+    data["availability"] = tables.unpack_slots(document.get("slots", []))
+    return data
+
+
+def state_cache_path():
+    return os.path.join(state_dir(), STATE_CACHE_FILE)
+
+
+def write_state_cache(data):
+    """最新の状態データをローカルのキャッシュファイルに書き出す"""
+    write_json_atomic(state_cache_path(), data)
+
+
+def state_from_issue_body(body):
+    """Issue本文から状態データを取り出す（```state の圧縮形式と、旧形式の ```json の両方に対応）"""
+    if "```state" in body:
+        state_start = body.find("```state") + 8
+        state_end = body.find("```", state_start)
+        return decode_state(body[state_start:state_end])
+    if "```json" in body:
+        json_start = body.find("```json") + 7
+        json_end = body.find("```", json_start)
+        return json.loads(body[json_start:json_end].strip())
+    return None
@@ -0,0 +1,105 @@
+#!/usr/bin/env python3
+"""
+画面遷移をステップ単位で実行する仕組み（チェックポイント付きリトライ）
+
+各ステップは「操作」と「事後条件（その操作が済んだ画面になっているか）」の組。
+ステップが失敗したら現在の画面を事後条件で確認し直し、
+済んでいる最後のステップの次から再開する。フロー全体をやり直すのは
+どの事後条件も満たされていない（=ホーム画面からやり直すしかない）場合だけ。
+
+Playwright の page でも Selenium の driver でも使えるよう、
+操作と事後条件には呼び出し側の対象（target）をそのまま渡す。
+実行全体の締め切り（run_deadline.Deadline）を渡すと、各ステップの前に確認し、
+待ち時間も残り時間までに抑える。締め切りを過ぎたら再試行せずに DeadlineExceeded を送出する。
+"""
+
+import time
+
+from circuit_breaker import backoff_delay
+from run_deadline import DeadlineExceeded
+
+
+class StepFailed(Exception):
+    """ステップが再試行の上限を超えて失敗した"""
+
+
+class Step:
+    """画面遷移の1ステップ
+
+    action(target) で操作し、verify(target) が True を返せばそのステップは完了とみなす。
+    verify は待機せずに現在の画面だけを見て素早く判定すること。
+    """
+
+    def __init__(self, name, action, verify, retries=2):
+        self.name = name
+        self.action = action
+        self.verify = verify
+        self.retries = retries
+
+
+def _verified(step, target):
+    try:
+        return bool(step.verify(target))
+    except Exception:
+        return False
+
+
+def resume_index(steps, failed_index, target):
+    """現在の画面から再開すべきステップの位置を返す"""
+    for index in range(failed_index, -1, -1):
+        if _verified(steps[index], target):
+            return index + 1
+    return 0
+
+
+def run_steps(steps, target, recover=None, between_steps=None, backoff_base=2.0, backoff_cap=15.0, deadline=None):
+    """ステップを順に実行し、失敗時は確認済みの位置から再開する
+
+    recover(target) を渡すと、再開前に対象を作り直せる（ページがクラッシュした場合など）。
+    between_steps(target) は各ステップの前に呼ばれ、別の対象を返すと
+    （メモリ節約のためにページを作り直した場合など）現在の画面から再開位置を決め直す。
+    deadline（run_deadline.Deadline）を過ぎたら DeadlineExceeded を送出する。
+    最終的な対象を返す。
+    """
+    failures = {}
+    index = 0
+    while index < len(steps):
+        if deadline:
+            deadline.check(steps[index].name)
+        if between_steps:
+            replaced = between_steps(target)
+            if replaced is not target:
+                target = replaced
+                index = resume_index(steps, index - 1, target) if index > 0 else 0
+                if index >= len(steps):
+                    break
+
+        step = steps[index]
+        try:
+            step.action(target)
+            if not _verified(step, target):
+                raise StepFailed(f"事後条件を満たしていません: {step.name}")
+            index += 1
+            continue
+        except DeadlineExceeded:
+            raise
+        except Exception as e:
+            failures[step.name] = failures.get(step.name, 0) + 1
+            attempt = failures[step.name]
+            if attempt > step.retries:
+                raise StepFailed(f"{step.name} が {attempt}回失敗しました: {str(e)[:200]}") from e
+
+            wait_time = backoff_delay(attempt - 1, base=backoff_base, cap=backoff_cap)
+            print(f"⚠ ステップ「{step.name}」失敗 ({attempt}/{step.retries}): {str(e)[:100]}")
+            if deadline:
+                deadline.sleep(wait_time)
+                deadline.check(step.name)
+            else:
+                time.sleep(wait_time)
+
+        if recover:
+            target = recover(target)
+        index = resume_index(steps, index, target)
+        print(f"  ↪ ステップ「{steps[index].name if index < len(steps) else '完了'}」から再開")
+
+    return target
@@ -9,32 +9,67 @@ from selenium.webdriver.chrome.options import Options
 import time
 import json
 import os
-import requests
+import rate_limit
 from datetime import datetime
 
+import low_memory
+from artifacts import ArtifactRecorder
+from facility_catalog import FacilityCatalog
+from run_deadline import Deadline, DeadlineExceeded, request_timeout
+from run_lock import RUN_LOCK_NAME, RunLock
+from step_runner import Step, StepFailed, run_steps
+from suginami_slots import FACILITIES, slot_key
+
+SUGINAMI_HOME_URL = "https://www.shisetsuyoyaku.city.suginami.tokyo.jp/user/Home"
+
+FILTER_LABEL_XPATHS = ["//label[text()='1ヶ月']", "//label[text()='土曜日']", "//label[text()='日曜日']", "//label[text()='祝日']"]
+
+# ラベルに対応するチェックボックスが未チェックの場合だけクリックする（再試行しても状態が反転しない）
+ENSURE_LABEL_CHECKED_JS = """
+    const label = arguments[0];
+    const input = label.control || label.querySelector('input');
+    if (!(input && input.checked)) label.click();
+"""
+
+IS_LABEL_CHECKED_JS = """
+    const label = arguments[0];
+    const input = label.control || label.querySelector('input');
+    return !!(input && input.checked);
+"""
+
+class DeadlineWait(WebDriverWait):
+    """待機ごとのタイムアウトを、上限（timeout秒）と実行全体の締め切りまでの残り時間の短い方にする WebDriverWait"""
+
+    def __init__(self, driver, deadline, timeout=30):
+        super().__init__(driver, timeout)
+        self.deadline = deadline
+        self.cap = timeout
+
+    def until(self, method, message=""):
+        self.deadline.check("待機")
+        self._timeout = self.deadline.timeout(self.cap)
+        return super().until(method, message)
+
+    def until_not(self, method, message=""):
+        self.deadline.check("待機")
+        self._timeout = self.deadline.timeout(self.cap)
+        return super().until_not(method, message)
+
+def label_checked(driver, xpath):
+    """ラベルに対応するチェックボックスがチェック済みか"""
+    labels = driver.find_elements(By.XPATH, xpath)
+    return bool(labels) and driver.execute_script(IS_LABEL_CHECKED_JS, labels[0])
+
 def setup_filters(driver, wait):
     """絞り込み設定を行う共通処理"""
     wait.until(EC.presence_of_element_located((By.XPATH, "//h2[text()='施設別空き状況']")))
-    time.sleep(2)  # 安全な待機
-
-    # 各要素のクリックをリトライ機能付きで実行
-    def safe_click(xpath, description):
-        for attempt in range(3):
-            try:
-                element = wait.until(EC.element_to_be_clickable((By.XPATH, xpath)))
-                driver.execute_script("arguments[0].click();", element)
-                time.sleep(0.5)
-                print(f"✅ {description} クリック成功")
-                return True
-            except Exception as e:
-                print(f"⚠️ {description} クリック試行 {attempt + 1}/3 失敗: {e}")
-                time.sleep(1)
-        return False
+    wait.until(EC.element_to_be_clickable((By.XPATH, FILTER_LABEL_XPATHS[0])))
 
-    safe_click("//label[text()='1ヶ月']", "1ヶ月選択")
-    safe_click("//label[text()='土曜日']", "土曜日選択")
-    safe_click("//label[text()='日曜日']", "日曜日選択")
-    safe_click("//label[text()='祝日']", "祝日選択")
+    for xpath in FILTER_LABEL_XPATHS:
+        label = wait.until(EC.element_to_be_clickable((By.XPATH, xpath)))
+        driver.execute_script(ENSURE_LABEL_CHECKED_JS, label)
+        time.sleep(0.5)
+    print("✅ 絞り込み条件を設定")
 
 def click_display_and_wait(driver, wait):
     """表示ボタンをクリックして読み込み完了まで待機"""
@@ -51,8 +86,8 @@ def select_facility(driver, wait, facility_name):
     button = wait.until(EC.presence_of_element_located((By.XPATH, "//button[text()='集会施設']")))
     driver.execute_script("arguments[0].click();", button)
 
-    checkbox = wait.until(EC.presence_of_element_located((By.XPATH, f"//label[contains(text(), '{facility_name}')]")))
-    driver.execute_script("arguments[0].click();", checkbox)
+    label = wait.until(EC.presence_of_element_located((By.XPATH, f"//label[contains(text(), '{facility_name}')]")))
+    driver.execute_script(ENSURE_LABEL_CHECKED_JS, label)
 
     next_button = wait.until(EC.presence_of_element_located((By.XPATH, "//button[@aria-label='次へ進む']")))
     driver.execute_script("arguments[0].click();", next_button)
@@ -107,7 +142,7 @@ def send_slack_notification(new_slots):
 
     payload = {"text": message}
     try:
-        requests.post(webhook_url, json=payload)
+        rate_limit.post(webhook_url, json=payload)
     except:
         pass
 
@@ -121,14 +156,12 @@ def save_data_if_new_slots_added(current_data, filename):
     # 前回のデータを識別子のセットに変換
     previous_slots = set()
     for slot in previous_availability:
-        slot_id = f"{slot['facility_key']}_{slot['date']}_{slot['facility']}_{slot['time_from']}_{slot['time_to']}"
-        previous_slots.add(slot_id)
+        previous_slots.add(slot_key(slot))
 
     # 今回のデータから新しいスロットをチェック
     new_slots = []
     for slot in current_availability:
-        slot_id = f"{slot['facility_key']}_{slot['date']}_{slot['facility']}_{slot['time_from']}_{slot['time_to']}"
-        if slot_id not in previous_slots:
+        if slot_key(slot) not in previous_slots:
             new_slots.append(slot)
 
     if new_slots:
@@ -146,86 +179,132 @@ def save_data_if_new_slots_added(current_data, filename):
         print(f"📝 新しいスロットはありません: {filename}")
         return False
 
-def process_nishiogi(driver, wait):
-    """西荻地域区民センター・勤福会館の処理"""
-    print("🏢 西荻地域区民センター・勤福会館 処理開始")
-
-    # アクセスにリトライ機能追加（タイムアウト短縮）
-    for attempt in range(3):
-        try:
-            driver.set_page_load_timeout(30)  # 短いタイムアウト
-            driver.get("https://www.shisetsuyoyaku.city.suginami.tokyo.jp/user/Home")
-            time.sleep(5)  # ページロード待機を延長
-            print(f"✅ ページアクセス成功（試行 {attempt + 1}）")
-            break
-        except Exception as e:
-            print(f"⚠️ ページアクセス試行 {attempt + 1}/3 失敗: {str(e)[:100]}")
-            if attempt < 2:
-                time.sleep(3)
-            else:
-                print("❌ 全てのアクセス試行が失敗")
-                return []
-
-    select_facility(driver, wait, "西荻地域区民センター・勤福会館")
-    setup_filters(driver, wait)
-    click_display_and_wait(driver, wait)
-
-    elements_a = driver.find_elements(By.XPATH, "//tr[td[contains(text(), '体育室半面Ａ')]]//label[contains(@class, 'some')]/input[@type='checkbox']")
-    elements_b = driver.find_elements(By.XPATH, "//tr[td[contains(text(), '体育室半面Ｂ')]]//label[contains(@class, 'some')]/input[@type='checkbox']")
-
-    if not elements_a and not elements_b:
-        print("❌ 体育室要素が見つかりません")
+def room_checkboxes(driver, room_names, facility_name=None):
+    """部屋名を含む行の「一部空き」チェックボックス
+
+    施設・部屋カタログ（facility_catalog.py）に記録があれば、記録したIDの行から選ぶ。
+    """
+    catalog = FacilityCatalog.load()
+    target = catalog.resolve(facility_name, room_names) if facility_name else None
+    if target:
+        # 記録したIDの行でも、部屋名を含まない行は選ばない（IDが別の部屋に使い回された場合）
+        named = " or ".join(f"contains(., '{room_name}')" for room_name in room_names)
+        elements = []
+        rows = 0
+        for room in target["rooms"]:
+            row = f"//tr[.//input[@{room['by']}='{room['key']}']]"
+            rows += len(driver.find_elements(By.XPATH, row))
+            elements += driver.find_elements(By.XPATH, f"{row}[td[{named}]]//label[contains(@class, 'some')]/input[@type='checkbox']")
+        if elements:
+            return elements
+        if rows and not driver.find_elements(By.XPATH, " | ".join(
+                f"//tr[.//input[@{room['by']}='{room['key']}']][td[{named}]]" for room in target["rooms"])):
+            print("⚠ カタログのIDの行が別の部屋になっています。部屋名で選択します")
+            catalog.invalidate(facility_name)
+
+    elements = []
+    for room_name in room_names:
+        elements += driver.find_elements(By.XPATH, f"//tr[td[contains(text(), '{room_name}')]]//label[contains(@class, 'some')]/input[@type='checkbox']")
+    return elements
+
+def build_facility_steps(wait, facility_name, room_names, state, deadline=None):
+    """ホーム → 施設選択 → 絞り込み → 部屋選択 → 時間帯別空き状況 の各ステップ
+
+    選択できる部屋（一部空き）がない場合は state["no_rooms"] を立てて以降の遷移を省く。
+    """
+    def open_home(driver):
+        driver.set_page_load_timeout(request_timeout(deadline, 30))  # 短いタイムアウト（締め切りまでに抑える）
+        driver.get(SUGINAMI_HOME_URL)
+        wait.until(EC.presence_of_element_located((By.XPATH, "//button[text()='集会施設']")))
+        print("✅ ページアクセス成功")
+
+    def filter_and_display(driver):
+        setup_filters(driver, wait)
+        click_display_and_wait(driver, wait)
+
+    def filters_applied(driver):
+        return all(label_checked(driver, xpath) for xpath in FILTER_LABEL_XPATHS) \
+            and bool(driver.find_elements(By.CSS_SELECTOR, "tr td"))
+
+    def select_rooms(driver):
+        elements = room_checkboxes(driver, room_names, facility_name)
+        state["no_rooms"] = not elements
+        if not elements:
+            print("❌ 体育室要素が見つかりません")
+            return
+        print(f"✅ 体育室要素発見: {len(elements)}個")
+        for element in elements:
+            if not element.is_selected():
+                driver.execute_script("arguments[0].click();", element)
+                time.sleep(0.2)
+
+    def rooms_selected(driver):
+        return state.get("no_rooms") or any(element.is_selected() for element in room_checkboxes(driver, room_names, facility_name))
+
+    def go_to_time_availability(driver):
+        if state.get("no_rooms"):
+            return
+        wait.until(EC.element_to_be_clickable((By.XPATH, "//button[@aria-label='次へ進む']"))).click()
+        wait.until(EC.presence_of_element_located((By.XPATH, "//h2[text()='時間帯別空き状況']")))
+
+    return [
+        Step("ホームを開く", open_home,
+             lambda driver: bool(driver.find_elements(By.XPATH, "//button[text()='集会施設']"))),
+        Step("施設を選択", lambda driver: select_facility(driver, wait, facility_name),
+             lambda driver: bool(driver.find_elements(By.XPATH, "//h2[text()='施設別空き状況']"))),
+        Step("絞り込んで表示", filter_and_display, filters_applied),
+        Step("体育室を選択", select_rooms, rooms_selected),
+        Step("時間帯別空き状況へ進む", go_to_time_availability,
+             lambda driver: state.get("no_rooms") or bool(driver.find_elements(By.XPATH, "//h2[text()='時間帯別空き状況']"))),
+    ]
+
+def process_facility(driver, wait, facility_key, recorder=None, deadline=None):
+    """施設の空き状況を取得（失敗したステップから再開する）
+
+    recorder（ArtifactRecorder）を渡すと、ステップが失敗した時点の画面を記録する。
+    deadline（run_deadline.Deadline）を過ぎたら DeadlineExceeded を送出する。
+    """
+    facility = FACILITIES[facility_key]
+    print(f"🏢 {facility['name']} 処理開始")
+
+    def recover(target):
+        if recorder:
+            recorder.capture_driver(target, f"{facility_key}_ステップ失敗")
+        return target
+
+    state = {}
+    try:
+        run_steps(build_facility_steps(wait, facility["name"], facility["rooms"], state, deadline), driver,
+                  recover=recover, deadline=deadline)
+    except StepFailed as e:
+        print(f"❌ {e}")
+        if recorder:
+            recorder.note_exception(e)
+            recorder.anomaly(f"{facility_key} の空き状況を取得できませんでした")
         return []
 
-    print(f"✅ 体育室要素発見: A={len(elements_a)}, B={len(elements_b)}")
-    for element in elements_a + elements_b:
-        driver.execute_script("arguments[0].click();", element)
-        time.sleep(0.2)
-
-    wait.until(EC.element_to_be_clickable((By.XPATH, "//button[@aria-label='次へ進む']"))).click()
-    wait.until(EC.presence_of_element_located((By.XPATH, "//h2[text()='時間帯別空き状況']")))
-
-    return get_availability_data(driver, "nishiogi")
-
-def process_sesion(driver, wait):
-    """セシオン杉並の処理"""
-    print("🏢 セシオン杉並 処理開始")
-
-    # アクセスにリトライ機能追加
-    for attempt in range(3):
-        try:
-            driver.set_page_load_timeout(30)
-            driver.get("https://www.shisetsuyoyaku.city.suginami.tokyo.jp/user/Home")
-            time.sleep(5)
-            print(f"✅ ページアクセス成功（試行 {attempt + 1}）")
-            break
-        except Exception as e:
-            print(f"⚠️ ページアクセス試行 {attempt + 1}/3 失敗: {str(e)[:100]}")
-            if attempt < 2:
-                time.sleep(3)
-            else:
-                print("❌ 全てのアクセス試行が失敗")
-                return []
-    select_facility(driver, wait, "セシオン杉並")
-    setup_filters(driver, wait)
-    click_display_and_wait(driver, wait)
-
-    elements = driver.find_elements(By.XPATH, "//tr[td[contains(text(), '体育室全面')]]//label[contains(@class, 'some')]/input[@type='checkbox']")
-
-    if not elements:
+    if state.get("no_rooms"):
         return []
 
-    for element in elements:
-        driver.execute_script("arguments[0].click();", element)
+    return get_availability_data(driver, facility_key)
 
-    wait.until(EC.element_to_be_clickable((By.XPATH, "//button[@aria-label='次へ進む']"))).click()
-    wait.until(EC.presence_of_element_located((By.XPATH, "//h2[text()='時間帯別空き状況']")))
+def process_nishiogi(driver, wait, recorder=None):
+    """西荻地域区民センター・勤福会館の処理"""
+    return process_facility(driver, wait, "nishiogi", recorder)
 
-    return get_availability_data(driver, "sesion")
+def process_sesion(driver, wait, recorder=None):
+    """セシオン杉並の処理"""
+    return process_facility(driver, wait, "sesion", recorder)
 
 def run():
     print("🚀 スクリプト開始")
 
+    with RunLock(RUN_LOCK_NAME) as lock:
+        if not lock.acquired:
+            return True
+        return _run_mode()
+
+def _run_mode():
     # GitHub Actions環境での簡易モード
     if os.getenv('GITHUB_ACTIONS') == 'true':
         print("🤖 GitHub Actions環境: 簡易アクセスモード")
@@ -330,6 +409,10 @@ def run_full_mode():
     options.add_argument("--no-first-run")
     options.add_argument("--mute-audio")
 
+    # 省メモリモード（LOW_MEMORY=true）の起動引数
+    for arg in low_memory.chromium_args():
+        options.add_argument(arg)
+
     # ページロード戦略
     options.page_load_strategy = 'eager'
 
@@ -341,21 +424,40 @@ def run_full_mode():
         driver = webdriver.Chrome(service=Service(ChromeDriverManager().install()), options=options)
         driver.execute_script("Object.defineProperty(navigator, 'webdriver', {get: () => undefined})")
 
-    wait = WebDriverWait(driver, 30)
+    deadline = Deadline()
+    wait = DeadlineWait(driver, deadline)
+    recorder = ArtifactRecorder("suginami-selenium")
+    failed = True
 
     try:
-        all_availability = process_nishiogi(driver, wait) + process_sesion(driver, wait)
+        # 締め切りを過ぎたら残りの施設は前回の空き枠を引き継ぎ、取得済みの施設だけで保存・通知する
+        previous_availability = load_previous_data("suginami_availability.json").get("availability", [])
+        all_availability = []
+        stale = []
+        for facility_key in ("nishiogi", "sesion"):
+            try:
+                deadline.check(facility_key)
+                all_availability += process_facility(driver, wait, facility_key, recorder, deadline)
+            except DeadlineExceeded as e:
+                print(f"⏱ {e} — {facility_key} は前回の空き枠を引き継ぎます")
+                stale.append(facility_key)
+                all_availability += [slot for slot in previous_availability if slot["facility_key"] == facility_key]
         current_data = {
             "availability": all_availability,
             "last_checked": datetime.now().isoformat(),
-            "mode": "full_functionality"
+            "mode": "full_functionality",
+            "stale": stale
         }
+        failed = False
         return save_data_if_new_slots_added(current_data, "suginami_availability.json")
 
     except Exception as e:
         print(f"❌ エラー: {e}")
+        recorder.note_exception(e)
+        recorder.capture_driver(driver, "エラー")
         return False
     finally:
+        recorder.finish(failed)
         driver.quit()
 
 if __name__ == "__main__":
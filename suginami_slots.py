@@ -0,0 +1,242 @@
+#!/usr/bin/env python3
+"""
+杉並区施設予約の空き枠データ 共通処理
+
+空き枠は以下の形式の辞書で扱う:
+  {"date": ..., "facility": ..., "time_from": "09:00", "time_to": "12:00", "facility_key": "nishiogi"}
+"""
+
+import os
+import re
+from datetime import date, timedelta
+from typing import NamedTuple
+
+from jp_holidays import SATURDAY, SUNDAY, add_months, candidate_dates
+
+# 監視対象の施設（facility_key → 施設選択画面のラベル、選択する部屋名、対象の曜日（0=月曜）と祝日）
+# 集会施設以外の施設は "category" に分類ボタンの名前を書く（python facility_catalog.py find で調べられる）
+FACILITIES = {
+    "nishiogi": {
+        "name": "西荻地域区民センター・勤福会館",
+        "rooms": ["体育室半面"],
+        "weekdays": [SATURDAY, SUNDAY],
+        "holidays": True,
+    },
+    "sesion": {
+        "name": "セシオン杉並",
+        "rooms": ["体育室全面"],
+        "weekdays": [SATURDAY, SUNDAY],
+        "holidays": True,
+    },
+}
+
+# 絞り込みで選ぶ表示期間（「1ヶ月」）
+SITE_PERIOD_MONTHS = 1
+
+
+def horizon_months():
+    """監視する期間の月数（SUGINAMI_HORIZON_MONTHS。表示期間ごとのシャードに分けて取得する）"""
+    return max(SITE_PERIOD_MONTHS, int(os.getenv("SUGINAMI_HORIZON_MONTHS", str(SITE_PERIOD_MONTHS))))
+
+
+def date_shards(start=None, months=None):
+    """監視する期間を表示期間（1ヶ月）ごとに分けた開始日の一覧。最初のシャードは今日（開始日の指定なし）で None
+
+    次のシャードは前のシャードの表示期間の終わりから始める（月末で日が切り詰められても隙間ができない）。
+    切り詰めで期間の終わりに届かなければ、短いシャードを1つ足す。
+    """
+    start = start or date.today()
+    months = horizon_months() if months is None else months
+    end = add_months(start, months)
+    shards = [None]
+    day = add_months(start, SITE_PERIOD_MONTHS)
+    while day < end:
+        shards.append(day)
+        day = add_months(day, SITE_PERIOD_MONTHS)
+    return shards
+
+
+def slot_key(slot):
+    """空き枠の識別子（施設キー・日付・部屋・時間帯）を返す"""
+    return f"{slot['facility_key']}_{slot['date']}_{slot['facility']}_{slot['time_from']}_{slot['time_to']}"
+
+
+def minutes_from_hhmm(text):
+    """'09:00' → 540"""
+    hours, minutes = text.split(":")
+    return int(hours) * 60 + int(minutes)
+
+
+def hhmm_from_minutes(minutes):
+    """540 → '09:00'"""
+    return f"{minutes // 60:02d}:{minutes % 60:02d}"
+
+
+_DATE_PATTERNS = [
+    re.compile(r"(?P<y>\d{4})\s*[/年.-]\s*(?P<m>\d{1,2})\s*[/月.-]\s*(?P<d>\d{1,2})"),
+    re.compile(r"(?P<m>\d{1,2})\s*[/月]\s*(?P<d>\d{1,2})"),
+]
+
+
+def parse_date_label(text, reference=None):
+    """サイトの日付表示（"2025/10/18(土)", "10月18日(土)" など）を date に変換する
+
+    年がない場合は reference（デフォルト: 今日）の31日前以降で最も近い日付とみなす。
+    解釈できなければ None を返す。
+    """
+    reference = reference or date.today()
+    for pattern in _DATE_PATTERNS:
+        match = pattern.search(text)
+        if not match:
+            continue
+        parts = match.groupdict()
+        try:
+            if parts.get("y"):
+                return date(int(parts["y"]), int(parts["m"]), int(parts["d"]))
+            candidate = date(reference.year, int(parts["m"]), int(parts["d"]))
+            if candidate < reference - timedelta(days=31):
+                candidate = date(reference.year + 1, candidate.month, candidate.day)
+            return candidate
+        except ValueError:
+            return None
+    return None
+
+
+def watch_candidate_dates(facility_key, start=None, months=SITE_PERIOD_MONTHS):
+    """施設の監視対象日（指定曜日と祝日）を start から months か月分返す"""
+    facility = FACILITIES[facility_key]
+    start = start or date.today()
+    return candidate_dates(start, add_months(start, months), facility["weekdays"], facility["holidays"])
+
+
+def check_date_coverage(date_labels, candidates, reference=None):
+    """サイトが返した日付表示と監視対象日を突き合わせる
+
+    (表示された対象日, 欠けている対象日, 対象外の日付表示) を返す。
+    欠けている日は、表示された最初の日以降の対象日に限る（予約受付前の直近の日は数えない）。
+    """
+    shown = {}
+    for label in date_labels:
+        parsed = parse_date_label(label, reference)
+        if parsed is not None:
+            shown[parsed] = label
+
+    candidate_set = set(candidates)
+    first_shown = min(shown) if shown else None
+    missing = [day for day in candidates if first_shown and day >= first_shown and day not in shown]
+    unexpected = [label for day, label in shown.items() if day not in candidate_set]
+    covered = [day for day in candidates if day in shown]
+    return covered, missing, unexpected
+
+
+def filter_candidate_slots(slots, candidates, reference=None):
+    """監視対象日以外の空き枠を除く（日付を解釈できない枠は残す）"""
+    candidate_set = set(candidates)
+    parsed = {}
+    kept = []
+    for slot in slots:
+        label = slot["date"]
+        if label not in parsed:
+            parsed[label] = parse_date_label(label, reference)
+        if parsed[label] is None or parsed[label] in candidate_set:
+            kept.append(slot)
+    return kept
+
+
+# 施設キー・部屋名・日付表示の辞書（Slot はこれらのIDだけを持つ）
+_facility_keys = []
+_facility_ids = {}
+_room_names = []
+_room_ids = {}
+_label_dates = {}
+_date_labels = {}
+
+
+def _intern(ids, names, value):
+    position = ids.get(value)
+    if position is None:
+        position = ids[value] = len(names)
+        names.append(value)
+    return position
+
+
+def _date_from_label(label, reference=None):
+    # 年のない日付表示は reference によって別の日になるので、reference ごとに覚える
+    key = (label, reference or date.today())
+    value = _label_dates.get(key)
+    if value is None:
+        parsed = parse_date_label(label, key[1])
+        # 解釈できない日付表示には負の仮IDを振る
+        value = parsed.toordinal() if parsed else -(len(_label_dates) + 1)
+        _label_dates[key] = value
+        _date_labels.setdefault(value, label)
+    return value
+
+
+class Slot(NamedTuple):
+    """空き枠1件（整数だけを持つ軽量なレコード）
+
+    facility, room は辞書化したID、date は日付の序数（date.toordinal）、
+    start, end は0時からの分。タプルなのでそのまま集合・辞書のキーにできる。
+    """
+
+    facility: int
+    date: int
+    room: int
+    start: int
+    end: int
+
+    @classmethod
+    def from_legacy(cls, slot, reference=None):
+        """従来の辞書形式から変換する"""
+        return cls(
+            _intern(_facility_ids, _facility_keys, slot["facility_key"]),
+            _date_from_label(slot["date"], reference),
+            _intern(_room_ids, _room_names, slot["facility"]),
+            minutes_from_hhmm(slot["time_from"]),
+            minutes_from_hhmm(slot["time_to"]),
+        )
+
+    @property
+    def facility_key(self):
+        return _facility_keys[self.facility]
+
+    @property
+    def room_name(self):
+        return _room_names[self.room]
+
+    @property
+    def date_label(self):
+        return _date_labels[self.date]
+
+    @property
+    def day(self):
+        """date（解釈できない日付表示なら None）"""
+        return date.fromordinal(self.date) if self.date > 0 else None
+
+    def to_legacy(self):
+        """従来の辞書形式に戻す（Slack通知・Issue保存用）"""
+        return {
+            "date": self.date_label,
+            "facility": self.room_name,
+            "time_from": hhmm_from_minutes(self.start),
+            "time_to": hhmm_from_minutes(self.end),
+            "facility_key": self.facility_key,
+        }
+
+
+def slots_from_legacy(slots, reference=None):
+    return [Slot.from_legacy(slot, reference) for slot in slots]
+
+
+def slots_to_legacy(slots):
+    return [slot.to_legacy() for slot in slots]
+
+
+def merge_slots(*slot_lists):
+    """複数のシャードの空き枠（辞書形式）を、正規化した Slot で重複を除いてまとめる（最初に現れた順）"""
+    merged = {}
+    for slots in slot_lists:
+        for slot in slots:
+            merged.setdefault(Slot.from_legacy(slot), slot)
+    return list(merged.values())
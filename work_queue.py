@@ -0,0 +1,381 @@
+#!/usr/bin/env python3
+"""
+施設チェックのジョブキュー（複数のワーカーで分担するため）
+
+ジョブは取り出すとリース（一定時間だけ他のワーカーから見えなくなる）され、
+ワーカーが完了を通知（ack）するまでキューに残る。ワーカーが落ちてリースが切れたジョブは
+別のワーカーが取り直す。試行回数が上限を超えたジョブはデッドレターに移す。
+ジョブIDが同じジョブは1度しか登録されない（複数のスケジューラーが同じ間隔のジョブを登録しても重複しない）。
+
+バックエンド:
+  SQLite（デフォルト）: 1台のマシン、または共有ディスク上の複数プロセス
+  Redis互換サーバー   : 複数台のワーカー（redis パッケージが必要。Valkey等のRedis互換サーバーでも可）
+
+ジョブの状態: ready（待ち） → leased（処理中） → done（完了） / dead（デッドレター）
+
+設定（環境変数）:
+  WORK_QUEUE_URL                キューの場所（デフォルト: sqlite:///CHECKER_STATE_DIR/queue.sqlite3）
+                                  sqlite:///path/to/queue.sqlite3
+                                  redis://host:6379/0
+  WORK_QUEUE_VISIBILITY_SECONDS リース期間（デフォルト: 900）
+  WORK_QUEUE_MAX_ATTEMPTS       デッドレターに移すまでの試行回数（デフォルト: 3）
+"""
+
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from typing import NamedTuple
+
+from circuit_breaker import state_dir
+
+try:
+    import redis
+except ImportError:
+    redis = None
+
+
+class Job(NamedTuple):
+    """リースしたジョブ（token はリースの識別子。ack・nack・extend に使う）"""
+
+    id: str
+    payload: dict
+    attempts: int
+    token: str
+
+
+def _visibility_seconds():
+    return float(os.getenv("WORK_QUEUE_VISIBILITY_SECONDS", "900"))
+
+
+def _max_attempts():
+    return int(os.getenv("WORK_QUEUE_MAX_ATTEMPTS", "3"))
+
+
+SQLITE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    payload TEXT NOT NULL,
+    state TEXT NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    max_attempts INTEGER NOT NULL,
+    visible_at REAL NOT NULL,
+    token TEXT,
+    worker TEXT,
+    result TEXT,
+    error TEXT,
+    updated_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS jobs_visible ON jobs (state, visible_at);
+"""
+
+
+class SQLiteQueue:
+    """SQLiteのジョブキュー（取り出しは BEGIN IMMEDIATE で排他する）"""
+
+    def __init__(self, path=None):
+        self.path = path or os.path.join(state_dir(), "queue.sqlite3")
+        self.conn = sqlite3.connect(self.path, timeout=30, isolation_level=None, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.executescript(SQLITE_SCHEMA)
+        # リースの延長（ハートビート）を別スレッドから呼べるよう、接続の利用を直列化する
+        self._lock = threading.RLock()
+
+    def _begin(self):
+        self.conn.execute("BEGIN IMMEDIATE")
+
+    def enqueue(self, job_id, payload, delay=0.0, max_attempts=None):
+        """ジョブを登録する。同じIDのジョブがあれば何もせず False を返す"""
+        with self._lock:
+            now = time.time()
+            cursor = self.conn.execute(
+                "INSERT OR IGNORE INTO jobs (id, payload, state, max_attempts, visible_at, updated_at) "
+                "VALUES (?, ?, 'ready', ?, ?, ?)",
+                (job_id, json.dumps(payload, ensure_ascii=False), max_attempts or _max_attempts(), now + delay, now),
+            )
+            return cursor.rowcount == 1
+
+    def lease(self, worker="", visibility_seconds=None):
+        """見えているジョブを1件リースする（なければ None）"""
+        with self._lock:
+            visibility_seconds = visibility_seconds or _visibility_seconds()
+            self._begin()
+            try:
+                while True:
+                    now = time.time()
+                    row = self.conn.execute(
+                        "SELECT id, payload, attempts, max_attempts FROM jobs "
+                        "WHERE state IN ('ready', 'leased') AND visible_at <= ? ORDER BY visible_at LIMIT 1",
+                        (now,),
+                    ).fetchone()
+                    if row is None:
+                        self.conn.execute("COMMIT")
+                        return None
+
+                    job_id, payload, attempts, max_attempts = row
+                    if attempts >= max_attempts:
+                        # リースが切れたまま試行回数を使い切った
+                        self.conn.execute(
+                            "UPDATE jobs SET state = 'dead', token = NULL, error = COALESCE(error, ?), updated_at = ? WHERE id = ?",
+                            ("リース期間内に完了しませんでした", now, job_id),
+                        )
+                        continue
+
+                    token = uuid.uuid4().hex
+                    self.conn.execute(
+                        "UPDATE jobs SET state = 'leased', attempts = ?, visible_at = ?, token = ?, worker = ?, updated_at = ? "
+                        "WHERE id = ?",
+                        (attempts + 1, now + visibility_seconds, token, worker, now, job_id),
+                    )
+                    self.conn.execute("COMMIT")
+                    return Job(job_id, json.loads(payload), attempts + 1, token)
+            except Exception:
+                self.conn.execute("ROLLBACK")
+                raise
+
+    def extend(self, job, visibility_seconds=None):
+        """リースを延長する。リースを失っていれば False"""
+        with self._lock:
+            cursor = self.conn.execute(
+                "UPDATE jobs SET visible_at = ?, updated_at = ? WHERE id = ? AND token = ? AND state = 'leased'",
+                (time.time() + (visibility_seconds or _visibility_seconds()), time.time(), job.id, job.token),
+            )
+            return cursor.rowcount == 1
+
+    def ack(self, job, result=None):
+        """完了を記録する。リースを失っていれば（別のワーカーが取り直していれば）False"""
+        with self._lock:
+            cursor = self.conn.execute(
+                "UPDATE jobs SET state = 'done', token = NULL, result = ?, updated_at = ? "
+                "WHERE id = ? AND token = ? AND state = 'leased'",
+                (json.dumps(result, ensure_ascii=False), time.time(), job.id, job.token),
+            )
+            return cursor.rowcount == 1
+
+    def nack(self, job, error="", delay=0.0):
+        """失敗を記録する。試行回数が残っていれば delay 秒後に再び取り出せるようにする"""
+        with self._lock:
+            now = time.time()
+            self._begin()
+            try:
+                row = self.conn.execute("SELECT max_attempts FROM jobs WHERE id = ? AND token = ? AND state = 'leased'",
+                                        (job.id, job.token)).fetchone()
+                if row is None:
+                    self.conn.execute("COMMIT")
+                    return False
+                state = "dead" if job.attempts >= row[0] else "ready"
+                self.conn.execute(
+                    "UPDATE jobs SET state = ?, token = NULL, visible_at = ?, error = ?, updated_at = ? WHERE id = ?",
+                    (state, now + delay, str(error)[:500], now, job.id),
+                )
+                self.conn.execute("COMMIT")
+                return True
+            except Exception:
+                self.conn.execute("ROLLBACK")
+                raise
+
+    def status(self, job_id):
+        """{"state", "attempts", "result", "error"}（ジョブがなければ None）"""
+        with self._lock:
+            row = self.conn.execute("SELECT state, attempts, result, error FROM jobs WHERE id = ?", (job_id,)).fetchone()
+            if row is None:
+                return None
+            return {"state": row[0], "attempts": row[1], "result": json.loads(row[2]) if row[2] else None, "error": row[3]}
+
+    def dead_letters(self):
+        with self._lock:
+            return [
+                {"id": row[0], "payload": json.loads(row[1]), "attempts": row[2], "error": row[3]}
+                for row in self.conn.execute("SELECT id, payload, attempts, error FROM jobs WHERE state = 'dead' ORDER BY updated_at")
+            ]
+
+    def requeue(self, job_id):
+        """デッドレターのジョブを試行回数をリセットして戻す"""
+        with self._lock:
+            cursor = self.conn.execute(
+                "UPDATE jobs SET state = 'ready', attempts = 0, visible_at = ?, error = NULL, updated_at = ? "
+                "WHERE id = ? AND state = 'dead'",
+                (time.time(), time.time(), job_id),
+            )
+            return cursor.rowcount == 1
+
+    def purge(self, older_than_seconds=7 * 86400):
+        """完了・デッドレターのジョブのうち古いものを削除する"""
+        with self._lock:
+            cursor = self.conn.execute("DELETE FROM jobs WHERE state IN ('done', 'dead') AND updated_at < ?",
+                                       (time.time() - older_than_seconds,))
+            return cursor.rowcount
+
+    def close(self):
+        self.conn.close()
+
+
+# Redis では、ready と leased のジョブを「見えるようになる時刻」をスコアにした1つのsorted setで管理する
+# （SQLite の visible_at と同じ）。状態の変更はすべてLuaスクリプトで原子的に行う
+_REDIS_ENQUEUE = """
+if redis.call('EXISTS', KEYS[2]) == 1 then return 0 end
+redis.call('HSET', KEYS[2], 'payload', ARGV[1], 'state', 'ready', 'attempts', 0, 'max_attempts', ARGV[2])
+redis.call('ZADD', KEYS[1], ARGV[3], ARGV[4])
+return 1
+"""
+
+_REDIS_LEASE = """
+local now = tonumber(ARGV[1])
+while true do
+  local ids = redis.call('ZRANGEBYSCORE', KEYS[1], '-inf', now, 'LIMIT', 0, 1)
+  if #ids == 0 then return false end
+  local id = ids[1]
+  local key = ARGV[5] .. id
+  local attempts = tonumber(redis.call('HGET', key, 'attempts') or '0')
+  local max_attempts = tonumber(redis.call('HGET', key, 'max_attempts') or '1')
+  if attempts >= max_attempts then
+    redis.call('ZREM', KEYS[1], id)
+    redis.call('HSET', key, 'state', 'dead', 'token', '')
+    if not redis.call('HGET', key, 'error') then redis.call('HSET', key, 'error', ARGV[6]) end
+    redis.call('ZADD', KEYS[2], now, id)
+  else
+    redis.call('ZADD', KEYS[1], now + tonumber(ARGV[2]), id)
+    redis.call('HSET', key, 'state', 'leased', 'attempts', attempts + 1, 'token', ARGV[3], 'worker', ARGV[4])
+    return {id, redis.call('HGET', key, 'payload'), attempts + 1}
+  end
+end
+"""
+
+_REDIS_EXTEND = """
+if redis.call('HGET', KEYS[2], 'token') ~= ARGV[1] or redis.call('HGET', KEYS[2], 'state') ~= 'leased' then return 0 end
+redis.call('ZADD', KEYS[1], ARGV[2], ARGV[3])
+return 1
+"""
+
+_REDIS_ACK = """
+if redis.call('HGET', KEYS[2], 'token') ~= ARGV[1] or redis.call('HGET', KEYS[2], 'state') ~= 'leased' then return 0 end
+redis.call('ZREM', KEYS[1], ARGV[3])
+redis.call('HSET', KEYS[2], 'state', 'done', 'token', '', 'result', ARGV[2])
+redis.call('EXPIRE', KEYS[2], ARGV[4])
+return 1
+"""
+
+_REDIS_NACK = """
+if redis.call('HGET', KEYS[2], 'token') ~= ARGV[1] or redis.call('HGET', KEYS[2], 'state') ~= 'leased' then return 0 end
+redis.call('HSET', KEYS[2], 'token', '', 'error', ARGV[2])
+if tonumber(redis.call('HGET', KEYS[2], 'attempts')) >= tonumber(redis.call('HGET', KEYS[2], 'max_attempts')) then
+  redis.call('ZREM', KEYS[1], ARGV[4])
+  redis.call('HSET', KEYS[2], 'state', 'dead')
+  redis.call('ZADD', KEYS[3], ARGV[5], ARGV[4])
+else
+  redis.call('HSET', KEYS[2], 'state', 'ready')
+  redis.call('ZADD', KEYS[1], ARGV[3], ARGV[4])
+end
+return 1
+"""
+
+
+class RedisQueue:
+    """Redis互換サーバーのジョブキュー（SQLiteQueue と同じ操作）"""
+
+    def __init__(self, url, prefix="taikukan:queue:", done_ttl_seconds=7 * 86400):
+        if redis is None:
+            raise RuntimeError("Redisのキューを使うには redis パッケージが必要です: pip install redis")
+        self.client = redis.Redis.from_url(url, decode_responses=True)
+        self.prefix = prefix
+        self.done_ttl_seconds = done_ttl_seconds
+        self.visible_key = prefix + "visible"
+        self.dead_key = prefix + "dead"
+        self._enqueue = self.client.register_script(_REDIS_ENQUEUE)
+        self._lease = self.client.register_script(_REDIS_LEASE)
+        self._extend = self.client.register_script(_REDIS_EXTEND)
+        self._ack = self.client.register_script(_REDIS_ACK)
+        self._nack = self.client.register_script(_REDIS_NACK)
+
+    def _job_key(self, job_id):
+        return f"{self.prefix}job:{job_id}"
+
+    def enqueue(self, job_id, payload, delay=0.0, max_attempts=None):
+        return self._enqueue(
+            keys=[self.visible_key, self._job_key(job_id)],
+            args=[json.dumps(payload, ensure_ascii=False), max_attempts or _max_attempts(), time.time() + delay, job_id],
+        ) == 1
+
+    def lease(self, worker="", visibility_seconds=None):
+        token = uuid.uuid4().hex
+        row = self._lease(
+            keys=[self.visible_key, self.dead_key],
+            args=[time.time(), visibility_seconds or _visibility_seconds(), token, worker,
+                  self.prefix + "job:", "リース期間内に完了しませんでした"],
+        )
+        if not row:
+            return None
+        job_id, payload, attempts = row
+        return Job(job_id, json.loads(payload), int(attempts), token)
+
+    def extend(self, job, visibility_seconds=None):
+        return self._extend(
+            keys=[self.visible_key, self._job_key(job.id)],
+            args=[job.token, time.time() + (visibility_seconds or _visibility_seconds()), job.id],
+        ) == 1
+
+    def ack(self, job, result=None):
+        return self._ack(
+            keys=[self.visible_key, self._job_key(job.id)],
+            args=[job.token, json.dumps(result, ensure_ascii=False), job.id, self.done_ttl_seconds],
+        ) == 1
+
+    def nack(self, job, error="", delay=0.0):
+        now = time.time()
+        return self._nack(
+            keys=[self.visible_key, self._job_key(job.id), self.dead_key],
+            args=[job.token, str(error)[:500], now + delay, job.id, now],
+        ) == 1
+
+    def status(self, job_id):
+        fields = self.client.hgetall(self._job_key(job_id))
+        if not fields:
+            return None
+        return {
+            "state": fields.get("state"),
+            "attempts": int(fields.get("attempts", 0)),
+            "result": json.loads(fields["result"]) if fields.get("result") else None,
+            "error": fields.get("error"),
+        }
+
+    def dead_letters(self):
+        letters = []
+        for job_id in self.client.zrange(self.dead_key, 0, -1):
+            fields = self.client.hgetall(self._job_key(job_id))
+            if fields:
+                letters.append({"id": job_id, "payload": json.loads(fields["payload"]),
+                                "attempts": int(fields.get("attempts", 0)), "error": fields.get("error")})
+        return letters
+
+    def requeue(self, job_id):
+        if self.client.zrem(self.dead_key, job_id) != 1:
+            return False
+        self.client.hset(self._job_key(job_id), mapping={"state": "ready", "attempts": 0, "error": ""})
+        self.client.hdel(self._job_key(job_id), "error")
+        self.client.zadd(self.visible_key, {job_id: time.time()})
+        return True
+
+    def purge(self, older_than_seconds=7 * 86400):
+        # 完了したジョブは ack 時に有効期限を付けているので、デッドレターだけを消す
+        old = self.client.zrangebyscore(self.dead_key, "-inf", time.time() - older_than_seconds)
+        for job_id in old:
+            self.client.delete(self._job_key(job_id))
+            self.client.zrem(self.dead_key, job_id)
+        return len(old)
+
+    def close(self):
+        self.client.close()
+
+
+def open_queue(url=None):
+    """WORK_QUEUE_URL に応じたキューを開く"""
+    url = url or os.getenv("WORK_QUEUE_URL", "")
+    if url.startswith(("redis://", "rediss://", "unix://")):
+        return RedisQueue(url)
+    if url.startswith("sqlite:///"):
+        return SQLiteQueue(url[len("sqlite:///"):])
+    if url:
+        raise ValueError(f"未対応のキューのURLです: {url}")
+    return SQLiteQueue()